@@ -3,16 +3,163 @@ AI Backend Response Cache
 Implements intelligent caching for AI responses to improve performance and reduce costs
 """
 
-import redis
+import redis.asyncio as aioredis
+import asyncio
 import json
 import hashlib
 import logging
-from typing import Optional, Dict, Any, List
+import secrets
+import struct
+import sys
+import zlib
+from collections import OrderedDict
+from typing import Optional, Dict, Any, List, Tuple
 import time
 import os
 
+from similarity_index import SimilarityIndex
+
 logger = logging.getLogger(__name__)
 
+# Index keys: a set of models plus, per model, sorted sets of entry keys scored
+# by expiry time (ms). They replace KEYS scans, which block the Redis server.
+MODELS_INDEX = "ai_index:models"
+INDEX_BATCH_SIZE = 500
+
+# Similarity keys are also logged by write time (ms) so workers can pull
+# new entries whatever their TTL. Reads overlap the last sync to cover writes
+# still in flight and small clock differences; a worker idle for longer than
+# the log is kept reloads from the expiry index instead.
+SIMILARITY_LOG_RETENTION_MS = 600000
+SIMILARITY_LOG_OVERLAP_MS = 5000
+
+# Workers announce changed keys here so peers drop their local copies
+INVALIDATION_CHANNEL = "ai_cache:invalidate"
+
+# Binary entry format: magic, version and flags, then a UTF-8 text or JSON
+# body that is zlib-compressed when that makes it smaller
+ENTRY_MAGIC = b"AC"
+ENTRY_VERSION = 1
+FLAG_ZLIB = 0x01
+FLAG_JSON = 0x02
+_ENTRY_HEADER = struct.Struct(">2sBB")
+
+def normalize_prompt(prompt: str) -> str:
+    """Prompt text as it is keyed for caching and deduplication: case and whitespace folded"""
+    return " ".join(prompt.split()).lower()
+
+def encode_entry(value: Any, compress_min_bytes: int = 512) -> bytes:
+    """Serialize a cache value to the versioned binary entry format"""
+    if isinstance(value, str):
+        body, flags = value.encode('utf-8'), 0
+    else:
+        body, flags = json.dumps(value, separators=(',', ':')).encode('utf-8'), FLAG_JSON
+    
+    if len(body) >= compress_min_bytes:
+        compressed = zlib.compress(body, 6)
+        if len(compressed) < len(body):
+            body, flags = compressed, flags | FLAG_ZLIB
+    
+    return _ENTRY_HEADER.pack(ENTRY_MAGIC, ENTRY_VERSION, flags) + body
+
+def decode_entry(raw: bytes) -> Any:
+    """Deserialize a cache value, accepting entries written as JSON text before versioning"""
+    if raw[:2] != ENTRY_MAGIC:
+        return json.loads(raw)
+    
+    _, version, flags = _ENTRY_HEADER.unpack_from(raw)
+    if version != ENTRY_VERSION:
+        raise ValueError(f"Unsupported cache entry version: {version}")
+    body = raw[_ENTRY_HEADER.size:]
+    if flags & FLAG_ZLIB:
+        body = zlib.decompress(body)
+    return json.loads(body) if flags & FLAG_JSON else body.decode('utf-8')
+
+class LocalCacheTier:
+    """
+    In-process LRU of decoded cache entries, bounded by bytes.
+    
+    Entries expire when their Redis key does. Hot prompts are answered from
+    memory without a Redis round trip.
+    """
+    
+    def __init__(self, max_bytes: int = 32 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.entries: "OrderedDict[str, Tuple[Any, float, int]]" = OrderedDict()
+        self.bytes = 0
+        self._stats = {
+            'hits': 0,
+            'misses': 0,
+            'evictions': 0,
+            'expirations': 0,
+            'invalidations': 0
+        }
+    
+    def get(self, key: str, now: Optional[float] = None) -> Optional[Any]:
+        """Return a live entry and mark it recently used"""
+        entry = self.lookup(key, now)
+        return entry[0] if entry is not None else None
+    
+    def lookup(self, key: str, now: Optional[float] = None) -> Optional[Tuple[Any, float]]:
+        """Return (value, expires_at) for a live entry and mark it recently used"""
+        entry = self.entries.get(key)
+        if entry is None:
+            self._stats['misses'] += 1
+            return None
+        
+        value, expires_at, _ = entry
+        if expires_at <= (now or time.time()):
+            self._discard(key)
+            self._stats['expirations'] += 1
+            self._stats['misses'] += 1
+            return None
+        
+        self.entries.move_to_end(key)
+        self._stats['hits'] += 1
+        return value, expires_at
+    
+    def put(self, key: str, value: Any, ttl: float, now: Optional[float] = None):
+        """Store an entry for ttl seconds, evicting least recently used entries"""
+        self._discard(key)
+        size = sys.getsizeof(key) + sys.getsizeof(value)
+        if ttl <= 0 or size > self.max_bytes:
+            return
+        
+        self.entries[key] = (value, (now or time.time()) + ttl, size)
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+            self._discard(next(iter(self.entries)))
+            self._stats['evictions'] += 1
+    
+    def invalidate(self, key: str):
+        """Drop an entry that changed elsewhere"""
+        if self._discard(key):
+            self._stats['invalidations'] += 1
+    
+    def clear(self):
+        """Drop every entry"""
+        self._stats['invalidations'] += len(self.entries)
+        self.entries.clear()
+        self.bytes = 0
+    
+    def _discard(self, key: str) -> bool:
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return False
+        self.bytes -= entry[2]
+        return True
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Get local tier statistics"""
+        lookups = self._stats['hits'] + self._stats['misses']
+        return {
+            **self._stats,
+            'entries': len(self.entries),
+            'bytes': self.bytes,
+            'max_bytes': self.max_bytes,
+            'hit_rate': self._stats['hits'] / lookups if lookups else 0
+        }
+
 class AIResponseCache:
     """
     Intelligent caching system for AI responses with TTL and similarity matching
@@ -22,19 +169,37 @@ class AIResponseCache:
         self.redis_url = redis_url or os.getenv('REDIS_URL', 'redis://localhost:6379/0')
         self.redis = None
         self.default_ttl = int(os.getenv('CACHE_TTL', '3600'))  # 1 hour default
+        # Entries stay servable (as stale) this long past their TTL while a
+        # background refresh replaces them; Redis expires them after that
+        self.grace_period = int(os.getenv('CACHE_GRACE_PERIOD', '600'))
         self.similarity_threshold = float(os.getenv('SIMILARITY_THRESHOLD', '0.85'))
+        self.compress_min_bytes = int(os.getenv('CACHE_COMPRESS_MIN_BYTES', '512'))
+        self.similarity_dim = int(os.getenv('SIMILARITY_DIM', '512'))
+        self.similarity_max_entries = int(os.getenv('SIMILARITY_MAX_ENTRIES', '100000'))
+        # Seconds between pulls of other workers' entries into the local index
+        self.similarity_sync_interval = float(os.getenv('SIMILARITY_SYNC_INTERVAL', '5'))
+        self._similarity_indexes: Dict[str, SimilarityIndex] = {}
+        self._similarity_synced: Dict[str, Dict[str, float]] = {}
+        
+        # In-process tier in front of Redis; L1_CACHE_MAX_BYTES=0 disables it
+        l1_bytes = int(os.getenv('L1_CACHE_MAX_BYTES', str(32 * 1024 * 1024)))
+        self.local_tier = LocalCacheTier(l1_bytes) if l1_bytes > 0 else None
+        self._fills: Dict[str, asyncio.Future] = {}
+        self._instance_id = secrets.token_hex(4)
+        self._listener_task: Optional[asyncio.Task] = None
         self._stats = {
             'cache_hits': 0,
             'cache_misses': 0,
             'cache_sets': 0,
-            'cache_errors': 0
+            'cache_errors': 0,
+            'coalesced_fills': 0,
+            'stale_hits': 0
         }
     
     async def initialize(self):
         """Initialize Redis connection"""
         try:
-            import aioredis
-            self.redis = await aioredis.from_url(
+            self.redis = aioredis.from_url(
                 self.redis_url,
                 decode_responses=True,
                 socket_connect_timeout=5,
@@ -44,72 +209,221 @@ class AIResponseCache:
             
             # Test connection
             await self.redis.ping()
+            await self.start_invalidation_listener()
             logger.info("AI Response Cache initialized successfully")
             
         except Exception as e:
             logger.error(f"Failed to initialize cache: {e}")
             self.redis = None
     
-    def _get_cache_key(self, prompt: str, model: str = "gpt-3.5-turbo") -> str:
-        """Generate cache key for prompt and model"""
-        # Create a normalized prompt for better caching
-        normalized_prompt = prompt.strip().lower()
-        content = f"{normalized_prompt}:{model}"
+    def _get_cache_key(self, prompt: str, model: str = "gpt-3.5-turbo", **params) -> str:
+        """Generate cache key for prompt, model and generation parameters"""
+        # Normalized exactly as the deduplicator does, so both agree on what a repeat is
+        content = f"{normalize_prompt(prompt)}:{model}"
+        if params:
+            content += ":" + json.dumps(params, sort_keys=True, default=str)
         return f"ai_response:{hashlib.md5(content.encode()).hexdigest()}"
     
     def _get_similarity_key(self, prompt: str, model: str = "gpt-3.5-turbo") -> str:
         """Generate key for similarity search"""
-        normalized_prompt = prompt.strip().lower()
-        content = f"similarity:{normalized_prompt}:{model}"
+        content = f"similarity:{normalize_prompt(prompt)}:{model}"
         return f"ai_similarity:{hashlib.md5(content.encode()).hexdigest()}"
     
-    async def get(self, prompt: str, model: str = "gpt-3.5-turbo") -> Optional[str]:
+    def _response_index(self, model: str) -> str:
+        """Sorted set of live response keys for a model"""
+        return f"ai_index:responses:{model}"
+    
+    def _similarity_index(self, model: str) -> str:
+        """Sorted set of live similarity keys for a model"""
+        return f"ai_index:similarity:{model}"
+    
+    def _similarity_log(self, model: str) -> str:
+        """Sorted set of similarity keys for a model scored by write time"""
+        return f"ai_index:similarity_log:{model}"
+    
+    def _similarity_index_for(self, model: str) -> SimilarityIndex:
+        """Local similarity index for a model"""
+        if model not in self._similarity_indexes:
+            self._similarity_indexes[model] = SimilarityIndex(
+                dim=self.similarity_dim,
+                max_entries=self.similarity_max_entries
+            )
+        return self._similarity_indexes[model]
+    
+    async def get(self, prompt: str, model: str = "gpt-3.5-turbo", **params) -> Optional[str]:
         """
-        Get cached response for exact match
+        Get cached response for exact match.
+        Extra keyword arguments (max_tokens, temperature, context...) are part of the key.
+        Stale entries inside the grace period are returned as well.
+        """
+        entry = await self.get_entry(prompt, model, **params)
+        return entry[0] if entry is not None else None
+    
+    async def get_entry(self, prompt: str, model: str = "gpt-3.5-turbo", **params) -> Optional[Tuple[str, bool]]:
+        """
+        Get (response, stale) for an exact match.
+        
+        An entry is stale once its TTL has passed but its grace period has
+        not; callers should serve it and refresh it in the background.
         """
         if not self.redis:
             return None
         
         try:
-            key = self._get_cache_key(prompt, model)
-            cached = await self.redis.get(key)
+            key = self._get_cache_key(prompt, model, **params)
+            now = time.time()
             
-            if cached:
-                self._stats['cache_hits'] += 1
-                logger.debug(f"Cache hit for prompt: {prompt[:50]}...")
-                return json.loads(cached)
-            else:
+            cached = self.local_tier.lookup(key, now) if self.local_tier is not None else None
+            if cached is None:
+                # Coalesce concurrent lookups of the same key into one Redis read
+                fill = self._fills.get(key)
+                if fill is None:
+                    fill = asyncio.ensure_future(self._fill_from_redis(key))
+                    self._fills[key] = fill
+                    fill.add_done_callback(lambda done: self._forget_fill(key, done))
+                else:
+                    self._stats['coalesced_fills'] += 1
+                cached = await asyncio.shield(fill)
+            
+            if cached is None:
                 self._stats['cache_misses'] += 1
                 return None
+            
+            value, expires_at = cached
+            stale = expires_at - now < self.grace_period
+            self._stats['cache_hits'] += 1
+            if stale:
+                self._stats['stale_hits'] += 1
+            logger.debug(f"Cache {'stale hit' if stale else 'hit'} for prompt: {prompt[:50]}...")
+            return value, stale
                 
         except Exception as e:
             self._stats['cache_errors'] += 1
             logger.error(f"Cache get error: {e}")
             return None
     
-    async def set(self, prompt: str, response: str, model: str = "gpt-3.5-turbo", ttl: int = None):
+    def _forget_fill(self, key: str, fill: asyncio.Future):
+        """Drop a finished fill so the next miss reads Redis again"""
+        if self._fills.get(key) is fill:
+            del self._fills[key]
+    
+    async def _fill_from_redis(self, key: str) -> Optional[Tuple[Any, float]]:
+        """Read an entry and its hard expiry time from Redis, filling the local tier"""
+        if self.local_tier is None and self.grace_period <= 0:
+            cached = await self._get_raw(key)
+            return (decode_entry(cached), float('inf')) if cached is not None else None
+        
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.execute_command("GET", key, NEVER_DECODE=True)
+            pipe.pttl(key)
+            cached, ttl_ms = await pipe.execute()
+        
+        if cached is None:
+            return None
+        value = decode_entry(cached)
+        if ttl_ms < 0:
+            return value, float('inf')
+        if self.local_tier is not None:
+            self.local_tier.put(key, value, ttl_ms / 1000)
+        return value, time.time() + ttl_ms / 1000
+    
+    async def _get_raw(self, key: str) -> Optional[bytes]:
+        """GET an entry as bytes, bypassing the client's response decoding"""
+        return await self.redis.execute_command("GET", key, NEVER_DECODE=True)
+    
+    async def _mget_raw(self, keys: List[str]) -> List[Optional[bytes]]:
+        """MGET entries as bytes"""
+        return await self.redis.execute_command("MGET", *keys, NEVER_DECODE=True)
+    
+    def _publish_invalidation(self, pipe, key: str):
+        """Queue an invalidation notice for other workers on a pipeline"""
+        if self.local_tier is not None:
+            pipe.publish(INVALIDATION_CHANNEL, f"{self._instance_id} {key}")
+    
+    async def start_invalidation_listener(self):
+        """Subscribe to peer invalidations so the local tier never outlives a change"""
+        if self.redis is None or self.local_tier is None:
+            return
+        if self._listener_task is None or self._listener_task.done():
+            ready = asyncio.Event()
+            self._listener_task = asyncio.create_task(self._listen_for_invalidations(ready))
+            await asyncio.wait_for(ready.wait(), timeout=5)
+    
+    async def _listen_for_invalidations(self, ready: asyncio.Event):
+        """Drop local entries that other workers changed"""
+        while True:
+            pubsub = self.redis.pubsub()
+            try:
+                await pubsub.subscribe(INVALIDATION_CHANNEL)
+                ready.set()
+                while True:
+                    message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                    if message is None:
+                        continue
+                    origin, _, key = message['data'].partition(' ')
+                    if origin == self._instance_id:
+                        continue
+                    if key == '*':
+                        self.local_tier.clear()
+                    else:
+                        self.local_tier.invalidate(key)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Notices may have been missed while disconnected
+                logger.warning(f"Cache invalidation listener error: {e}")
+                self.local_tier.clear()
+                ready.set()
+                await asyncio.sleep(1)
+            finally:
+                try:
+                    await pubsub.aclose()
+                except Exception:
+                    pass
+    
+    async def set(self, prompt: str, response: str, model: str = "gpt-3.5-turbo", ttl: int = None, **params):
         """
-        Cache response with TTL
+        Cache response with TTL; the entry goes stale after ttl seconds and
+        expires after the grace period on top of that
         """
         if not self.redis:
             return
         
         try:
-            key = self._get_cache_key(prompt, model)
+            key = self._get_cache_key(prompt, model, **params)
             ttl = ttl or self.default_ttl
-            
-            # Store the response
-            await self.redis.setex(key, ttl, json.dumps(response))
-            
-            # Also store for similarity matching
+            # Keys outlive the soft TTL by the grace period so stale answers
+            # can be served while they are refreshed
+            lifetime = ttl + max(0, self.grace_period)
             similarity_key = self._get_similarity_key(prompt, model)
+            # The similarity entry references the response by its key rather
+            # than holding a second copy of it
             similarity_data = {
                 'prompt': prompt,
-                'response': response,
-                'timestamp': time.time()
+                'model': model,
+                'timestamp': time.time(),
+                'response_key': key
             }
-            await self.redis.setex(similarity_key, ttl * 2, json.dumps(similarity_data))  # Longer TTL for similarity
+            now_ms = int(time.time() * 1000)
+            
+            async with self.redis.pipeline(transaction=False) as pipe:
+                pipe.set(key, encode_entry(response, self.compress_min_bytes), ex=lifetime)
+                pipe.set(similarity_key, encode_entry(similarity_data, self.compress_min_bytes), ex=lifetime)
+                
+                # Index both entries by expiry and drop entries that have expired
+                for index, entry in ((self._response_index(model), key),
+                                     (self._similarity_index(model), similarity_key)):
+                    pipe.zadd(index, {entry: now_ms + lifetime * 1000})
+                    pipe.zremrangebyscore(index, "-inf", now_ms)
+                    pipe.expire(index, lifetime * 2)
+                self._log_similarity_key(pipe, model, similarity_key, now_ms)
+                pipe.sadd(MODELS_INDEX, model)
+                self._publish_invalidation(pipe, key)
+                await pipe.execute()
             
+            if self.local_tier is not None:
+                self.local_tier.put(key, response, lifetime)
+            self._similarity_index_for(model).add(similarity_key, prompt, now_ms / 1000 + lifetime, now=now_ms / 1000)
             self._stats['cache_sets'] += 1
             logger.debug(f"Cached response for prompt: {prompt[:50]}...")
             
@@ -119,58 +433,106 @@ class AIResponseCache:
     
     async def get_similar(self, prompt: str, model: str = "gpt-3.5-turbo", max_results: int = 3) -> List[Dict[str, Any]]:
         """
-        Get similar cached responses using simple keyword matching
+        Get cached responses to near-duplicate prompts.
+        
+        Candidates come from the in-process similarity index (TF-IDF cosine
+        over hashed n-grams with an LSH prefilter); only the matches are
+        fetched from Redis.
         """
         if not self.redis:
             return []
         
         try:
-            # Get all similarity keys for this model
-            pattern = f"ai_similarity:*:{model}"
-            keys = await self.redis.keys(pattern)
-            
-            if not keys:
+            await self._sync_similarity_index(model)
+            index = self._similarity_index_for(model)
+            matches = index.query(prompt, self.similarity_threshold, max_results, now=time.time())
+            if not matches:
                 return []
             
-            similar_responses = []
-            prompt_words = set(prompt.lower().split())
-            
-            for key in keys[:100]:  # Limit to prevent excessive processing
-                try:
-                    cached_data = await self.redis.get(key)
-                    if cached_data:
-                        data = json.loads(cached_data)
-                        cached_prompt = data.get('prompt', '').lower()
-                        
-                        # Simple keyword similarity
-                        cached_words = set(cached_prompt.split())
-                        
-                        # Calculate Jaccard similarity
-                        intersection = len(prompt_words.intersection(cached_words))
-                        union = len(prompt_words.union(cached_words))
-                        similarity = intersection / union if union > 0 else 0
-                        
-                        if similarity >= self.similarity_threshold:
-                            similar_responses.append({
-                                'response': data.get('response'),
-                                'similarity': similarity,
-                                'prompt': data.get('prompt'),
-                                'timestamp': data.get('timestamp')
-                            })
-                
-                except Exception as e:
-                    logger.debug(f"Error processing similarity key {key}: {e}")
+            keys = [key for key, _ in matches]
+            found = []
+            for (key, similarity), raw in zip(matches, await self._mget_raw(keys)):
+                if raw is None:
+                    # Expired or evicted in Redis since it was indexed
+                    index.remove(key)
                     continue
+                found.append((key, similarity, decode_entry(raw)))
+            
+            # Resolve response references in one more MGET
+            references = [data['response_key'] for _, _, data in found if 'response_key' in data]
+            responses = dict(zip(references, await self._mget_raw(references))) if references else {}
             
-            # Sort by similarity and return top results
-            similar_responses.sort(key=lambda x: x['similarity'], reverse=True)
-            return similar_responses[:max_results]
+            similar_responses = []
+            for key, similarity, data in found:
+                if 'response_key' in data:
+                    raw = responses.get(data['response_key'])
+                    if raw is None:
+                        continue
+                    response = decode_entry(raw)
+                else:
+                    # Entries written before responses were stored once
+                    response = data.get('response')
+                similar_responses.append({
+                    'response': response,
+                    'similarity': similarity,
+                    'prompt': data.get('prompt'),
+                    'timestamp': data.get('timestamp')
+                })
+            
+            return similar_responses
             
         except Exception as e:
             logger.error(f"Similarity search error: {e}")
             return []
     
-    async def invalidate(self, prompt: str, model: str = "gpt-3.5-turbo"):
+    def _log_similarity_key(self, pipe, model: str, similarity_key: str, now_ms: int):
+        """Queue a similarity key on the model's write log, trimming old writes"""
+        log = self._similarity_log(model)
+        pipe.zadd(log, {similarity_key: now_ms})
+        pipe.zremrangebyscore(log, "-inf", now_ms - SIMILARITY_LOG_RETENTION_MS)
+        pipe.pexpire(log, SIMILARITY_LOG_RETENTION_MS)
+    
+    async def _sync_similarity_index(self, model: str):
+        """
+        Pull entries written by other workers into the local similarity index.
+        
+        Entries written since the last sync come from the write log; the
+        first sync, or one after the log has moved past the last, loads every
+        live entry from the expiry index.
+        """
+        now = time.time()
+        now_ms = int(now * 1000)
+        synced = self._similarity_synced.setdefault(model, {'at': 0.0, 'high_water': 0})
+        if now - synced['at'] < self.similarity_sync_interval:
+            return
+        synced['at'] = now
+        
+        if now_ms - synced['high_water'] > SIMILARITY_LOG_RETENTION_MS - SIMILARITY_LOG_OVERLAP_MS:
+            source, low = self._similarity_index(model), f"({now_ms}"
+        else:
+            source, low = self._similarity_log(model), synced['high_water'] - SIMILARITY_LOG_OVERLAP_MS
+        
+        index = self._similarity_index_for(model)
+        offset = 0
+        while True:
+            keys = await self.redis.zrangebyscore(source, low, "+inf", start=offset, num=INDEX_BATCH_SIZE)
+            if not keys:
+                break
+            offset += len(keys)
+            
+            missing = [key for key in keys if key not in index]
+            if not missing:
+                continue
+            async with self.redis.pipeline(transaction=False) as pipe:
+                pipe.execute_command("MGET", *missing, NEVER_DECODE=True)
+                pipe.zmscore(self._similarity_index(model), missing)
+                payloads, expiries = await pipe.execute()
+            for key, payload, expires_ms in zip(missing, payloads, expiries):
+                if payload and expires_ms and expires_ms > now_ms:
+                    index.add(key, decode_entry(payload).get('prompt', ''), expires_ms / 1000, now=now)
+        synced['high_water'] = now_ms
+    
+    async def invalidate(self, prompt: str, model: str = "gpt-3.5-turbo", **params):
         """
         Invalidate cached response for a prompt
         """
@@ -178,11 +540,19 @@ class AIResponseCache:
             return
         
         try:
-            key = self._get_cache_key(prompt, model)
+            key = self._get_cache_key(prompt, model, **params)
             similarity_key = self._get_similarity_key(prompt, model)
             
-            await self.redis.delete(key)
-            await self.redis.delete(similarity_key)
+            async with self.redis.pipeline(transaction=False) as pipe:
+                pipe.delete(key, similarity_key)
+                pipe.zrem(self._response_index(model), key)
+                pipe.zrem(self._similarity_index(model), similarity_key)
+                pipe.zrem(self._similarity_log(model), similarity_key)
+                self._publish_invalidation(pipe, key)
+                await pipe.execute()
+            if self.local_tier is not None:
+                self.local_tier.invalidate(key)
+            self._similarity_index_for(model).remove(similarity_key)
             
             logger.debug(f"Invalidated cache for prompt: {prompt[:50]}...")
             
@@ -197,19 +567,101 @@ class AIResponseCache:
             return
         
         try:
-            # Delete all AI response keys
-            patterns = ["ai_response:*", "ai_similarity:*"]
+            # Delete indexed entries in bounded batches, then the indexes themselves
+            models = await self.redis.smembers(MODELS_INDEX)
+            for model in models:
+                for index in (self._response_index(model), self._similarity_index(model)):
+                    while True:
+                        keys = await self.redis.zrange(index, 0, INDEX_BATCH_SIZE - 1)
+                        if not keys:
+                            break
+                        async with self.redis.pipeline(transaction=False) as pipe:
+                            pipe.unlink(*keys)
+                            pipe.zrem(index, *keys)
+                            await pipe.execute()
+                await self.redis.unlink(self._similarity_log(model))
+            await self.redis.unlink(MODELS_INDEX)
+            for index in self._similarity_indexes.values():
+                index.clear()
+            if self.local_tier is not None:
+                self.local_tier.clear()
+                await self.redis.publish(INVALIDATION_CHANNEL, f"{self._instance_id} *")
             
-            for pattern in patterns:
-                keys = await self.redis.keys(pattern)
-                if keys:
-                    await self.redis.delete(*keys)
+            # Sweep up entries the indexes do not know about (written before
+            # indexing existed, or whose index expired) without blocking Redis
+            for pattern in ("ai_response:*", "ai_similarity:*"):
+                await self._scan_delete(pattern)
             
             logger.info("Cleared all cached AI responses")
             
         except Exception as e:
             logger.error(f"Cache clear error: {e}")
     
+    async def _scan_delete(self, pattern: str) -> int:
+        """Incrementally delete keys matching pattern using SCAN"""
+        deleted = 0
+        batch = []
+        async for key in self.redis.scan_iter(match=pattern, count=INDEX_BATCH_SIZE):
+            batch.append(key)
+            if len(batch) >= INDEX_BATCH_SIZE:
+                deleted += await self.redis.unlink(*batch)
+                batch = []
+        if batch:
+            deleted += await self.redis.unlink(*batch)
+        return deleted
+    
+    async def rebuild_index(self, model: str = "gpt-3.5-turbo") -> int:
+        """
+        Rebuild the indexes from a SCAN of the keyspace.
+        
+        Use after upgrading from an unindexed cache or losing the index keys.
+        Entries that do not record their model are attributed to `model`.
+        Returns the number of entries indexed.
+        """
+        if not self.redis:
+            return 0
+        
+        indexed = 0
+        now_ms = int(time.time() * 1000)
+        for pattern in ("ai_response:*", "ai_similarity:*"):
+            batch = []
+            async for key in self.redis.scan_iter(match=pattern, count=INDEX_BATCH_SIZE):
+                batch.append(key)
+                if len(batch) >= INDEX_BATCH_SIZE:
+                    indexed += await self._index_existing(batch, model, now_ms)
+                    batch = []
+            if batch:
+                indexed += await self._index_existing(batch, model, now_ms)
+        
+        logger.info(f"Rebuilt cache index with {indexed} entries")
+        return indexed
+    
+    async def _index_existing(self, keys: List[str], model: str, now_ms: int) -> int:
+        """Add already-stored entries to their model's index using their remaining TTL"""
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for key in keys:
+                pipe.pttl(key)
+                pipe.execute_command("GET", key, NEVER_DECODE=True)
+            replies = await pipe.execute()
+        
+        indexed = 0
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for key, ttl_ms, value in zip(keys, replies[::2], replies[1::2]):
+                if value is None or ttl_ms < 0:
+                    continue  # Expired meanwhile, or persistent keys we did not write
+                if key.startswith("ai_similarity:"):
+                    entry_model = decode_entry(value).get('model', model)
+                    index = self._similarity_index(entry_model)
+                    self._log_similarity_key(pipe, entry_model, key, now_ms)
+                else:
+                    entry_model = model
+                    index = self._response_index(entry_model)
+                pipe.zadd(index, {key: now_ms + ttl_ms})
+                pipe.sadd(MODELS_INDEX, entry_model)
+                indexed += 1
+            await pipe.execute()
+        return indexed
+    
     async def get_stats(self) -> Dict[str, Any]:
         """
         Get cache statistics
@@ -225,26 +677,43 @@ class AIResponseCache:
                     'redis_connected_clients': info.get('connected_clients', 0),
                     'redis_total_commands': info.get('total_commands_processed', 0)
                 })
+            except Exception as e:
+                # INFO is often disabled on managed Redis; sizes still come from the index
+                logger.debug(f"Redis INFO unavailable: {e}")
+            
+            try:
+                # Count live entries from the per-model indexes: O(models * log N)
+                models = sorted(await self.redis.smembers(MODELS_INDEX))
+                now_ms = int(time.time() * 1000)
+                async with self.redis.pipeline(transaction=False) as pipe:
+                    for model in models:
+                        pipe.zcount(self._response_index(model), now_ms, "+inf")
+                        pipe.zcount(self._similarity_index(model), now_ms, "+inf")
+                    counts = await pipe.execute()
                 
-                # Get cache size
-                response_keys = await self.redis.keys("ai_response:*")
-                similarity_keys = await self.redis.keys("ai_similarity:*")
+                response_count = sum(counts[::2])
+                similarity_count = sum(counts[1::2])
                 stats.update({
-                    'cached_responses': len(response_keys),
-                    'cached_similarities': len(similarity_keys),
-                    'total_cached_items': len(response_keys) + len(similarity_keys)
+                    'cached_responses': response_count,
+                    'cached_similarities': similarity_count,
+                    'total_cached_items': response_count + similarity_count,
+                    'cached_responses_by_model': dict(zip(models, counts[::2]))
                 })
-                
-                # Calculate hit rate
-                total_requests = stats['cache_hits'] + stats['cache_misses']
-                stats['hit_rate'] = (
-                    stats['cache_hits'] / total_requests
-                    if total_requests > 0 else 0
-                )
+                stats['similarity_index_entries'] = sum(len(index) for index in self._similarity_indexes.values())
                 
             except Exception as e:
                 logger.error(f"Error getting cache stats: {e}")
         
+        if self.local_tier is not None:
+            stats['l1'] = self.local_tier.get_stats()
+        
+        # Calculate hit rate
+        total_requests = stats['cache_hits'] + stats['cache_misses']
+        stats['hit_rate'] = (
+            stats['cache_hits'] / total_requests
+            if total_requests > 0 else 0
+        )
+        
         return stats
     
     def reset_stats(self):
@@ -253,13 +722,24 @@ class AIResponseCache:
             'cache_hits': 0,
             'cache_misses': 0,
             'cache_sets': 0,
-            'cache_errors': 0
+            'cache_errors': 0,
+            'coalesced_fills': 0,
+            'stale_hits': 0
         }
     
     async def close(self):
-        """Close Redis connection"""
+        """Stop the invalidation listener and close the Redis connection"""
+        if (self._listener_task and not self._listener_task.done()
+                and self._listener_task.get_loop() is asyncio.get_running_loop()):
+            self._listener_task.cancel()
+            try:
+                await self._listener_task
+            except asyncio.CancelledError:
+                pass
+        self._listener_task = None
+        
         if self.redis:
-            await self.redis.close()
+            await self.redis.aclose()
             logger.info("AI Response Cache closed")
 
 # Global cache instance
@@ -0,0 +1,256 @@
+"""
+AI Backend Cache Warmer
+Pre-populates the response cache with answers to predictable questions about each docs page
+"""
+
+import argparse
+import asyncio
+import html
+import json
+import logging
+import os
+import re
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import yaml
+
+from cache import get_cache, close_cache
+from connection_manager import close_connection_pool
+from deduplicator import close_deduplicator
+from scheduler import PRIORITY_BULK, close_scheduler
+import main
+
+logger = logging.getLogger(__name__)
+
+# Questions offered as one-click suggestions in the chat widget. Keep in sync
+# with SUGGESTED_QUESTIONS in docs/javascripts/ai-assistant.js: the cache key
+# is the exact (normalized) question, so only these can be warmed.
+WARM_QUESTIONS = (
+    "What is this page about?",
+    "Summarize the key steps on this page.",
+    "What should I set up before following this page?",
+)
+
+# getWindowContext() truncates the joined headings to this many characters
+HEADINGS_MAX_CHARS = 500
+
+# Text toc's permalink option appends to every rendered heading
+PERMALINK = "¶"
+
+_FRONT_MATTER_RE = re.compile(r"\A---\s*\n(.*?)\n---\s*\n", re.DOTALL)
+_FENCE_RE = re.compile(r"^\s*(```|~~~)")
+_ATX_RE = re.compile(r"^(#{1,3})\s+(.*?)(?:\s+#+)?\s*$")
+_HTML_HEADING_RE = re.compile(r"<h([1-3])\b[^>]*>(.*?)</h\1>", re.IGNORECASE | re.DOTALL)
+
+class DocsPage(NamedTuple):
+    """A rendered docs page as getWindowContext() sees it"""
+    path: str
+    title: str
+    url: str
+    headings: str
+
+    @property
+    def context(self) -> Dict[str, str]:
+        """The chat context sent by the widget, without its timestamp"""
+        return {"page_title": self.title, "page_url": self.url, "headings": self.headings}
+
+def inline_text(markdown: str) -> str:
+    """Approximate the textContent of rendered inline markdown"""
+    text = re.sub(r"\s*\{[^}]*\}\s*$", "", markdown)           # attr_list
+    text = re.sub(r"!\[[^\]]*\]\([^)]*\)", "", text)            # images
+    text = re.sub(r"\[([^\]]*)\]\([^)]*\)", r"\1", text)        # links
+    text = re.sub(r":[a-z0-9_+-]+:", "", text)                  # emoji shortcodes
+    text = re.sub(r"<[^>]+>", "", text)                         # inline HTML
+    text = re.sub(r"(\*\*|\*|`|~~|==)(.+?)\1", r"\2", text)
+    text = re.sub(r"(?<!\w)(__|_)(.+?)\1(?!\w)", r"\2", text)     # no intraword emphasis
+    text = re.sub(r"\\(.)", r"\1", text)
+    return html.unescape(text).strip()
+
+def extract_headings(markdown: str) -> List[Tuple[int, str]]:
+    """(level, text) for every h1-h3 in a page, skipping fenced code blocks"""
+    headings = []
+    in_fence = None
+    for line in markdown.splitlines():
+        fence = _FENCE_RE.match(line)
+        if fence:
+            if in_fence is None:
+                in_fence = fence.group(1)
+            elif fence.group(1) == in_fence:
+                in_fence = None
+            continue
+        if in_fence:
+            continue
+
+        atx = _ATX_RE.match(line)
+        if atx:
+            headings.append((len(atx.group(1)), inline_text(atx.group(2))))
+            continue
+        for level, body in _HTML_HEADING_RE.findall(line):
+            headings.append((int(level), inline_text(body)))
+    return headings
+
+def js_substring(text: str, length: int) -> str:
+    """String.prototype.substring(0, length): JavaScript counts UTF-16 code units"""
+    encoded = text.encode('utf-16-le', 'surrogatepass')
+    return encoded[:length * 2].decode('utf-16-le', 'ignore')
+
+def page_url(path: str) -> str:
+    """URL path of a page with MkDocs' default use_directory_urls"""
+    stem = path[:-len(".md")]
+    if stem == "index":
+        return "/"
+    if stem.endswith("/index"):
+        return f"/{stem[:-len('/index')]}/"
+    return f"/{stem}/"
+
+def nav_titles(nav: Optional[Iterable]) -> Dict[str, str]:
+    """Map page paths to the titles given to them in mkdocs.yml's nav"""
+    titles = {}
+    for item in nav or ():
+        if isinstance(item, dict):
+            for title, value in item.items():
+                if isinstance(value, str):
+                    titles[value] = title
+                else:
+                    titles.update(nav_titles(value))
+    return titles
+
+def render_page(path: str, markdown: str, site_name: str, nav_title: Optional[str] = None) -> DocsPage:
+    """
+    Reproduce the page context the chat widget reads from a rendered page.
+
+    The title follows MkDocs (nav title, front matter, first H1, file name)
+    and Material's <title> template; headings carry toc's permalink marker,
+    and Material adds an H1 with the page title when the page has none.
+    """
+    meta = {}
+    front_matter = _FRONT_MATTER_RE.match(markdown)
+    if front_matter:
+        meta = yaml.safe_load(front_matter.group(1)) or {}
+        markdown = markdown[front_matter.end():]
+    headings = extract_headings(markdown)
+
+    first_h1 = next((text for level, text in headings if level == 1), None)
+    name = Path(path).parent.name if Path(path).stem == "index" else Path(path).stem
+    fallback = name.replace('-', ' ').replace('_', ' ')
+    title = nav_title or meta.get('title') or first_h1 or (fallback.capitalize() if fallback.islower() else fallback)
+
+    if meta.get('title'):
+        document_title = f"{meta['title']} - {site_name}"
+    elif path == "index.md":
+        document_title = site_name
+    else:
+        document_title = f"{title} - {site_name}"
+
+    lines = [f"{text}{PERMALINK}" for _, text in headings]
+    if first_h1 is None:
+        lines.insert(0, title)
+    return DocsPage(path, document_title, page_url(path), js_substring("\n".join(lines), HEADINGS_MAX_CHARS))
+
+def load_docs_pages(docs_root: Path, mkdocs_config: Optional[Path] = None) -> List[DocsPage]:
+    """Every markdown page under docs_root, in path order"""
+    site_name, titles = "", {}
+    if mkdocs_config and mkdocs_config.exists():
+        with open(mkdocs_config) as f:
+            config = yaml.safe_load(f) or {}
+        site_name = config.get('site_name', '')
+        titles = nav_titles(config.get('nav'))
+
+    pages = []
+    for file in sorted(docs_root.rglob("*.md")):
+        path = file.relative_to(docs_root).as_posix()
+        pages.append(render_page(path, file.read_text(encoding='utf-8'), site_name, titles.get(path)))
+    return pages
+
+class CacheWarmer:
+    """
+    Answers WARM_QUESTIONS for every docs page and stores them in the
+    response cache under the same keys /api/ai/chat looks up.
+
+    Generation goes through main's single-flight path and OpenAI connection
+    pool, with at most `concurrency` questions in flight. Questions that
+    already have a fresh cached answer are skipped.
+    """
+
+    def __init__(self, concurrency: int = 4, questions: Iterable[str] = WARM_QUESTIONS):
+        self.concurrency = concurrency
+        self.questions = tuple(questions)
+        self._stats = {
+            'pages': 0,
+            'questions': 0,
+            'warmed': 0,
+            'skipped': 0,
+            'failed': 0,
+            'duration_seconds': 0.0
+        }
+
+    def cache_params(self, page: DocsPage) -> Dict[str, Any]:
+        """Cache key parameters for a chat question on a page"""
+        return {
+            "max_tokens": main.CHAT_MAX_TOKENS,
+            "temperature": main.AI_TEMPERATURE,
+            "context": main.chat_page_context(page.context)
+        }
+
+    async def warm(self, pages: List[DocsPage]) -> Dict[str, Any]:
+        """Warm every (page, question) pair and return the run statistics"""
+        start_time = time.time()
+        semaphore = asyncio.Semaphore(self.concurrency)
+        cache = await get_cache()
+
+        async def warm_one(page: DocsPage, question: str):
+            async with semaphore:
+                params = self.cache_params(page)
+                entry = await cache.get_entry(question, main.AI_MODEL, **params)
+                if entry is not None and not entry[1]:
+                    self._stats['skipped'] += 1
+                    return
+                messages = main.build_chat_messages(question, params["context"])
+                try:
+                    await main._generate_once(question, params,
+                                              lambda: main.call_openai(messages, max_tokens=main.CHAT_MAX_TOKENS,
+                                                                        priority=PRIORITY_BULK))
+                    self._stats['warmed'] += 1
+                except Exception as e:
+                    self._stats['failed'] += 1
+                    logger.warning(f"Cache warming failed for {page.path}: {e}")
+
+        self._stats['pages'] += len(pages)
+        self._stats['questions'] += len(pages) * len(self.questions)
+        await asyncio.gather(*(warm_one(page, question) for page in pages for question in self.questions))
+        self._stats['duration_seconds'] += round(time.time() - start_time, 3)
+        return self.get_stats()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get warming statistics"""
+        return self._stats.copy()
+
+async def run(docs_root: Path, mkdocs_config: Path, concurrency: int, dry_run: bool = False) -> Dict[str, Any]:
+    """Warm the cache for a docs tree, closing shared clients afterwards"""
+    pages = load_docs_pages(docs_root, mkdocs_config)
+    if dry_run:
+        return {"pages": [page._asdict() for page in pages], "questions": list(WARM_QUESTIONS)}
+    if not main.Config.ai_configured():
+        raise SystemExit(f"OPENAI_API_KEY is not configured for LLM provider '{main.Config.LLM_PROVIDER}'")
+
+    try:
+        return await CacheWarmer(concurrency).warm(pages)
+    finally:
+        await close_cache()
+        await close_deduplicator()
+        await close_connection_pool()
+        close_scheduler()
+
+if __name__ == "__main__":
+    repo_root = Path(__file__).resolve().parent.parent
+    parser = argparse.ArgumentParser(description="Pre-populate the AI response cache from the docs corpus")
+    parser.add_argument("--docs", type=Path, default=repo_root / "docs")
+    parser.add_argument("--mkdocs-config", type=Path, default=repo_root / "mkdocs.yml")
+    parser.add_argument("--concurrency", type=int, default=int(os.getenv('CACHE_WARM_CONCURRENCY', '4')))
+    parser.add_argument("--dry-run", action="store_true", help="print the page contexts and questions only")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    print(json.dumps(asyncio.run(run(args.docs, args.mkdocs_config, args.concurrency, args.dry_run)), indent=2))
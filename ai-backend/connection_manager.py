@@ -5,28 +5,258 @@ Handles connection pooling and optimization for external API calls
 
 import aiohttp
 import asyncio
+import json
 import logging
+import math
 import os
-from typing import Optional, Dict, Any
+from collections import deque
+from typing import Optional, Dict, Any, AsyncIterator
 import time
 
 logger = logging.getLogger(__name__)
 
+class UpstreamError(Exception):
+    """Raised when the upstream API returns an error status"""
+    
+    def __init__(self, status_code: int, error: str):
+        super().__init__(f"Upstream error {status_code}: {error}")
+        self.status_code = status_code
+        self.error = error
+
+class UpstreamOverloadedError(UpstreamError):
+    """Raised when a request is shed because the upstream is overloaded or failing"""
+    
+    def __init__(self, retry_after: int, error: str = "Upstream concurrency limit reached"):
+        super().__init__(503, error)
+        self.retry_after = retry_after
+
+# Responses that mean the upstream is overloaded; they shrink the limit
+OVERLOAD_STATUSES = {408, 429, 502, 503, 504}
+
+# Successful latencies needed before hedging trusts its p95 estimate
+HEDGE_MIN_SAMPLES = 20
+
+def is_upstream_failure(status_code: int) -> bool:
+    """Whether a status says the upstream, rather than the request, is at fault"""
+    return status_code >= 500 or status_code in (408, 429)
+
+def output_token_latency(result: Dict[str, Any]) -> Optional[float]:
+    """Seconds per completion token of a successful call, or None without usage data"""
+    if not result['success'] or not isinstance(result.get('data'), dict):
+        return None
+    tokens = (result['data'].get('usage') or {}).get('completion_tokens')
+    return result['response_time'] / tokens if tokens else None
+
+class CircuitBreaker:
+    """
+    Fails upstream calls fast while the upstream is down.
+    
+    After `failure_threshold` consecutive failures the circuit opens and
+    calls are rejected for `reset_timeout` seconds. It then half-opens and
+    lets a single probe through: success closes the circuit, failure opens
+    it for another period.
+    """
+    
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+    
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._stats = {
+            'opens': 0,
+            'rejections': 0,
+            'probes': 0
+        }
+    
+    def allow(self) -> bool:
+        """Whether a call may go upstream now"""
+        if self.state == self.OPEN:
+            if time.monotonic() - self._opened_at < self.reset_timeout:
+                self._stats['rejections'] += 1
+                return False
+            self.state = self.HALF_OPEN
+            self._probe_in_flight = False
+        
+        if self.state == self.HALF_OPEN:
+            if self._probe_in_flight:
+                self._stats['rejections'] += 1
+                return False
+            self._probe_in_flight = True
+            self._stats['probes'] += 1
+        return True
+    
+    def record(self, success: bool):
+        """Record the outcome of an allowed call"""
+        self._probe_in_flight = False
+        if success:
+            self.consecutive_failures = 0
+            self.state = self.CLOSED
+            return
+        
+        self.consecutive_failures += 1
+        if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                self._stats['opens'] += 1
+                logger.warning(f"Upstream circuit opened after {self.consecutive_failures} failures")
+            self.state = self.OPEN
+            self._opened_at = time.monotonic()
+    
+    def abandon(self):
+        """An allowed call ended without an upstream verdict (cancelled or shed)"""
+        self._probe_in_flight = False
+    
+    def retry_after(self) -> int:
+        """Whole seconds until the circuit will next let a probe through"""
+        remaining = self._opened_at + self.reset_timeout - time.monotonic()
+        return max(1, math.ceil(remaining))
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Get circuit breaker statistics"""
+        return {
+            **self._stats,
+            'state': self.state,
+            'consecutive_failures': self.consecutive_failures
+        }
+    
+    def reset_stats(self):
+        """Reset statistics"""
+        self._stats = {key: 0 for key in self._stats}
+
+class AdaptiveConcurrencyLimiter:
+    """
+    AIMD concurrency limit driven by upstream latency and status codes.
+    
+    Latency is judged per unit of work, since LLM completion time grows
+    with output length: time to first byte for streams, seconds per output
+    token for completed calls. The baseline is a slowly rising minimum of
+    that signal. A response within `latency_tolerance` times the baseline
+    grows the limit additively while at least half of it is in use; an
+    overload status or a slower response multiplies it by `backoff`, at
+    most once per round trip so a burst of failures from one window counts
+    once. Calls without a latency signal are judged by status alone.
+    Requests beyond the limit are rejected immediately rather than queued
+    behind a slow upstream.
+    """
+    
+    def __init__(self, initial_limit: int = 10, min_limit: int = 1, max_limit: int = 10,
+                 latency_tolerance: float = 2.0, backoff: float = 0.7):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_tolerance = latency_tolerance
+        self.backoff = backoff
+        self.limit = float(min(max(initial_limit, min_limit), max_limit))
+        self.in_flight = 0
+        self.baseline_latency: Optional[float] = None
+        self.smoothed_rtt: Optional[float] = None
+        self._last_decrease = 0.0
+        self._stats = {
+            'admitted': 0,
+            'shed': 0,
+            'increases': 0,
+            'decreases': 0
+        }
+    
+    def try_acquire(self) -> bool:
+        """Take a slot if the current limit allows it"""
+        if self.in_flight >= int(self.limit):
+            self._stats['shed'] += 1
+            return False
+        self.in_flight += 1
+        self._stats['admitted'] += 1
+        return True
+    
+    def release(self, latency: Optional[float], status_code: Optional[int],
+                response_time: Optional[float] = None):
+        """
+        Free a slot and adjust the limit from the request's outcome.
+        
+        `latency` is the congestion signal, or None when the call offers
+        none; `response_time`, defaulting to `latency`, is the full round
+        trip used for retry hints.
+        """
+        self.in_flight -= 1
+        if status_code is None:
+            return  # Cancelled before the upstream answered; no signal
+        
+        response_time = latency if response_time is None else response_time
+        if response_time is not None:
+            self.smoothed_rtt = (response_time if self.smoothed_rtt is None
+                                 else 0.8 * self.smoothed_rtt + 0.2 * response_time)
+        
+        slow = False
+        if latency is not None:
+            if self.baseline_latency is None or latency < self.baseline_latency:
+                self.baseline_latency = latency
+            else:
+                # Let the baseline follow a lasting shift in upstream latency
+                self.baseline_latency += 0.01 * (latency - self.baseline_latency)
+            slow = latency > self.latency_tolerance * self.baseline_latency
+        
+        now = time.monotonic()
+        if status_code in OVERLOAD_STATUSES or slow:
+            if now - self._last_decrease >= (self.smoothed_rtt or 0):
+                self.limit = max(self.min_limit, self.limit * self.backoff)
+                self._last_decrease = now
+                self._stats['decreases'] += 1
+        elif 2 * (self.in_flight + 1) >= self.limit:
+            # Only grow while at least half the limit is in use
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self._stats['increases'] += 1
+    
+    def retry_after(self) -> int:
+        """Whole seconds a shed client should wait: about one upstream round trip"""
+        return max(1, math.ceil(self.smoothed_rtt or 1))
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Get limiter statistics"""
+        return {
+            **self._stats,
+            'limit': int(self.limit),
+            'in_flight': self.in_flight,
+            'baseline_latency': self.baseline_latency,
+            'smoothed_rtt': self.smoothed_rtt
+        }
+    
+    def reset_stats(self):
+        """Reset statistics"""
+        self._stats = {key: 0 for key in self._stats}
+
 class OpenAIConnectionPool:
     """
     Manages HTTP connections to OpenAI API with connection pooling and optimization
     """
     
-    def __init__(self, max_connections: int = 10, timeout: int = 30):
+    def __init__(self, max_connections: int = 10, timeout: int = 30, adaptive: bool = True,
+                 latency_tolerance: float = 2.0, breaker: Optional[CircuitBreaker] = None,
+                 hedge: bool = False):
         self.max_connections = max_connections
         self.timeout = timeout
+        self.limiter = AdaptiveConcurrencyLimiter(
+            initial_limit=max_connections,
+            max_limit=max_connections,
+            latency_tolerance=latency_tolerance
+        ) if adaptive else None
+        self.breaker = breaker
+        # Send a second attempt when the first outlives the p95 latency
+        self.hedge = hedge
+        self._latencies = deque(maxlen=200)
         self.connector = None
         self.session = None
         self._stats = {
             'requests_made': 0,
             'connection_reuses': 0,
             'connection_creates': 0,
-            'total_response_time': 0.0
+            'total_response_time': 0.0,
+            'streams_opened': 0,
+            'total_first_byte_time': 0.0,
+            'hedges_sent': 0,
+            'hedges_won': 0
         }
     
     async def initialize(self):
@@ -38,8 +268,7 @@ class OpenAIConnectionPool:
             use_dns_cache=True,
             keepalive_timeout=30,  # 30 seconds keepalive
             enable_cleanup_closed=True,
-            force_close=False,  # Allow connection reuse
-            ssl=False  # Let aiohttp handle SSL
+            force_close=False  # Allow connection reuse
         )
         
         self.session = aiohttp.ClientSession(
@@ -64,10 +293,107 @@ class OpenAIConnectionPool:
         
         return self.session
     
-    async def make_request(self, method: str, url: str, **kwargs) -> Dict[str, Any]:
+    def _rejection(self, error: str, retry_after: int) -> Dict[str, Any]:
+        """Failure result for a request that was not sent upstream"""
+        return {
+            'success': False,
+            'error': error,
+            'status_code': 503,
+            'response_time': 0.0,
+            'retry_after': retry_after
+        }
+    
+    def shed_response(self) -> Optional[Dict[str, Any]]:
+        """Failure result for a request the adaptive limit does not admit, or None to proceed"""
+        if self.limiter is None or self.limiter.try_acquire():
+            return None
+        return self._rejection('Upstream concurrency limit reached', self.limiter.retry_after())
+    
+    def hedge_delay(self) -> Optional[float]:
+        """p95 of recent successful response times, once there are enough samples"""
+        if len(self._latencies) < HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(self._latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+    
+    async def make_request(self, method: str, url: str, hedge: Optional[bool] = None, **kwargs) -> Dict[str, Any]:
         """
-        Make an HTTP request with timing and error handling
+        Make an HTTP request with timing and error handling.
+        
+        While the circuit is open, or when the adaptive concurrency limit is
+        reached, requests fail at once with a 503 result carrying
+        'retry_after'. With hedging, a second attempt is sent if the first
+        is still running after the p95 latency, and the slower one is
+        cancelled.
         """
+        if self.breaker is not None and not self.breaker.allow():
+            return self._rejection('Upstream circuit open', self.breaker.retry_after())
+        
+        delay = self.hedge_delay() if (self.hedge if hedge is None else hedge) else None
+        result = None
+        try:
+            if delay is None:
+                result = await self._admitted_request(method, url, **kwargs)
+            else:
+                result = await self._hedged_request(delay, method, url, **kwargs)
+            return result
+        finally:
+            if self.breaker is not None:
+                if result is None or 'retry_after' in result:
+                    self.breaker.abandon()
+                else:
+                    self.breaker.record(not is_upstream_failure(result['status_code']))
+    
+    async def _admitted_request(self, method: str, url: str, **kwargs) -> Dict[str, Any]:
+        """Send one attempt if the adaptive limit admits it"""
+        shed = self.shed_response()
+        if shed is not None:
+            return shed
+        
+        result = None
+        try:
+            result = await self._send_request(method, url, **kwargs)
+            if result['success']:
+                self._latencies.append(result['response_time'])
+            return result
+        finally:
+            if self.limiter is not None:
+                if result is None:
+                    self.limiter.release(None, None)
+                else:
+                    self.limiter.release(output_token_latency(result), result['status_code'],
+                                         result['response_time'])
+    
+    async def _hedged_request(self, delay: float, method: str, url: str, **kwargs) -> Dict[str, Any]:
+        """Race a second attempt against a slow first one; the first success wins"""
+        first = asyncio.ensure_future(self._admitted_request(method, url, **kwargs))
+        pending = {first}
+        try:
+            done, _ = await asyncio.wait(pending, timeout=delay)
+            if done:
+                return first.result()
+            
+            self._stats['hedges_sent'] += 1
+            hedge = asyncio.ensure_future(self._admitted_request(method, url, **kwargs))
+            pending.add(hedge)
+            result = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for attempt in done:
+                    result = attempt.result()
+                    if result['success']:
+                        if attempt is hedge:
+                            self._stats['hedges_won'] += 1
+                        return result
+            return result
+        finally:
+            # Cancel the loser and let it release its connection and limit slot
+            for attempt in pending:
+                attempt.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+    
+    async def _send_request(self, method: str, url: str, **kwargs) -> Dict[str, Any]:
+        """Send one request and describe its outcome"""
         start_time = time.time()
         session = await self.get_session()
         
@@ -129,6 +455,94 @@ class OpenAIConnectionPool:
                 'response_time': time.time() - start_time
             }
     
+    async def stream_request(self, method: str, url: str, **kwargs) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Make a streaming request and yield server-sent events as they arrive.
+        
+        Each `data:` payload is JSON-decoded; the stream ends at `[DONE]` or EOF.
+        Raises UpstreamError for non-200 responses, or UpstreamOverloadedError
+        when shed by the adaptive limit. Closing the generator releases the
+        connection back to the pool.
+        """
+        if self.breaker is not None and not self.breaker.allow():
+            raise UpstreamOverloadedError(self.breaker.retry_after(), 'Upstream circuit open')
+        shed = self.shed_response()
+        if shed is not None:
+            if self.breaker is not None:
+                self.breaker.abandon()
+            raise UpstreamOverloadedError(shed['retry_after'])
+        
+        outcome: Dict[str, Any] = {}
+        start_time = time.time()
+        events = self._stream_events(method, url, outcome, **kwargs)
+        try:
+            async for event in events:
+                yield event
+        except asyncio.TimeoutError:
+            outcome.setdefault('first_byte_time', time.time() - start_time)
+            outcome.setdefault('status_code', 408)
+            raise
+        except aiohttp.ClientError:
+            outcome.setdefault('status_code', 500)
+            raise
+        finally:
+            await events.aclose()
+            if self.limiter is not None:
+                # Time to first byte is the latency signal for streams
+                self.limiter.release(outcome.get('first_byte_time'), outcome.get('status_code'))
+            if self.breaker is not None:
+                if 'status_code' in outcome:
+                    self.breaker.record(not is_upstream_failure(outcome['status_code']))
+                else:
+                    self.breaker.abandon()
+    
+    async def _stream_events(self, method: str, url: str, outcome: Dict[str, Any],
+                             **kwargs) -> AsyncIterator[Dict[str, Any]]:
+        """Decode server-sent events, recording first byte time and status in outcome"""
+        start_time = time.time()
+        session = await self.get_session()
+        
+        # The session-wide total timeout would cut off long generations;
+        # bound the gap between chunks instead
+        kwargs.setdefault('timeout', aiohttp.ClientTimeout(total=None, sock_read=self.timeout))
+        
+        self._stats['requests_made'] += 1
+        self._stats['streams_opened'] += 1
+        
+        async with session.request(method, url, **kwargs) as response:
+            first_byte_time = time.time() - start_time
+            self._stats['total_first_byte_time'] += first_byte_time
+            outcome.update(first_byte_time=first_byte_time, status_code=response.status)
+            
+            if response.status != 200:
+                error_text = await response.text()
+                self._stats['total_response_time'] += time.time() - start_time
+                logger.error(f"API error {response.status}: {error_text}")
+                raise UpstreamError(response.status, error_text)
+            
+            try:
+                data_lines = []
+                async for raw_line in response.content:
+                    line = raw_line.decode('utf-8').rstrip('\r\n')
+                    
+                    if line.startswith('data:'):
+                        # The field value drops a single leading space, no more
+                        value = line[5:]
+                        data_lines.append(value[1:] if value.startswith(' ') else value)
+                        continue
+                    if line or not data_lines:
+                        # Comments, other SSE fields and keep-alive blank lines
+                        continue
+                    
+                    # A blank line terminates the event
+                    data = '\n'.join(data_lines)
+                    data_lines = []
+                    if data == '[DONE]':
+                        break
+                    yield json.loads(data)
+            finally:
+                self._stats['total_response_time'] += time.time() - start_time
+    
     async def close(self):
         """Close all connections and cleanup"""
         if self.session and not self.session.closed:
@@ -154,7 +568,17 @@ class OpenAIConnectionPool:
             'total_response_time': self._stats['total_response_time'],
             'reuse_ratio': (
                 self._stats['connection_reuses'] / max(1, self._stats['requests_made'])
-            )
+            ),
+            'streams_opened': self._stats['streams_opened'],
+            'average_first_byte_time': (
+                self._stats['total_first_byte_time'] / self._stats['streams_opened']
+                if self._stats['streams_opened'] > 0 else 0
+            ),
+            'adaptive_limit': self.limiter.get_stats() if self.limiter else None,
+            'circuit': self.breaker.get_stats() if self.breaker else None,
+            'hedges_sent': self._stats['hedges_sent'],
+            'hedges_won': self._stats['hedges_won'],
+            'hedge_delay': self.hedge_delay()
         }
     
     def reset_stats(self):
@@ -163,7 +587,11 @@ class OpenAIConnectionPool:
             'requests_made': 0,
             'connection_reuses': 0,
             'connection_creates': 0,
-            'total_response_time': 0.0
+            'total_response_time': 0.0,
+            'streams_opened': 0,
+            'total_first_byte_time': 0.0,
+            'hedges_sent': 0,
+            'hedges_won': 0
         }
 
 # Global connection pool instance
@@ -176,12 +604,23 @@ async def get_connection_pool() -> OpenAIConnectionPool:
     if _connection_pool is None:
         _connection_pool = OpenAIConnectionPool(
             max_connections=int(os.getenv('MAX_CONNECTIONS', '10')),
-            timeout=int(os.getenv('REQUEST_TIMEOUT', '30'))
+            timeout=int(os.getenv('REQUEST_TIMEOUT', '30')),
+            adaptive=os.getenv('ADAPTIVE_CONCURRENCY', 'true').lower() == 'true',
+            latency_tolerance=float(os.getenv('ADAPTIVE_LATENCY_TOLERANCE', '2.0')),
+            breaker=CircuitBreaker(
+                failure_threshold=int(os.getenv('CIRCUIT_FAILURE_THRESHOLD', '5')),
+                reset_timeout=float(os.getenv('CIRCUIT_RESET_TIMEOUT', '30'))
+            ),
+            hedge=os.getenv('HEDGE_REQUESTS', 'false').lower() == 'true'
         )
         await _connection_pool.initialize()
     
     return _connection_pool
 
+def get_concurrency_limiter() -> Optional[AdaptiveConcurrencyLimiter]:
+    """The global pool's adaptive limiter, if the pool exists and is adaptive"""
+    return _connection_pool.limiter if _connection_pool else None
+
 async def close_connection_pool():
     """Close the global connection pool"""
     global _connection_pool
@@ -8,28 +8,90 @@ import hashlib
 import json
 import logging
 import os
+import secrets
 import time
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, Callable, Awaitable
+
+from redis.exceptions import RedisError
+
+from cache import normalize_prompt
+from connection_manager import UpstreamOverloadedError
+from redis_pool import RedisScript, get_async_redis
+
 logger = logging.getLogger(__name__)
 
+# Extend the lease only while this worker still holds it
+RENEW_LEASE = RedisScript("""
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+""")
+
+# Store the outcome, wake followers and drop the lease in one round trip.
+# Failures are published but not stored, so late arrivals retry upstream.
+FINISH_FLIGHT = RedisScript("""
+if ARGV[3] == '1' then
+    redis.call('SET', KEYS[2], ARGV[2], 'PX', ARGV[4])
+end
+redis.call('PUBLISH', KEYS[3], ARGV[2])
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    redis.call('DEL', KEYS[1])
+end
+return 1
+""")
+
+# Leaders publish outcomes on FLIGHT_CHANNEL + request key
+FLIGHT_CHANNEL = "ai_singleflight:done:"
+
+# Give up the lease without a result so a follower takes over at once
+RELEASE_LEASE = RedisScript("""
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+""")
+
+class DistributedFlightError(Exception):
+    """The leading worker's upstream request failed"""
+
 class RequestDeduplicator:
     """
     Deduplicates identical AI requests to prevent redundant API calls
     """
     
-    def __init__(self, request_timeout: int = 300, max_pending: int = 100):
+    def __init__(self, request_timeout: int = 300, max_pending: int = 100,
+                 distributed: bool = False, lease_ms: int = 5000, result_ttl_ms: int = 30000):
         self.request_timeout = request_timeout  # 5 minutes default
         self.max_pending = max_pending
+        # Distributed mode extends single-flight across workers via a Redis lease
+        self.distributed = distributed
+        self.lease_ms = lease_ms
+        self.result_ttl_ms = result_ttl_ms
         self.pending_requests: Dict[str, asyncio.Future] = {}
         self.request_stats: Dict[str, Dict[str, Any]] = {}
         self._cleanup_task = None
         self._cleanup_interval = 60  # Cleanup every minute
+        # Followers waiting on a leader elsewhere, fed by one pattern subscription
+        self._flight_waiters: Dict[str, List[asyncio.Future]] = {}
+        self._listener_task: Optional[asyncio.Task] = None
+        self._stats = {
+            'executions': 0,
+            'deduplicated': 0,
+            'failures': 0,
+            'distributed_leads': 0,
+            'distributed_follows': 0,
+            'takeovers': 0,
+            'redis_fallbacks': 0
+        }
         self._start_cleanup_task()
     
     def _start_cleanup_task(self):
-        """Start background cleanup task"""
-        if self._cleanup_task is None or self._cleanup_task.done():
-            self._cleanup_task = asyncio.create_task(self._cleanup_expired_requests())
+        """Start background cleanup task on the running event loop"""
+        loop = asyncio.get_running_loop()
+        if (self._cleanup_task is None or self._cleanup_task.done()
+                or self._cleanup_task.get_loop() is not loop):
+            self._cleanup_task = loop.create_task(self._cleanup_expired_requests())
     
     async def _cleanup_expired_requests(self):
         """Clean up expired requests"""
@@ -69,44 +131,42 @@ class RequestDeduplicator:
     
     def _get_request_key(self, prompt: str, model: str, **kwargs) -> str:
         """Generate unique key for request deduplication"""
-        # Normalize prompt for better deduplication
-        normalized_prompt = prompt.strip().lower()
-        
-        # Include relevant parameters in key
+        # Include relevant parameters in key, with the prompt normalized as the cache key does
         params = {
-            'prompt': normalized_prompt,
+            **kwargs,
+            'prompt': normalize_prompt(prompt),
             'model': model,
             'max_tokens': kwargs.get('max_tokens', 1000),
             'temperature': kwargs.get('temperature', 0.7)
         }
         
         # Create deterministic key
-        key_data = json.dumps(params, sort_keys=True)
+        key_data = json.dumps(params, sort_keys=True, default=str)
         return hashlib.sha256(key_data.encode()).hexdigest()
     
-    async def execute_or_wait(self, prompt: str, model: str, coro, **kwargs) -> Any:
+    async def execute_or_wait(self, prompt: str, model: str,
+                              request_factory: Callable[[], Awaitable[Any]], **kwargs) -> Any:
         """
-        Execute coroutine or wait for existing identical request
+        Execute request_factory() or wait for an identical request in flight.
+        
+        Only the first caller for a key invokes the factory; everyone else awaits
+        the same task and receives its result or its exception. The shared task
+        is shielded, so a caller that is cancelled (e.g. a disconnected client)
+        does not cancel the request for the remaining waiters.
         """
+        self._start_cleanup_task()
         key = self._get_request_key(prompt, model, **kwargs)
         
         # Check if identical request is already pending
-        if key in self.pending_requests:
+        future = self.pending_requests.get(key)
+        if future is not None and not future.done():
             stats = self.request_stats.get(key, {})
             stats['wait_count'] = stats.get('wait_count', 0) + 1
             self.request_stats[key] = stats
+            self._stats['deduplicated'] += 1
             
             logger.debug(f"Waiting for existing request: {key[:16]}...")
-            try:
-                result = await self.pending_requests[key]
-                logger.debug(f"Received result from existing request: {key[:16]}...")
-                return result
-            except Exception as e:
-                # If existing request failed, remove it and retry
-                logger.warning(f"Existing request failed, retrying: {key[:16]}... - {e}")
-                self.pending_requests.pop(key, None)
-                self.request_stats.pop(key, None)
-                return await self.execute_or_wait(prompt, model, coro, **kwargs)
+            return await asyncio.shield(future)
         
         # Create new request
         if len(self.pending_requests) >= self.max_pending:
@@ -114,7 +174,7 @@ class RequestDeduplicator:
             raise Exception("Too many pending requests")
         
         # Create future and store it
-        future = asyncio.create_task(self._execute_with_tracking(key, coro))
+        future = asyncio.create_task(self._execute_with_tracking(key, request_factory))
         self.pending_requests[key] = future
         self.request_stats[key] = {
             'start_time': time.time(),
@@ -122,26 +182,209 @@ class RequestDeduplicator:
             'model': model,
             'wait_count': 0
         }
+        self._stats['executions'] += 1
+        future.add_done_callback(lambda done: self._release(key, done))
         
-        try:
-            result = await future
-            return result
-        finally:
-            # Clean up
+        return await asyncio.shield(future)
+    
+    def _release(self, key: str, future: asyncio.Future):
+        """Forget a finished request so the next caller starts a fresh one"""
+        if self.pending_requests.get(key) is future:
             self.pending_requests.pop(key, None)
             stats = self.request_stats.pop(key, {})
             duration = time.time() - stats.get('start_time', time.time())
-            logger.debug(f"Request completed: {key[:16]}... in {duration:.2f}s")
+            logger.debug(f"Request completed: {key[:16]}... in {duration:.2f}s "
+                         f"({stats.get('wait_count', 0)} waiters)")
+        if not future.cancelled() and future.exception() is not None:
+            self._stats['failures'] += 1
     
-    async def _execute_with_tracking(self, key: str, coro) -> Any:
-        """Execute coroutine with tracking"""
+    async def _execute_with_tracking(self, key: str, request_factory: Callable[[], Awaitable[Any]]) -> Any:
+        """Execute the request with tracking"""
         try:
-            result = await coro
-            return result
+            if self.distributed:
+                return await self._execute_distributed(key, request_factory)
+            return await request_factory()
         except Exception as e:
             logger.error(f"Request execution failed: {key[:16]}... - {e}")
             raise
     
+    async def _execute_distributed(self, key: str, request_factory: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Single-flight across workers.
+        
+        The worker that wins SET NX on the lease key calls upstream, renewing
+        the lease while it runs. Other workers wait for the leader's published
+        result; if the lease expires with no result (the leader died) a
+        follower takes the lease over. Each worker receives results on a
+        single pattern subscription shared by all its followers, so waiting
+        holds no pooled connection. If Redis fails before this worker leads,
+        the request runs locally instead. Results must be JSON-serializable.
+        """
+        redis_conn = await get_async_redis()
+        if redis_conn is None:
+            return await request_factory()
+        
+        lease_key = f"ai_singleflight:lease:{key}"
+        result_key = f"ai_singleflight:result:{key}"
+        channel = f"{FLIGHT_CHANNEL}{key}"
+        token = secrets.token_hex(8)
+        waiter = None
+        
+        try:
+            while True:
+                try:
+                    leading = await redis_conn.set(lease_key, token, nx=True, px=self.lease_ms)
+                except RedisError as e:
+                    return await self._run_without_redis(key, request_factory, e)
+                if leading:
+                    self._stats['distributed_leads'] += 1
+                    return await self._lead(redis_conn, token, (lease_key, result_key, channel), request_factory)
+                
+                # Register before looking for a stored result so a publish
+                # landing in between is not missed
+                if waiter is None:
+                    await self._start_listener(redis_conn)
+                    waiter = asyncio.get_running_loop().create_future()
+                    self._flight_waiters.setdefault(key, []).append(waiter)
+                
+                try:
+                    payload = await self._follow(redis_conn, waiter, lease_key, result_key)
+                except RedisError as e:
+                    return await self._run_without_redis(key, request_factory, e)
+                if payload is not None:
+                    self._stats['distributed_follows'] += 1
+                    outcome = json.loads(payload)
+                    if not outcome['ok']:
+                        if 'retry_after' in outcome:
+                            raise UpstreamOverloadedError(outcome['retry_after'], outcome['error'])
+                        raise DistributedFlightError(outcome['error'])
+                    return outcome['result']
+                
+                self._stats['takeovers'] += 1
+                logger.warning(f"Single-flight leader lost, taking over: {key[:16]}...")
+        finally:
+            if waiter is not None:
+                waiters = self._flight_waiters.get(key, [])
+                if waiter in waiters:
+                    waiters.remove(waiter)
+                if not waiters:
+                    self._flight_waiters.pop(key, None)
+    
+    async def _run_without_redis(self, key: str, request_factory: Callable[[], Awaitable[Any]],
+                                 error: Exception) -> Any:
+        """Call upstream directly, single-flight within this worker only"""
+        self._stats['redis_fallbacks'] += 1
+        logger.warning(f"Single-flight Redis error, calling upstream locally: {key[:16]}... - {error}")
+        return await request_factory()
+    
+    async def _start_listener(self, redis_conn):
+        """Start the worker's flight result subscription on the running event loop"""
+        loop = asyncio.get_running_loop()
+        if (self._listener_task is None or self._listener_task.done()
+                or self._listener_task.get_loop() is not loop):
+            ready = asyncio.Event()
+            self._listener_task = loop.create_task(self._listen_flights(redis_conn, ready))
+            try:
+                await asyncio.wait_for(ready.wait(), timeout=5)
+            except asyncio.TimeoutError:
+                # Followers still notice the lease lapsing without the listener
+                logger.warning("Single-flight listener not ready, relying on lease polling")
+    
+    async def _listen_flights(self, redis_conn, ready: asyncio.Event):
+        """Hand published flight outcomes to the followers waiting on them"""
+        while True:
+            pubsub = redis_conn.pubsub()
+            try:
+                await pubsub.psubscribe(f"{FLIGHT_CHANNEL}*")
+                ready.set()
+                while True:
+                    message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                    if message is None:
+                        continue
+                    key = message['channel'][len(FLIGHT_CHANNEL):]
+                    for waiter in self._flight_waiters.get(key, []):
+                        if not waiter.done():
+                            waiter.set_result(message['data'])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Followers fall back to watching the lease until this recovers
+                logger.warning(f"Single-flight listener error: {e}")
+                ready.set()
+                await asyncio.sleep(1)
+            finally:
+                try:
+                    await pubsub.aclose()
+                except Exception:
+                    pass
+    
+    async def _lead(self, redis_conn, token: str, keys: tuple, request_factory: Callable[[], Awaitable[Any]]) -> Any:
+        """Run the upstream request as flight leader and publish its outcome"""
+        lease_key = keys[0]
+        renewal = asyncio.create_task(self._renew_lease(redis_conn, lease_key, token))
+        try:
+            result = await request_factory()
+        except asyncio.CancelledError:
+            try:
+                await RELEASE_LEASE(redis_conn, [lease_key], [token])
+            except Exception as e:
+                logger.error(f"Single-flight lease release error: {lease_key} - {e}")
+            raise
+        except UpstreamOverloadedError as e:
+            # Followers get the same 503 and retry hint rather than a generic failure
+            await self._finish(redis_conn, token, keys, {'ok': False, 'error': e.error,
+                                                         'retry_after': e.retry_after})
+            raise
+        except Exception as e:
+            await self._finish(redis_conn, token, keys, {'ok': False, 'error': str(e)})
+            raise
+        finally:
+            renewal.cancel()
+        
+        await self._finish(redis_conn, token, keys, {'ok': True, 'result': result})
+        return result
+    
+    async def _finish(self, redis_conn, token: str, keys: tuple, outcome: Dict[str, Any]):
+        """
+        Publish the leader's outcome, storing it only on success.
+        
+        A publish error must not replace the leader's own result or
+        exception; followers then see the lease lapse and retry upstream.
+        """
+        try:
+            await FINISH_FLIGHT(redis_conn, list(keys),
+                                [token, json.dumps(outcome), int(outcome['ok']), self.result_ttl_ms])
+        except Exception as e:
+            logger.error(f"Single-flight publish error: {keys[0]} - {e}")
+    
+    async def _renew_lease(self, redis_conn, lease_key: str, token: str):
+        """Keep the lease alive while the leader's request is running"""
+        while True:
+            await asyncio.sleep(self.lease_ms / 3000)
+            try:
+                if not await RENEW_LEASE(redis_conn, [lease_key], [token, self.lease_ms]):
+                    logger.warning(f"Single-flight lease lost: {lease_key}")
+                    return
+            except Exception as e:
+                logger.error(f"Lease renewal error: {e}")
+    
+    async def _follow(self, redis_conn, waiter: asyncio.Future, lease_key: str, result_key: str) -> Optional[str]:
+        """Wait for the leader's outcome; None means the lease lapsed without one"""
+        stored = await redis_conn.get(result_key)
+        if stored is not None:
+            return stored
+        
+        poll_interval = min(1.0, self.lease_ms / 4000)
+        while True:
+            try:
+                return await asyncio.wait_for(asyncio.shield(waiter), poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            
+            # No news: check the leader is still holding its lease
+            if not await redis_conn.exists(lease_key):
+                return await redis_conn.get(result_key)
+    
     async def get_pending_requests(self) -> List[Dict[str, Any]]:
         """Get information about pending requests"""
         current_time = time.time()
@@ -164,20 +407,29 @@ class RequestDeduplicator:
     
     def get_stats(self) -> Dict[str, Any]:
         """Get deduplication statistics"""
-        total_requests = sum(stats.get('wait_count', 0) for stats in self.request_stats.values())
-        unique_requests = len(self.request_stats)
-        duplicates_prevented = total_requests - unique_requests
+        total_requests = self._stats['executions'] + self._stats['deduplicated']
         
         return {
             'pending_requests': len(self.pending_requests),
-            'unique_requests': unique_requests,
-            'total_duplicates_prevented': duplicates_prevented,
+            'unique_requests': self._stats['executions'],
+            'total_duplicates_prevented': self._stats['deduplicated'],
+            'failed_requests': self._stats['failures'],
+            'distributed': self.distributed,
+            'distributed_leads': self._stats['distributed_leads'],
+            'distributed_follows': self._stats['distributed_follows'],
+            'takeovers': self._stats['takeovers'],
+            'redis_fallbacks': self._stats['redis_fallbacks'],
             'duplicate_prevention_rate': (
-                duplicates_prevented / max(1, total_requests)
+                self._stats['deduplicated'] / max(1, total_requests)
             ),
             'max_pending_reached': len(self.pending_requests) >= self.max_pending
         }
     
+    def reset_stats(self):
+        """Reset deduplication statistics"""
+        for key in self._stats:
+            self._stats[key] = 0
+    
     async def cancel_request(self, prompt: str, model: str, **kwargs) -> bool:
         """Cancel a specific request"""
         key = self._get_request_key(prompt, model, **kwargs)
@@ -210,13 +462,14 @@ class RequestDeduplicator:
     
     async def shutdown(self):
         """Shutdown the deduplicator"""
-        # Cancel cleanup task
-        if self._cleanup_task and not self._cleanup_task.done():
-            self._cleanup_task.cancel()
-            try:
-                await self._cleanup_task
-            except asyncio.CancelledError:
-                pass
+        # Cancel background tasks (a task left on a closed loop is simply dropped)
+        for task in (self._cleanup_task, self._listener_task):
+            if task and not task.done() and task.get_loop() is asyncio.get_running_loop():
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
         
         # Cancel all pending requests
         await self.cancel_all_requests()
@@ -233,7 +486,9 @@ async def get_deduplicator() -> RequestDeduplicator:
     if _deduplicator is None:
         _deduplicator = RequestDeduplicator(
             request_timeout=int(os.getenv('REQUEST_TIMEOUT', '300')),
-            max_pending=int(os.getenv('MAX_PENDING_REQUESTS', '100'))
+            max_pending=int(os.getenv('MAX_PENDING_REQUESTS', '100')),
+            distributed=os.getenv('DISTRIBUTED_DEDUP', 'false').lower() == 'true',
+            lease_ms=int(os.getenv('DEDUP_LEASE_MS', '5000'))
         )
     
     return _deduplicator
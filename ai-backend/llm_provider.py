@@ -0,0 +1,117 @@
+"""
+AI Backend LLM Provider
+Chat completion backends behind one interface, selected by LLM_PROVIDER
+"""
+
+import logging
+from typing import Any, AsyncIterator, Dict, List, NamedTuple, Optional, Type
+
+from connection_manager import UpstreamError, UpstreamOverloadedError, get_connection_pool
+
+logger = logging.getLogger(__name__)
+
+class Completion(NamedTuple):
+    """A finished chat completion"""
+    content: str
+    total_tokens: Optional[int]  # Reported usage, when the backend returns it
+
+class LLMProvider:
+    """
+    A chat completion backend.
+
+    complete() and stream() raise UpstreamOverloadedError when the request
+    was shed and UpstreamError for any other failure.
+    """
+
+    # Whether the backend refuses requests without an API key
+    requires_api_key = True
+
+    def __init__(self, api_base: str, api_key: Optional[str], model: str):
+        self.api_base = api_base.rstrip('/')
+        self.api_key = api_key
+        self.model = model
+
+    async def complete(self, messages: List[Dict[str, str]], max_tokens: int, temperature: float) -> Completion:
+        raise NotImplementedError
+
+    def stream(self, messages: List[Dict[str, str]], max_tokens: int, temperature: float) -> AsyncIterator[str]:
+        """Yield content deltas as they arrive"""
+        raise NotImplementedError
+
+class OpenAICompatibleProvider(LLMProvider):
+    """The OpenAI chat completions API, over the shared connection pool"""
+
+    def _payload(self, messages: List[Dict[str, str]], max_tokens: int, temperature: float,
+                 stream: bool = False) -> Dict[str, Any]:
+        """Chat completion request body"""
+        return {
+            "model": self.model,
+            "messages": messages,
+            "max_tokens": max_tokens,
+            "temperature": temperature,
+            "top_p": 0.9,
+            "frequency_penalty": 0.1,
+            "presence_penalty": 0.1,
+            "stream": stream
+        }
+
+    def _headers(self) -> Dict[str, str]:
+        return {"Authorization": f"Bearer {self.api_key}"} if self.api_key else {}
+
+    async def complete(self, messages: List[Dict[str, str]], max_tokens: int, temperature: float) -> Completion:
+        pool = await get_connection_pool()
+        result = await pool.make_request(
+            "POST",
+            f"{self.api_base}/chat/completions",
+            json=self._payload(messages, max_tokens, temperature),
+            headers=self._headers()
+        )
+        if 'retry_after' in result:
+            raise UpstreamOverloadedError(result['retry_after'], result['error'])
+        if not result['success']:
+            raise UpstreamError(result['status_code'], result['error'])
+
+        data = result['data']
+        return Completion(data['choices'][0]['message']['content'], (data.get('usage') or {}).get('total_tokens'))
+
+    async def stream(self, messages: List[Dict[str, str]], max_tokens: int, temperature: float) -> AsyncIterator[str]:
+        pool = await get_connection_pool()
+        events = pool.stream_request(
+            "POST",
+            f"{self.api_base}/chat/completions",
+            json=self._payload(messages, max_tokens, temperature, stream=True),
+            headers={**self._headers(), "Accept": "text/event-stream"}
+        )
+        try:
+            async for event in events:
+                choices = event.get("choices") or [{}]
+                delta = choices[0].get("delta", {}).get("content")
+                if delta:
+                    yield delta
+        finally:
+            await events.aclose()
+
+class LocalProvider(OpenAICompatibleProvider):
+    """An OpenAI-compatible server that needs no key: mock_llm_server.py, vLLM, llama.cpp, Ollama"""
+
+    requires_api_key = False
+
+PROVIDERS: Dict[str, Type[LLMProvider]] = {
+    'openai': OpenAICompatibleProvider,
+    'local': LocalProvider
+}
+
+def register_provider(name: str, provider_class: Type[LLMProvider]):
+    """Make a backend selectable through LLM_PROVIDER"""
+    PROVIDERS[name] = provider_class
+
+def get_provider_class(name: str) -> Type[LLMProvider]:
+    """Look up a backend by name"""
+    try:
+        return PROVIDERS[name]
+    except KeyError:
+        raise ValueError(f"Unknown LLM provider '{name}', expected one of: {', '.join(sorted(PROVIDERS))}")
+
+def create_provider(name: str, api_base: str, api_key: Optional[str], model: str) -> LLMProvider:
+    """Build a backend; providers hold no connections, so this is cheap"""
+    return get_provider_class(name)(api_base, api_key, model)
@@ -0,0 +1,240 @@
+"""
+AI Backend Login Throttle
+Cheap admission checks that turn away credential stuffing before any password is hashed
+"""
+
+import asyncio
+import contextlib
+import logging
+import math
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from redis_pool import RedisScript, get_async_redis
+
+logger = logging.getLogger(__name__)
+
+class BackoffPolicy(NamedTuple):
+    """
+    After `free_failures` failed logins each further failure blocks the key
+    for `base_delay` seconds, doubling up to `max_delay`. Failures are
+    forgotten `window` seconds after the last one.
+    """
+    free_failures: int
+    base_delay: float = 1.0
+    max_delay: float = 900.0
+    window: float = 900.0
+
+class LoginThrottledError(Exception):
+    """Raised when a login attempt is refused before its password is checked"""
+
+    def __init__(self, retry_after: int, reason: str):
+        super().__init__(f"Login throttled: {reason}")
+        self.retry_after = retry_after
+        self.reason = reason
+
+# Remaining block in milliseconds for username KEYS[1] and IP KEYS[2]; the IP
+# block only applies when ARGV[1] is '1' (unknown user) or the username has failures
+CHECK_SCRIPT = RedisScript("""
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+local wait = tonumber(redis.call('HGET', KEYS[1], 'blocked_until') or '0') - now
+if ARGV[1] == '1' or redis.call('HEXISTS', KEYS[1], 'failures') == 1 then
+    local ip_wait = tonumber(redis.call('HGET', KEYS[2], 'blocked_until') or '0') - now
+    if ip_wait > wait then
+        wait = ip_wait
+    end
+end
+return math.max(wait, 0)
+""")
+
+# Count a failure against each key; ARGV holds free, base_ms, max_ms, window_ms per key
+FAILURE_SCRIPT = RedisScript("""
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+for i, key in ipairs(KEYS) do
+    local offset = (i - 1) * 4
+    local free = tonumber(ARGV[offset + 1])
+    local failures = redis.call('HINCRBY', key, 'failures', 1)
+    local delay = 0
+    if failures > free then
+        delay = math.floor(math.min(tonumber(ARGV[offset + 3]),
+                                    tonumber(ARGV[offset + 2]) * 2 ^ (failures - free - 1)))
+        redis.call('HSET', key, 'blocked_until', now + delay)
+    end
+    redis.call('PEXPIRE', key, tonumber(ARGV[offset + 4]) + delay)
+end
+return 1
+""")
+
+class LoginThrottle:
+    """
+    Admission control for the login endpoint.
+
+    Each attempt is checked against exponential backoff counters for the
+    submitted username and the client IP, and each password check must take
+    one of a fixed number of slots. Refusals cost one Redis round trip and no
+    hashing. The username counter stops guessing against one account. The IP
+    counter stops one source spraying many accounts, but many users can share
+    an address behind NAT, so it is a soft limit: it only refuses unknown
+    usernames and ones that have failed recently, and its backoff is capped
+    far lower. A password check waits up to `slot_timeout` seconds for a
+    slot before being refused; the slots default to half the password
+    hasher's queue (`workers * 8`), so a login flood cannot starve
+    registration.
+
+    Counters live in Redis so every worker sees them. While Redis is
+    unavailable they are kept in a bounded per-worker LRU instead.
+    """
+
+    def __init__(self, username_policy: BackoffPolicy = BackoffPolicy(free_failures=5),
+                 ip_policy: BackoffPolicy = BackoffPolicy(free_failures=20, max_delay=60.0),
+                 max_concurrent: Optional[int] = None, slot_timeout: float = 1.0,
+                 max_local_entries: int = 100000):
+        self.username_policy = username_policy
+        self.ip_policy = ip_policy
+        self.max_concurrent = max_concurrent or (os.cpu_count() or 1) * 4
+        self.slot_timeout = slot_timeout
+        self.max_local_entries = max_local_entries
+        self.in_flight = 0
+        self._slots = asyncio.Semaphore(self.max_concurrent)
+        # key -> [failures, blocked_until, forget_at]
+        self.local: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._stats = {
+            'checks': 0,
+            'throttled': 0,
+            'concurrency_rejections': 0,
+            'failures': 0,
+            'successes': 0,
+            'redis_errors': 0
+        }
+
+    def _keys(self, username: str, client_ip: str) -> List[Tuple[str, BackoffPolicy]]:
+        return [(f"login_throttle:user:{username.lower()}", self.username_policy),
+                (f"login_throttle:ip:{client_ip}", self.ip_policy)]
+
+    async def check(self, username: str, client_ip: str, known_user: bool = False):
+        """Raise LoginThrottledError while the username, or for a suspect login the IP, is backing off"""
+        self._stats['checks'] += 1
+        wait = await self._blocked_for([key for key, _ in self._keys(username, client_ip)], known_user)
+        if wait > 0:
+            self._stats['throttled'] += 1
+            raise LoginThrottledError(max(1, math.ceil(wait)), "too many failed attempts")
+
+    @contextlib.asynccontextmanager
+    async def verify_slot(self):
+        """Hold one of the password check slots, or raise LoginThrottledError if none frees up in time"""
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.slot_timeout)
+        except asyncio.TimeoutError:
+            self._stats['concurrency_rejections'] += 1
+            raise LoginThrottledError(1, "too many concurrent logins")
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self._slots.release()
+
+    async def _blocked_for(self, keys: List[str], known_user: bool) -> float:
+        redis_conn = await get_async_redis()
+        if redis_conn is not None:
+            try:
+                return await CHECK_SCRIPT(redis_conn, keys, ['0' if known_user else '1']) / 1000
+            except Exception as e:
+                self._stats['redis_errors'] += 1
+                logger.error(f"Login throttle check error: {e}")
+
+        now = time.time()
+        user_key, ip_key = keys
+        entry = self.local.get(user_key)
+        wait = 0.0 if entry is None else entry[1] - now
+        if not known_user or (entry is not None and entry[2] > now):
+            entry = self.local.get(ip_key)
+            if entry is not None:
+                wait = max(wait, entry[1] - now)
+        return wait
+
+    async def record_failure(self, username: str, client_ip: str):
+        """Count a failed login against the username and the IP"""
+        self._stats['failures'] += 1
+        keys = self._keys(username, client_ip)
+        redis_conn = await get_async_redis()
+        if redis_conn is not None:
+            args = []
+            for _, policy in keys:
+                args.extend([policy.free_failures, int(policy.base_delay * 1000),
+                             int(policy.max_delay * 1000), int(policy.window * 1000)])
+            try:
+                await FAILURE_SCRIPT(redis_conn, [key for key, _ in keys], args)
+                return
+            except Exception as e:
+                self._stats['redis_errors'] += 1
+                logger.error(f"Login throttle update error: {e}")
+
+        now = time.time()
+        for key, policy in keys:
+            entry = self.local.get(key)
+            if entry is None or entry[2] <= now:
+                entry = self.local[key] = [0, 0.0, 0.0]
+            self.local.move_to_end(key)
+            entry[0] += 1
+            delay = 0.0
+            if entry[0] > policy.free_failures:
+                delay = min(policy.max_delay, policy.base_delay * 2 ** (entry[0] - policy.free_failures - 1))
+                entry[1] = now + delay
+            entry[2] = now + policy.window + delay
+        while len(self.local) > self.max_local_entries:
+            self.local.popitem(last=False)
+
+    async def record_success(self, username: str, client_ip: str):
+        """Clear the username's failures; the IP's stand, as one success says little about a source"""
+        self._stats['successes'] += 1
+        key = self._keys(username, client_ip)[0][0]
+        self.local.pop(key, None)
+        redis_conn = await get_async_redis()
+        if redis_conn is not None:
+            try:
+                await redis_conn.delete(key)
+            except Exception as e:
+                self._stats['redis_errors'] += 1
+                logger.error(f"Login throttle reset error: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get login throttle statistics"""
+        return {
+            **self._stats,
+            'in_flight': self.in_flight,
+            'max_concurrent': self.max_concurrent,
+            'local_entries': len(self.local)
+        }
+
+    def reset_stats(self):
+        """Reset statistics"""
+        self._stats = {key: 0 for key in self._stats}
+
+# Global login throttle
+_login_throttle: Optional[LoginThrottle] = None
+
+def get_login_throttle() -> LoginThrottle:
+    """Get or create the global login throttle"""
+    global _login_throttle
+
+    if _login_throttle is None:
+        _login_throttle = LoginThrottle(
+            username_policy=BackoffPolicy(
+                free_failures=int(os.getenv('LOGIN_USER_FREE_FAILURES', '5')),
+                base_delay=float(os.getenv('LOGIN_BACKOFF_BASE', '1')),
+                max_delay=float(os.getenv('LOGIN_BACKOFF_MAX', '900'))
+            ),
+            ip_policy=BackoffPolicy(
+                free_failures=int(os.getenv('LOGIN_IP_FREE_FAILURES', '20')),
+                base_delay=float(os.getenv('LOGIN_BACKOFF_BASE', '1')),
+                max_delay=float(os.getenv('LOGIN_IP_BACKOFF_MAX', '60'))
+            ),
+            max_concurrent=int(os.getenv('LOGIN_MAX_CONCURRENT', '0')) or None,
+            slot_timeout=float(os.getenv('LOGIN_SLOT_TIMEOUT', '1'))
+        )
+    return _login_throttle
@@ -7,24 +7,37 @@ import os
 import logging
 import secrets
 import hashlib
+import json
+import math
 import time
 from datetime import datetime, timedelta
 from pathlib import Path
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, AsyncIterator
 
-from fastapi import FastAPI, HTTPException, Depends, BackgroundTasks, UploadFile, File, Request, status
+from fastapi import FastAPI, HTTPException, Depends, BackgroundTasks, UploadFile, File, Request, Response, status
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from starlette.middleware.base import BaseHTTPMiddleware
 from pydantic import BaseModel, Field
 import uvicorn
-import redis
 import jwt
 from passlib.context import CryptContext
-import openai
 import asyncio
-from tenacity import retry, stop_after_attempt, wait_exponential
+
+from cache import get_cache, close_cache
+from connection_manager import UpstreamOverloadedError, get_connection_pool, close_connection_pool
+from deduplicator import get_deduplicator, close_deduplicator
+from llm_provider import LLMProvider, create_provider, get_provider_class
+from login_throttle import LoginThrottledError, get_login_throttle
+from password_hasher import PasswordHasherOverloadedError, get_password_hasher, close_password_hasher
+from rate_limiter import LocalCounterTier, RateLimiter, RateLimitRule
+from redis_pool import close_async_redis
+from revocation import get_revocation_list, close_revocation_list
+from scheduler import PRIORITY_BULK, PRIORITY_INTERACTIVE, estimate_tokens, get_scheduler, close_scheduler
+from session_store import ROTATED, UNAVAILABLE, get_session_store
+from token_cache import TokenCache
+from user_store import UserStore, create_user_store
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -48,6 +61,24 @@ class SecurityConfig:
     # Rate Limiting
     RATE_LIMIT_REQUESTS = 100
     RATE_LIMIT_WINDOW = 3600  # 1 hour
+    RATE_LIMIT_ALGORITHM = os.getenv("RATE_LIMIT_ALGORITHM", "sliding_window")
+    
+    # Per-route overrides, matched by longest path prefix
+    RATE_LIMIT_RULES = {
+        "/api/ai/chat": RateLimitRule(limit=30, window=60, algorithm="token_bucket", burst=10),
+        "/api/generate": RateLimitRule(limit=10, window=60, algorithm="token_bucket", burst=3),
+        "/api/files": RateLimitRule(limit=100, window=3600, algorithm="sliding_window"),
+        "/auth/login": RateLimitRule(limit=10, window=60, algorithm="sliding_window"),
+    }
+    
+    # In-process counter tier synced to Redis in batches
+    RATE_LIMIT_LOCAL_TIER = os.getenv("RATE_LIMIT_LOCAL_TIER", "true").lower() == "true"
+    RATE_LIMIT_LOCAL_MAX_ENTRIES = int(os.getenv("RATE_LIMIT_LOCAL_MAX_ENTRIES", "10000"))
+    RATE_LIMIT_SYNC_INTERVAL_MS = int(os.getenv("RATE_LIMIT_SYNC_INTERVAL_MS", "250"))
+    RATE_LIMIT_APPROXIMATE = os.getenv("RATE_LIMIT_APPROXIMATE", "false").lower() == "true"
+    
+    # Verified access tokens kept in memory (0 disables the cache)
+    TOKEN_CACHE_MAX_ENTRIES = int(os.getenv("TOKEN_CACHE_MAX_ENTRIES", "10000"))
     
     # CORS Configuration
     ALLOWED_ORIGINS = os.getenv("ALLOWED_ORIGINS", "http://localhost:3000,http://localhost:8000,http://localhost").split(",")
@@ -67,20 +98,23 @@ pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 # JWT Security
 security = HTTPBearer()
 
-# Redis connection for rate limiting and session storage
-redis_client: Optional[redis.Redis] = None
+# Claims of recently verified access tokens
+token_cache = TokenCache(max_entries=SecurityConfig.TOKEN_CACHE_MAX_ENTRIES)
 
-def get_redis():
-    global redis_client
-    if redis_client is None:
-        redis_url = os.getenv("REDIS_URL", "redis://localhost:6379/0")
-        try:
-            redis_client = redis.from_url(redis_url, decode_responses=True)
-            redis_client.ping()
-        except Exception as e:
-            logger.warning(f"Redis connection failed: {e}. Rate limiting disabled.")
-            redis_client = None
-    return redis_client
+# Rate limiter with per-route rules
+rate_limiter = RateLimiter(
+    rules=SecurityConfig.RATE_LIMIT_RULES,
+    default_rule=RateLimitRule(
+        limit=SecurityConfig.RATE_LIMIT_REQUESTS,
+        window=SecurityConfig.RATE_LIMIT_WINDOW,
+        algorithm=SecurityConfig.RATE_LIMIT_ALGORITHM
+    ),
+    local_tier=LocalCounterTier(
+        max_entries=SecurityConfig.RATE_LIMIT_LOCAL_MAX_ENTRIES,
+        sync_interval_ms=SecurityConfig.RATE_LIMIT_SYNC_INTERVAL_MS,
+        approximate=SecurityConfig.RATE_LIMIT_APPROXIMATE
+    ) if SecurityConfig.RATE_LIMIT_LOCAL_TIER else None
+)
 
 # Rate Limiting Middleware
 class RateLimitMiddleware(BaseHTTPMiddleware):
@@ -92,31 +126,28 @@ class RateLimitMiddleware(BaseHTTPMiddleware):
         if endpoint in ["/health", "/"]:
             return await call_next(request)
         
+        result = None
         try:
-            redis_conn = get_redis()
-            if redis_conn is None:
-                return await call_next(request)
-            
-            key = f"rate_limit:{client_ip}:{endpoint}"
-            
-            # Check current count
-            current = redis_conn.get(key)
-            if current is None:
-                redis_conn.setex(key, SecurityConfig.RATE_LIMIT_WINDOW, 1)
-            else:
-                count = int(current)
-                if count >= SecurityConfig.RATE_LIMIT_REQUESTS:
-                    return JSONResponse(
-                        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
-                        content={"error": "Rate limit exceeded. Please try again later."}
-                    )
-                redis_conn.incr(key)
-                
+            result = await rate_limiter.check(client_ip, endpoint)
         except Exception as e:
             logger.error(f"Rate limiting error: {e}")
             # Continue without rate limiting if Redis is unavailable
         
+        if result is not None and not result.allowed:
+            return JSONResponse(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                content={"error": "Rate limit exceeded. Please try again later."},
+                headers={
+                    "Retry-After": str(max(1, math.ceil(result.retry_after))),
+                    "X-RateLimit-Limit": str(result.limit),
+                    "X-RateLimit-Remaining": "0"
+                }
+            )
+        
         response = await call_next(request)
+        if result is not None:
+            response.headers["X-RateLimit-Limit"] = str(result.limit)
+            response.headers["X-RateLimit-Remaining"] = str(result.remaining)
         return response
 
 # Add rate limiting middleware
@@ -140,9 +171,17 @@ app.add_middleware(
 # Configuration
 class Config:
     OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+    OPENAI_API_BASE = os.getenv("OPENAI_API_BASE", "https://api.openai.com/v1").rstrip("/")
+    # Chat completion backend, see llm_provider.PROVIDERS
+    LLM_PROVIDER = os.getenv("LLM_PROVIDER", "openai")
     SECRET_KEY = SecurityConfig.SECRET_KEY
     DOCS_ROOT = Path(__file__).parent.parent / "docs"
     MAX_CONTENT_LENGTH = 10 * 1024 * 1024  # 10MB
+    
+    @classmethod
+    def ai_configured(cls) -> bool:
+        """Whether the LLM provider can be called: it has a key or needs none"""
+        return bool(cls.OPENAI_API_KEY) or not get_provider_class(cls.LLM_PROVIDER).requires_api_key
 
 # Pydantic models
 class ContentRequest(BaseModel):
@@ -151,6 +190,7 @@ class ContentRequest(BaseModel):
     target_audience: str = Field(default="beginner", description="Target audience level")
     length: Optional[str] = Field(default="medium", description="Content length")
     additional_context: Optional[str] = Field(None, description="Additional context for generation")
+    stream: bool = Field(default=False, description="Stream markdown as it is generated")
 
 class AIChatRequest(BaseModel):
     message: str = Field(..., description="User message to AI")
@@ -187,12 +227,8 @@ class Token(BaseModel):
     refresh_token: str
     token_type: str
 
-class TokenData(BaseModel):
-    username: Optional[str] = None
-
-# User Management (in production, use a proper database)
-users_db = {}
-users_sessions = {}
+# User Management: SQLite by default, see user_store.create_user_store
+users_db: UserStore = create_user_store()
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """Verify a password against its hash."""
@@ -202,6 +238,14 @@ def get_password_hash(password: str) -> str:
     """Hash a password."""
     return pwd_context.hash(password)
 
+def _hashing_unavailable(error: PasswordHasherOverloadedError) -> HTTPException:
+    """503 for an auth request turned away by the password hashing admission limit"""
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Authentication is busy. Please try again shortly.",
+        headers={"Retry-After": str(error.retry_after)}
+    )
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     """Create JWT access token."""
     to_encode = data.copy()
@@ -210,7 +254,7 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     else:
         expire = datetime.utcnow() + timedelta(minutes=SecurityConfig.ACCESS_TOKEN_EXPIRE_MINUTES)
     
-    to_encode.update({"exp": expire, "type": "access"})
+    to_encode.update({"exp": expire, "type": "access", "jti": secrets.token_hex(16)})
     encoded_jwt = jwt.encode(to_encode, SecurityConfig.SECRET_KEY, algorithm=SecurityConfig.ALGORITHM)
     return encoded_jwt
 
@@ -222,6 +266,37 @@ def create_refresh_token(data: dict):
     encoded_jwt = jwt.encode(to_encode, SecurityConfig.SECRET_KEY, algorithm=SecurityConfig.ALGORITHM)
     return encoded_jwt
 
+def get_sessions():
+    """Refresh token sessions, each kept as long as its refresh token lives."""
+    return get_session_store(SecurityConfig.REFRESH_TOKEN_EXPIRE_DAYS * 24 * 3600)
+
+async def start_session(username: str) -> Token:
+    """Issue tokens for a new login session and record its refresh token."""
+    session_id = secrets.token_hex(16)
+    refresh_jti = secrets.token_hex(16)
+    sessions = get_sessions()
+    if not await sessions.create(username, session_id, refresh_jti):
+        logger.warning("Redis unavailable: refresh token for new session not recorded")
+    return Token(
+        access_token=create_access_token(data={"sub": username, "sid": session_id}),
+        refresh_token=create_refresh_token(data={"sub": username, "sid": session_id, "jti": refresh_jti}),
+        token_type="bearer"
+    )
+
+def decode_access_token(token: str) -> Optional[Dict[str, Any]]:
+    """Claims of a valid access token, or None; verified tokens are cached."""
+    payload = token_cache.get(token)
+    if payload is None:
+        try:
+            payload = jwt.decode(token, SecurityConfig.SECRET_KEY, algorithms=[SecurityConfig.ALGORITHM])
+        except jwt.PyJWTError:
+            return None
+        
+        if payload.get("sub") is None or payload.get("type") != "access":
+            return None
+        token_cache.put(token, payload)
+    return payload
+
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
     """Get current user from JWT token."""
     credentials_exception = HTTPException(
@@ -230,19 +305,18 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
         headers={"WWW-Authenticate": "Bearer"},
     )
     
-    try:
-        payload = jwt.decode(credentials.credentials, SecurityConfig.SECRET_KEY, algorithms=[SecurityConfig.ALGORITHM])
-        username: str = payload.get("sub")
-        token_type: str = payload.get("type")
-        
-        if username is None or token_type != "access":
-            raise credentials_exception
-        
-        token_data = TokenData(username=username)
-    except jwt.PyJWTError:
+    payload = decode_access_token(credentials.credentials)
+    if payload is None:
+        raise credentials_exception
+    
+    # Answered locally unless the token's jti is in the revocation filter
+    revocations = await get_revocation_list()
+    if await revocations.is_revoked(payload.get("jti")):
         raise credentials_exception
     
-    user = users_db.get(username)
+    username: str = payload["sub"]
+    
+    user = await users_db.get_user(username)
     if user is None:
         raise credentials_exception
     
@@ -260,78 +334,82 @@ async def register_user(user: UserCreate):
     """Register a new user."""
     try:
         # Check if user already exists
-        if user.username in users_db:
+        if await users_db.get_user(user.username) is not None:
             raise HTTPException(status_code=400, detail="Username already registered")
         
-        # Hash password
-        hashed_password = get_password_hash(user.password)
+        # Hash password off the event loop
+        try:
+            hashed_password = await get_password_hasher(pwd_context).hash(user.password)
+        except PasswordHasherOverloadedError as e:
+            raise _hashing_unavailable(e)
         
-        # Store user (in production, use proper database)
-        users_db[user.username] = {
+        # Store user; a concurrent registration may have taken the name meanwhile
+        created = await users_db.create_user({
             "username": user.username,
             "email": user.email,
             "hashed_password": hashed_password,
             "is_active": True,
             "created_at": datetime.utcnow().isoformat()
-        }
+        })
+        if not created:
+            raise HTTPException(status_code=400, detail="Username already registered")
         
         # Generate tokens
-        access_token = create_access_token(data={"sub": user.username})
-        refresh_token = create_refresh_token(data={"sub": user.username})
-        
-        # Store refresh token
-        redis_conn = get_redis()
-        if redis_conn:
-            redis_conn.setex(
-                f"refresh_token:{user.username}", 
-                SecurityConfig.REFRESH_TOKEN_EXPIRE_DAYS * 24 * 3600, 
-                refresh_token
-            )
+        tokens = await start_session(user.username)
         
         return {
             "message": "User registered successfully",
             "username": user.username,
-            "access_token": access_token,
-            "refresh_token": refresh_token,
+            "access_token": tokens.access_token,
+            "refresh_token": tokens.refresh_token,
             "token_type": "bearer"
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Registration error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/auth/login", response_model=Token, tags=["Authentication"])
-async def login_user(user_credentials: UserLogin):
+async def login_user(user_credentials: UserLogin, request: Request):
     """Authenticate user and return tokens."""
     try:
-        # Verify user exists
-        user = users_db.get(user_credentials.username)
-        if not user or not verify_password(user_credentials.password, user["hashed_password"]):
+        # Refuse throttled attempts before spending any bcrypt time on them
+        throttle = get_login_throttle()
+        client_ip = request.client.host if request.client else "unknown"
+        try:
+            # Verify user exists; the IP's backoff only applies to unknown or failing usernames
+            user = await users_db.get_user(user_credentials.username)
+            await throttle.check(user_credentials.username, client_ip, known_user=user is not None)
+            
+            valid = False
+            if user is not None:
+                async with throttle.verify_slot():
+                    valid = await get_password_hasher(pwd_context).verify(
+                        user_credentials.password, user["hashed_password"])
+        except LoginThrottledError as e:
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many login attempts. Please try again later.",
+                headers={"Retry-After": str(e.retry_after)}
+            )
+        except PasswordHasherOverloadedError as e:
+            raise _hashing_unavailable(e)
+        if not valid:
+            await throttle.record_failure(user_credentials.username, client_ip)
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Incorrect username or password",
                 headers={"WWW-Authenticate": "Bearer"},
             )
+        await throttle.record_success(user_credentials.username, client_ip)
         
         # Generate tokens
-        access_token = create_access_token(data={"sub": user["username"]})
-        refresh_token = create_refresh_token(data={"sub": user["username"]})
-        
-        # Store refresh token
-        redis_conn = get_redis()
-        if redis_conn:
-            redis_conn.setex(
-                f"refresh_token:{user_credentials.username}", 
-                SecurityConfig.REFRESH_TOKEN_EXPIRE_DAYS * 24 * 3600, 
-                refresh_token
-            )
-        
-        return Token(
-            access_token=access_token,
-            refresh_token=refresh_token,
-            token_type="bearer"
-        )
+        return await start_session(user["username"])
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Login error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -344,25 +422,35 @@ async def refresh_token(refresh_token: str):
         payload = jwt.decode(refresh_token, SecurityConfig.SECRET_KEY, algorithms=[SecurityConfig.ALGORITHM])
         username: str = payload.get("sub")
         token_type: str = payload.get("type")
+        session_id: str = payload.get("sid")
         
-        if username is None or token_type != "refresh":
+        if username is None or token_type != "refresh" or session_id is None or payload.get("jti") is None:
             raise HTTPException(status_code=401, detail="Invalid refresh token")
         
-        # Check if refresh token exists in Redis
-        redis_conn = get_redis()
-        if redis_conn:
-            stored_token = redis_conn.get(f"refresh_token:{username}")
-            if stored_token != refresh_token:
-                raise HTTPException(status_code=401, detail="Invalid refresh token")
-        
-        # Generate new access token
-        access_token = create_access_token(data={"sub": username})
+        # Rotate the session's refresh token; a stale one ends the session
+        new_jti = secrets.token_hex(16)
+        sessions = get_sessions()
+        outcome = await sessions.rotate(username, session_id, payload["jti"], new_jti)
+        if outcome == UNAVAILABLE:
+            # Keep the presented token: an unrecorded new one would look replayed once Redis is back
+            logger.warning("Redis unavailable: refresh token not rotated")
+            return {
+                "access_token": create_access_token(data={"sub": username, "sid": session_id}),
+                "refresh_token": refresh_token,
+                "token_type": "bearer"
+            }
+        if outcome != ROTATED:
+            raise HTTPException(status_code=401, detail="Invalid refresh token")
         
+        # Generate new tokens
         return {
-            "access_token": access_token,
+            "access_token": create_access_token(data={"sub": username, "sid": session_id}),
+            "refresh_token": create_refresh_token(data={"sub": username, "sid": session_id, "jti": new_jti}),
             "token_type": "bearer"
         }
         
+    except HTTPException:
+        raise
     except jwt.PyJWTError:
         raise HTTPException(status_code=401, detail="Invalid refresh token")
     except Exception as e:
@@ -370,13 +458,25 @@ async def refresh_token(refresh_token: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/auth/logout", tags=["Authentication"])
-async def logout_user(current_user: dict = Depends(get_current_active_user)):
-    """Logout user and invalidate tokens."""
+async def logout_user(
+    current_user: dict = Depends(get_current_active_user),
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    all_sessions: bool = False
+):
+    """Logout user and invalidate tokens; all_sessions signs out every device."""
     try:
-        # Remove refresh token from Redis
-        redis_conn = get_redis()
-        if redis_conn:
-            redis_conn.delete(f"refresh_token:{current_user['username']}")
+        # Revoke the access token used for this request until it expires
+        payload = decode_access_token(credentials.credentials)
+        if payload and payload.get("jti"):
+            revocations = await get_revocation_list()
+            await revocations.revoke(payload["jti"], float(payload["exp"]))
+        
+        # End this session's refresh token, or every session's
+        sessions = get_sessions()
+        if all_sessions:
+            await sessions.revoke_all(current_user["username"])
+        elif payload and payload.get("sid"):
+            await sessions.revoke(current_user["username"], payload["sid"])
         
         return {"message": "Successfully logged out"}
         
@@ -392,7 +492,7 @@ async def health_check():
         "status": "healthy",
         "version": "1.0.0",
         "services": {
-            "ai": "operational" if Config.OPENAI_API_KEY else "limited",
+            "ai": "operational" if Config.ai_configured() else "limited",
             "file_system": "operational"
         }
     }
@@ -480,22 +580,63 @@ def get_login_page():
     from fastapi.responses import HTMLResponse
     return HTMLResponse(content=LOGIN_HTML)
 
-# Content generation endpoints
-@app.post("/api/generate", response_model=ContentResponse, tags=["Content Generation"])
-async def generate_content(request: ContentRequest, current_user: dict = Depends(get_current_active_user)):
-    """Generate AI-powered content"""
-    try:
-        if not Config.OPENAI_API_KEY:
-            raise HTTPException(
-                status_code=503,
-                detail="OpenAI API key not configured"
-            )
-        
-        # Configure OpenAI client
-        openai.api_key = Config.OPENAI_API_KEY
-        
-        # Build prompt based on request parameters
-        prompt = f"""Create a comprehensive technical documentation guide about "{request.topic}" for a {request.target_audience} audience.
+# Generation settings shared by the endpoints and the response cache key
+AI_MODEL = os.getenv("LLM_MODEL", "gpt-3.5-turbo")
+GENERATE_MAX_TOKENS = 2000
+CHAT_MAX_TOKENS = 1000  # Shorter responses for chat
+AI_TEMPERATURE = 0.7
+
+# Precedes the error note that ends a streamed generation cut short by upstream
+GENERATE_STREAM_ERROR_MARKER = "<!-- generation-error -->"
+
+GENERATE_SYSTEM_MESSAGE = "You are an expert technical documentation writer. Create clear, accurate, and well-structured documentation."
+
+CHAT_SYSTEM_MESSAGE = """You are an expert homelab assistant specializing in:
+- Docker containerization and orchestration
+- Network configuration and security
+- Storage solutions (ZFS, NAS, RAID)
+- Virtualization (KVM, VMware, LXC)
+- Monitoring and logging (Prometheus, Grafana, ELK)
+- Security best practices
+- System administration
+- Cloud services integration
+
+Provide concise, practical, and accurate advice. Include specific commands, configurations, or step-by-step instructions when relevant. Focus on homelab and self-hosted solutions."""
+
+def get_llm_provider() -> LLMProvider:
+    """The configured chat completion backend"""
+    return create_provider(Config.LLM_PROVIDER, Config.OPENAI_API_BASE, Config.OPENAI_API_KEY, AI_MODEL)
+
+async def call_openai(messages: List[Dict[str, str]], max_tokens: int, temperature: float = AI_TEMPERATURE,
+                      priority: int = PRIORITY_INTERACTIVE) -> str:
+    """
+    Call the chat completion API through the scheduler and the configured provider.
+    
+    Failures are not retried here: timeouts and 5xx already count against
+    the connection pool's circuit breaker and concurrency limit, and
+    retrying them would multiply load on a struggling upstream.
+    """
+    async with get_scheduler().slot(priority, estimate_tokens(messages, max_tokens)) as ticket:
+        completion = await get_llm_provider().complete(messages, max_tokens, temperature)
+        ticket.used_tokens = completion.total_tokens
+    return completion.content
+
+async def stream_openai(messages: List[Dict[str, str]], max_tokens: int, temperature: float = AI_TEMPERATURE,
+                        priority: int = PRIORITY_INTERACTIVE) -> AsyncIterator[str]:
+    """Stream a chat completion, yielding content deltas as they arrive"""
+    # The slot is held until the stream ends; streamed usage is not reported,
+    # so the estimate stands
+    async with get_scheduler().slot(priority, estimate_tokens(messages, max_tokens)):
+        deltas = get_llm_provider().stream(messages, max_tokens, temperature)
+        try:
+            async for delta in deltas:
+                yield delta
+        finally:
+            await deltas.aclose()
+
+def build_generate_prompt(request: "ContentRequest") -> str:
+    """Build the documentation prompt for a content request"""
+    return f"""Create a comprehensive technical documentation guide about "{request.topic}" for a {request.target_audience} audience.
         
 Content type: {request.content_type}
 Desired length: {request.length}
@@ -511,29 +652,179 @@ Please create well-structured markdown content that includes:
 6. Related topics and further reading
 
 Format the response in clean markdown with proper headers, code blocks, and formatting."""
+
+def chat_page_context(context: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Page context fields that shape the chat prompt (and its cache key)"""
+    if not context:
+        return {}
+    return {
+        "page_title": context.get('page_title', 'Unknown'),
+        "page_url": context.get('page_url', '/'),
+        "headings": context.get('headings', 'None')
+    }
+
+def build_chat_messages(message: str, page_context: Dict[str, Any]) -> List[Dict[str, str]]:
+    """Build the chat conversation for a user message"""
+    messages = [
+        {"role": "system", "content": CHAT_SYSTEM_MESSAGE},
+    ]
+    
+    # Add context if available
+    if page_context:
+        context_info = f"""
+Current Page Context:
+- Page: {page_context['page_title']}
+- URL: {page_context['page_url']}
+- Section Headings: {page_context['headings']}
+
+"""
+        messages.append({
+            "role": "system", 
+            "content": context_info + "\nUser is asking about something related to the above context."
+        })
+    
+    # Add user message
+    messages.append({
+        "role": "user", 
+        "content": message
+    })
+    return messages
+
+async def _generate_once(prompt: str, cache_params: Dict[str, Any], upstream_call) -> str:
+    """
+    Single-flight a cache miss: identical concurrent prompts share one upstream
+    call, and the leader fills the cache before waiters are released.
+    """
+    async def fill():
+        content = await upstream_call()
+        cache = await get_cache()
+        await cache.set(prompt, content, AI_MODEL, **cache_params)
+        return content
+    
+    deduplicator = await get_deduplicator()
+    return await deduplicator.execute_or_wait(prompt, AI_MODEL, fill, **cache_params)
+
+async def _stream_once(prompt: str, cache_params: Dict[str, Any], open_stream) -> AsyncIterator[str]:
+    """
+    Single-flight a streamed cache miss.
+    
+    The caller that leads the flight relays upstream deltas as they arrive
+    and the completed text is cached. Identical requests arriving meanwhile,
+    on this worker or another, wait for the finished text and receive it as
+    one chunk. The shared flight outlives a disconnecting leader, so its
+    followers still get an answer.
+    """
+    deltas: asyncio.Queue = asyncio.Queue()
+    
+    async def fill():
+        chunks = []
+        upstream = open_stream()
+        try:
+            async for delta in upstream:
+                chunks.append(delta)
+                deltas.put_nowait(delta)
+        finally:
+            await upstream.aclose()
+        content = "".join(chunks)
+        cache = await get_cache()
+        await cache.set(prompt, content, AI_MODEL, **cache_params)
+        return content
+    
+    deduplicator = await get_deduplicator()
+    flight = asyncio.ensure_future(deduplicator.execute_or_wait(prompt, AI_MODEL, fill, **cache_params))
+    next_delta = None
+    relayed = False
+    try:
+        while not flight.done():
+            next_delta = asyncio.ensure_future(deltas.get())
+            await asyncio.wait({flight, next_delta}, return_when=asyncio.FIRST_COMPLETED)
+            if not next_delta.done():
+                break
+            relayed = True
+            yield next_delta.result()
         
-        # Call OpenAI API with retry logic
-        @retry(
-            stop=stop_after_attempt(3),
-            wait=wait_exponential(multiplier=1, min=4, max=10)
-        )
-        async def call_openai():
-            response = await openai.ChatCompletion.acreate(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {"role": "system", "content": "You are an expert technical documentation writer. Create clear, accurate, and well-structured documentation."},
-                    {"role": "user", "content": prompt}
-                ],
-                max_tokens=2000,
-                temperature=0.7,
-                top_p=0.9,
-                frequency_penalty=0.1,
-                presence_penalty=0.1
+        while not deltas.empty():
+            relayed = True
+            yield deltas.get_nowait()
+        
+        content = flight.result()
+        if not relayed:
+            yield content
+    finally:
+        # Only this caller's wait is cancelled; the shared flight carries on
+        flight.cancel()
+        if next_delta is not None:
+            next_delta.cancel()
+
+def _service_unavailable(error: UpstreamOverloadedError) -> HTTPException:
+    """503 for a request shed by the upstream concurrency limit"""
+    logger.warning(f"Shedding AI request: {error.error}")
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="AI service is busy. Please try again shortly.",
+        headers={"Retry-After": str(error.retry_after)}
+    )
+
+def _cache_status(content: Optional[str], stale: bool) -> str:
+    """X-Cache header value for a response cache lookup"""
+    if content is None:
+        return "MISS"
+    return "STALE" if stale else "HIT"
+
+async def _refresh_stale_entry(prompt: str, cache_params: Dict[str, Any], upstream_call):
+    """
+    Regenerate a stale cache entry after its response has been sent.
+    
+    The refresh goes through the same single flight as a miss, so concurrent
+    stale hits on one prompt cost one upstream call.
+    """
+    try:
+        await _generate_once(prompt, cache_params, upstream_call)
+    except Exception as e:
+        # The stale entry keeps being served until its grace period ends
+        logger.warning(f"Background cache refresh failed: {e}")
+
+# Content generation endpoints
+@app.post("/api/generate", response_model=ContentResponse, tags=["Content Generation"])
+async def generate_content(request: ContentRequest, response: Response, background_tasks: BackgroundTasks,
+                           current_user: dict = Depends(get_current_active_user)):
+    """Generate AI-powered content"""
+    try:
+        if not Config.ai_configured():
+            raise HTTPException(
+                status_code=503,
+                detail="OpenAI API key not configured"
+            )
+        
+        # Build prompt based on request parameters
+        prompt = build_generate_prompt(request)
+        cache_params = {"max_tokens": GENERATE_MAX_TOKENS, "temperature": AI_TEMPERATURE}
+        
+        messages = [
+            {"role": "system", "content": GENERATE_SYSTEM_MESSAGE},
+            {"role": "user", "content": prompt}
+        ]
+        
+        # Serve identical prompts from the response cache
+        cache = await get_cache()
+        content, stale = await cache.get_entry(prompt, AI_MODEL, **cache_params) or (None, False)
+        
+        async def upstream_call():
+            return await call_openai(messages, max_tokens=GENERATE_MAX_TOKENS, priority=PRIORITY_BULK)
+        
+        if stale:
+            background_tasks.add_task(_refresh_stale_entry, prompt, cache_params, upstream_call)
+        
+        if request.stream:
+            return StreamingResponse(
+                _stream_generated_content(prompt, messages, cache_params, content),
+                media_type="text/markdown; charset=utf-8",
+                headers={"X-Cache": _cache_status(content, stale)}
             )
-            return response.choices[0].message.content
         
-        # Generate content
-        content = await call_openai()
+        response.headers["X-Cache"] = _cache_status(content, stale)
+        if content is None:
+            content = await _generate_once(prompt, cache_params, upstream_call)
         
         metadata = {
             "topic": request.topic,
@@ -556,84 +847,75 @@ Format the response in clean markdown with proper headers, code blocks, and form
             suggestions=suggestions
         )
         
+    except HTTPException:
+        raise
+    except UpstreamOverloadedError as e:
+        raise _service_unavailable(e)
     except Exception as e:
         logger.error(f"Content generation error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+def _generate_stream_error(message: str) -> str:
+    """Markdown that ends an interrupted generation stream, marked for clients to detect"""
+    return f"\n\n{GENERATE_STREAM_ERROR_MARKER}\n> **Error:** {message}\n"
+
+async def _stream_generated_content(prompt: str, messages: List[Dict[str, str]],
+                                    cache_params: Dict[str, Any], cached: Optional[str]) -> AsyncIterator[str]:
+    """
+    Relay generated markdown as it streams in, single-flighted with identical
+    requests and caching the completed text.
+    
+    The status line has been sent by the time upstream can fail, so a
+    failure ends the body with an error note instead of an error status.
+    """
+    if cached is not None:
+        yield cached
+        return
+    
+    def open_stream():
+        return stream_openai(messages, max_tokens=GENERATE_MAX_TOKENS, priority=PRIORITY_BULK)
+    
+    try:
+        async for delta in _stream_once(prompt, cache_params, open_stream):
+            yield delta
+    except UpstreamOverloadedError:
+        yield _generate_stream_error("AI service is busy. Please try again shortly.")
+    except Exception as e:
+        logger.error(f"Content generation stream error: {e}")
+        yield _generate_stream_error("AI response failed. Please try again.")
+
 @app.post("/api/ai/chat", tags=["AI Chat"])
-async def ai_chat(request: AIChatRequest, current_user: dict = Depends(get_current_active_user)):
+async def ai_chat(request: AIChatRequest, response: Response, background_tasks: BackgroundTasks,
+                  current_user: dict = Depends(get_current_active_user)):
     """AI chat endpoint for real-time assistance"""
     try:
-        if not Config.OPENAI_API_KEY:
+        if not Config.ai_configured():
             raise HTTPException(
                 status_code=503,
                 detail="OpenAI API key not configured"
             )
         
-        # Configure OpenAI client
-        openai.api_key = Config.OPENAI_API_KEY
-        
-        # Build context-aware prompt
-        context_info = ""
-        if request.context:
-            context_info = f"""
-Current Page Context:
-- Page: {request.context.get('page_title', 'Unknown')}
-- URL: {request.context.get('page_url', '/')}
-- Section Headings: {request.context.get('headings', 'None')}
-
-"""
-        
-        # Build system message for homelab assistance
-        system_message = """You are an expert homelab assistant specializing in:
-- Docker containerization and orchestration
-- Network configuration and security
-- Storage solutions (ZFS, NAS, RAID)
-- Virtualization (KVM, VMware, LXC)
-- Monitoring and logging (Prometheus, Grafana, ELK)
-- Security best practices
-- System administration
-- Cloud services integration
-
-Provide concise, practical, and accurate advice. Include specific commands, configurations, or step-by-step instructions when relevant. Focus on homelab and self-hosted solutions."""
-
-        # Build conversation history (simplified for now)
-        messages = [
-            {"role": "system", "content": system_message},
-        ]
+        # Build context-aware conversation
+        page_context = chat_page_context(request.context)
+        cache_params = {
+            "max_tokens": CHAT_MAX_TOKENS,
+            "temperature": AI_TEMPERATURE,
+            "context": page_context
+        }
         
-        # Add context if available
-        if context_info:
-            messages.append({
-                "role": "system", 
-                "content": context_info + "\nUser is asking about something related to the above context."
-            })
+        # Serve repeated questions about the same page from the response cache
+        cache = await get_cache()
+        response_content, stale = await cache.get_entry(request.message, AI_MODEL, **cache_params) or (None, False)
+        messages = build_chat_messages(request.message, page_context)
         
-        # Add user message
-        messages.append({
-            "role": "user", 
-            "content": request.message
-        })
+        async def upstream_call():
+            return await call_openai(messages, max_tokens=CHAT_MAX_TOKENS)
         
-        # Call OpenAI API with retry logic
-        @retry(
-            stop=stop_after_attempt(3),
-            wait=wait_exponential(multiplier=1, min=4, max=10)
-        )
-        async def call_openai():
-            response = await openai.ChatCompletion.acreate(
-                model="gpt-3.5-turbo",
-                messages=messages,
-                max_tokens=1000,  # Shorter responses for chat
-                temperature=0.7,
-                top_p=0.9,
-                frequency_penalty=0.1,
-                presence_penalty=0.1
-            )
-            return response.choices[0].message.content
-        
-        # Generate response
-        response_content = await call_openai()
+        response.headers["X-Cache"] = _cache_status(response_content, stale)
+        if stale:
+            background_tasks.add_task(_refresh_stale_entry, request.message, cache_params, upstream_call)
+        elif response_content is None:
+            response_content = await _generate_once(request.message, cache_params, upstream_call)
         
         # Log the interaction for monitoring
         logger.info(f"AI Chat - User: {current_user['username']}, Message: {request.message[:100]}...")
@@ -644,10 +926,117 @@ Provide concise, practical, and accurate advice. Include specific commands, conf
             "user": current_user['username']
         }
         
+    except HTTPException:
+        raise
+    except UpstreamOverloadedError as e:
+        raise _service_unavailable(e)
     except Exception as e:
         logger.error(f"AI Chat error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+def _sse_event(event: str, data: Dict[str, Any]) -> str:
+    """Format a server-sent event frame"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+async def _stream_chat_events(request: Request, chat_request: AIChatRequest, current_user: dict,
+                              cache_params: Dict[str, Any], cached: Optional[str]) -> AsyncIterator[str]:
+    """
+    Relay chat tokens as server-sent events.
+    
+    Cache misses are single-flighted: concurrent identical questions share
+    one upstream stream. If the client disconnects it stops receiving
+    frames, while the shared generation finishes for any other waiters and
+    fills the cache.
+    """
+    start_time = time.time()
+    chunks = []
+    try:
+        if cached is not None:
+            chunks.append(cached)
+            yield _sse_event("token", {"content": cached})
+        else:
+            def open_stream():
+                return stream_openai(build_chat_messages(chat_request.message, cache_params["context"]),
+                                     max_tokens=CHAT_MAX_TOKENS)
+            
+            deltas = _stream_once(chat_request.message, cache_params, open_stream)
+            try:
+                async for delta in deltas:
+                    if await request.is_disconnected():
+                        logger.info(f"AI Chat stream cancelled by client - User: {current_user['username']}")
+                        return
+                    chunks.append(delta)
+                    yield _sse_event("token", {"content": delta})
+            finally:
+                await deltas.aclose()
+        
+        logger.info(f"AI Chat stream - User: {current_user['username']}, Message: {chat_request.message[:100]}...")
+        
+        yield _sse_event("done", {
+            "timestamp": datetime.utcnow().isoformat(),
+            "user": current_user['username'],
+            "cached": cached is not None,
+            "chunks": len(chunks),
+            "duration_ms": round((time.time() - start_time) * 1000)
+        })
+        
+    except UpstreamOverloadedError as e:
+        yield _sse_event("error", {"error": "AI service is busy. Please try again shortly.",
+                                   "retry_after": e.retry_after})
+    except Exception as e:
+        logger.error(f"AI Chat stream error: {e}")
+        yield _sse_event("error", {"error": "AI response failed. Please try again."})
+
+@app.post("/api/ai/chat/stream", tags=["AI Chat"])
+async def ai_chat_stream(chat_request: AIChatRequest, request: Request, background_tasks: BackgroundTasks,
+                         current_user: dict = Depends(get_current_active_user)):
+    """AI chat endpoint that streams tokens as server-sent events"""
+    if not Config.ai_configured():
+        raise HTTPException(
+            status_code=503,
+            detail="OpenAI API key not configured"
+        )
+    
+    page_context = chat_page_context(chat_request.context)
+    cache_params = {
+        "max_tokens": CHAT_MAX_TOKENS,
+        "temperature": AI_TEMPERATURE,
+        "context": page_context
+    }
+    
+    cache = await get_cache()
+    cached, stale = await cache.get_entry(chat_request.message, AI_MODEL, **cache_params) or (None, False)
+    if stale:
+        messages = build_chat_messages(chat_request.message, page_context)
+        
+        async def upstream_call():
+            return await call_openai(messages, max_tokens=CHAT_MAX_TOKENS)
+        
+        background_tasks.add_task(_refresh_stale_entry, chat_request.message, cache_params, upstream_call)
+    
+    return StreamingResponse(
+        _stream_chat_events(request, chat_request, current_user, cache_params, cached),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",  # Disable nginx response buffering
+            "X-Cache": _cache_status(cached, stale)
+        }
+    )
+
+@app.get("/api/ai/stats", tags=["AI Chat"])
+async def ai_statistics(current_user: dict = Depends(get_current_active_user)):
+    """Get AI response cache, deduplication, upstream scheduling and connection metrics"""
+    cache = await get_cache()
+    pool = await get_connection_pool()
+    deduplicator = await get_deduplicator()
+    return {
+        "cache": await cache.get_stats(),
+        "deduplication": deduplicator.get_stats(),
+        "scheduler": get_scheduler().get_stats(),
+        "connections": pool.get_stats()
+    }
+
 # File management endpoints
 @app.get("/api/files", tags=["File Management"])
 async def list_files(path: str = ""):
@@ -834,6 +1223,19 @@ async def get_statistics():
         logger.error(f"Statistics error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Release shared connections on shutdown"""
+    await rate_limiter.close()
+    await close_cache()
+    await close_deduplicator()
+    await close_connection_pool()
+    close_scheduler()
+    close_password_hasher()
+    users_db.close()
+    await close_revocation_list()
+    await close_async_redis()
+
 # Error handlers
 @app.exception_handler(404)
 async def not_found_handler(request, exc):
@@ -855,5 +1257,8 @@ if __name__ == "__main__":
         host="0.0.0.0",
         port=8000,
         reload=True,
-        log_level="info"
+        log_level="info",
+        # Take the client address from nginx's X-Forwarded-For
+        proxy_headers=True,
+        forwarded_allow_ips=os.getenv("FORWARDED_ALLOW_IPS", "127.0.0.1")
     )
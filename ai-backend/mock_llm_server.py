@@ -0,0 +1,174 @@
+"""
+AI Backend Mock LLM Server
+Deterministic OpenAI-compatible chat completions server for offline load tests
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import random
+import time
+from typing import Any, Dict, List, Optional
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+# Words replies are built from; one word is one completion token
+VOCABULARY = (
+    "docker", "container", "volume", "network", "bridge", "proxy", "nginx", "traefik", "certificate",
+    "zfs", "pool", "snapshot", "backup", "raid", "mirror", "disk", "vm", "kvm", "proxmox", "lxc",
+    "prometheus", "grafana", "alert", "metric", "dashboard", "firewall", "vlan", "dns", "dhcp",
+    "configure", "install", "enable", "restart", "check", "the", "a", "your", "with", "and", "then",
+    "service", "port", "host", "config", "file", "directory", "permissions", "user", "group", "log"
+)
+
+class MockLLMServer:
+    """
+    Serves /v1/chat/completions with scripted timing.
+
+    Each response waits `latency` seconds (plus up to `jitter`), then
+    produces `reply_tokens` tokens (capped by max_tokens) at
+    `tokens_per_second`, or all at once when that is 0. A fraction
+    `error_rate` of requests fail with `error_status` instead. Reply text
+    depends only on the request body and errors and jitter on the request
+    sequence, both seeded, so runs with the same seed and request order are
+    reproducible.
+    """
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, tokens_per_second: float = 0.0,
+                 reply_tokens: int = 64, error_rate: float = 0.0, error_status: int = 503, seed: int = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.tokens_per_second = tokens_per_second
+        self.reply_tokens = reply_tokens
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.seed = seed
+        self._sequence = random.Random(seed)
+        self._runner: Optional[web.AppRunner] = None
+        self.port: Optional[int] = None
+        self._stats = {
+            'requests': 0,
+            'errors': 0,
+            'streams': 0,
+            'completion_tokens': 0
+        }
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}/v1"
+
+    def reply(self, body: Dict[str, Any]) -> List[str]:
+        """Completion tokens for a request body"""
+        digest = hashlib.sha256(json.dumps(body.get("messages", []), sort_keys=True).encode()).digest()
+        rng = random.Random(int.from_bytes(digest[:8], "big") ^ self.seed)
+        count = min(self.reply_tokens, body.get("max_tokens") or self.reply_tokens)
+        words = [rng.choice(VOCABULARY) for _ in range(count)]
+        return [word if i == 0 else " " + word for i, word in enumerate(words)]
+
+    async def _chat_completions(self, request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        self._stats['requests'] += 1
+        # Draw both values for every request so the sequence does not depend on the configuration
+        delay = self.latency + self._sequence.random() * self.jitter
+        failed = self._sequence.random() < self.error_rate
+        if delay:
+            await asyncio.sleep(delay)
+
+        if failed:
+            self._stats['errors'] += 1
+            return web.json_response({"error": {"message": "Mock upstream failure", "type": "server_error"}},
+                                     status=self.error_status)
+
+        tokens = self.reply(body)
+        prompt_tokens = sum(len(m.get("content", "").split()) for m in body.get("messages", []))
+        self._stats['completion_tokens'] += len(tokens)
+        interval = 1 / self.tokens_per_second if self.tokens_per_second else 0.0
+
+        if not body.get("stream"):
+            if interval:
+                await asyncio.sleep(interval * len(tokens))
+            return web.json_response({
+                "id": f"mock-{self._stats['requests']}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body.get("model", "mock"),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(tokens)},
+                             "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": len(tokens),
+                          "total_tokens": prompt_tokens + len(tokens)}
+            })
+
+        self._stats['streams'] += 1
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        for token in tokens:
+            if interval:
+                await asyncio.sleep(interval)
+            chunk = {"object": "chat.completion.chunk", "model": body.get("model", "mock"),
+                     "choices": [{"index": 0, "delta": {"content": token}}]}
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode())
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/v1/chat/completions", self._chat_completions)
+        return app
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> "MockLLMServer":
+        """Serve on the running event loop; port 0 picks a free port"""
+        self._runner = web.AppRunner(self.app())
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        logger.info(f"Mock LLM server listening on {self.base_url}")
+        return self
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get server statistics"""
+        return self._stats.copy()
+
+    def reset_stats(self):
+        """Reset statistics"""
+        self._stats = {key: 0 for key in self._stats}
+
+async def serve(server: MockLLMServer, host: str, port: int):
+    await server.start(host, port)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a mock OpenAI-compatible LLM server "
+                                                 "(point the backend at it with LLM_PROVIDER=local)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds before the first token")
+    parser.add_argument("--jitter", type=float, default=0.0, help="extra random latency, up to this many seconds")
+    parser.add_argument("--tokens-per-second", type=float, default=50.0, help="0 sends every token at once")
+    parser.add_argument("--reply-tokens", type=int, default=64)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    mock = MockLLMServer(latency=args.latency, jitter=args.jitter, tokens_per_second=args.tokens_per_second,
+                         reply_tokens=args.reply_tokens, error_rate=args.error_rate,
+                         error_status=args.error_status, seed=args.seed)
+    try:
+        asyncio.run(serve(mock, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,141 @@
+"""
+AI Backend Password Hasher
+Runs bcrypt on a bounded thread pool so hashing never blocks the event loop
+"""
+
+import asyncio
+import logging
+import math
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+from passlib.context import CryptContext
+
+logger = logging.getLogger(__name__)
+
+class PasswordHasherOverloadedError(Exception):
+    """Raised when too many hashes are already waiting for a worker"""
+
+    def __init__(self, retry_after: int):
+        super().__init__("Password hashing capacity exhausted")
+        self.retry_after = retry_after
+
+class PasswordHasher:
+    """
+    Hashes and verifies passwords on a dedicated thread pool.
+
+    bcrypt releases the GIL while it works, so `workers` threads hash in
+    parallel on as many cores. At most `max_pending` calls may be running or
+    queued; beyond that calls fail at once with
+    PasswordHasherOverloadedError rather than queueing for seconds behind a
+    login storm.
+    """
+
+    def __init__(self, context: CryptContext, workers: Optional[int] = None, max_pending: Optional[int] = None):
+        self.context = context
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = max_pending or self.workers * 8
+        self.pending = 0
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._stats = {
+            'hashes': 0,
+            'verifies': 0,
+            'rejected': 0,
+            'peak_pending': 0,
+            'total_wait_time': 0.0,
+            'total_hash_time': 0.0
+        }
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="password-hasher")
+        return self._executor
+
+    def retry_after(self) -> int:
+        """Seconds until the queue ahead of a new call has likely drained"""
+        calls = self._stats['hashes'] + self._stats['verifies']
+        average = self._stats['total_hash_time'] / calls if calls else 0.25
+        return max(1, math.ceil(self.pending / self.workers * average))
+
+    async def _run(self, function: Callable[..., Any], *args) -> Any:
+        if self.pending >= self.max_pending:
+            self._stats['rejected'] += 1
+            raise PasswordHasherOverloadedError(self.retry_after())
+
+        self.pending += 1
+        self._stats['peak_pending'] = max(self._stats['peak_pending'], self.pending)
+        submitted = time.perf_counter()
+        started = None
+
+        def timed():
+            nonlocal started
+            started = time.perf_counter()
+            return function(*args)
+
+        def finished(_):
+            self.pending -= 1
+            if started is not None:
+                self._stats['total_wait_time'] += started - submitted
+                self._stats['total_hash_time'] += time.perf_counter() - started
+
+        future = asyncio.get_running_loop().run_in_executor(self._get_executor(), timed)
+        future.add_done_callback(finished)
+        # A cancelled caller cannot stop a running hash; it still counts until done
+        return await asyncio.shield(future)
+
+    async def hash(self, password: str) -> str:
+        """Hash a password"""
+        hashed = await self._run(self.context.hash, password)
+        self._stats['hashes'] += 1
+        return hashed
+
+    async def verify(self, password: str, hashed_password: str) -> bool:
+        """Verify a password against its hash"""
+        valid = await self._run(self.context.verify, password, hashed_password)
+        self._stats['verifies'] += 1
+        return valid
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get hashing statistics"""
+        calls = self._stats['hashes'] + self._stats['verifies']
+        return {
+            **self._stats,
+            'workers': self.workers,
+            'max_pending': self.max_pending,
+            'pending': self.pending,
+            'average_wait_time': self._stats['total_wait_time'] / calls if calls else 0,
+            'average_hash_time': self._stats['total_hash_time'] / calls if calls else 0
+        }
+
+    def reset_stats(self):
+        """Reset statistics"""
+        self._stats = {key: type(value)() for key, value in self._stats.items()}
+
+    def close(self):
+        """Stop the worker threads once queued work is done"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+# Global hasher instance
+_password_hasher: Optional[PasswordHasher] = None
+
+def get_password_hasher(context: CryptContext) -> PasswordHasher:
+    """Get or create the global password hasher for a passlib context"""
+    global _password_hasher
+
+    if _password_hasher is None:
+        workers = int(os.getenv('PASSWORD_HASH_WORKERS', '0')) or None
+        max_pending = int(os.getenv('PASSWORD_HASH_MAX_PENDING', '0')) or None
+        _password_hasher = PasswordHasher(context, workers=workers, max_pending=max_pending)
+    return _password_hasher
+
+def close_password_hasher():
+    """Shut down the global password hasher"""
+    global _password_hasher
+
+    if _password_hasher:
+        _password_hasher.close()
+        _password_hasher = None
@@ -0,0 +1,453 @@
+"""
+AI Backend Rate Limiter
+Pluggable rate limiting engines backed by atomic Redis Lua scripts
+"""
+
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from redis.exceptions import NoScriptError
+
+from redis_pool import RedisScript, get_async_redis
+
+logger = logging.getLogger(__name__)
+
+class RateLimitRule(NamedTuple):
+    """Limit of `limit` requests per `window` seconds using `algorithm`"""
+    limit: int
+    window: int
+    algorithm: str = "sliding_window"
+    burst: Optional[int] = None  # Token bucket capacity, defaults to limit
+
+class RateLimitResult(NamedTuple):
+    """Outcome of a single rate limit check"""
+    allowed: bool
+    limit: int
+    remaining: int
+    retry_after: float  # Seconds until the next request would be allowed
+
+class RateLimitEngine:
+    """
+    Base class for rate limiting algorithms.
+
+    Each engine is one Lua script, so a check is a single atomic round trip.
+    Scripts return {allowed, remaining, retry_after_ms}. With `force` set the
+    cost is recorded even when it exceeds the limit, which is used to
+    reconcile requests that were already admitted locally.
+    """
+
+    script: RedisScript
+
+    def keys(self, key: str, rule: RateLimitRule):
+        return [key]
+
+    def args(self, rule: RateLimitRule, cost: int, force: bool):
+        raise NotImplementedError
+
+    async def acquire(self, redis_conn, key: str, rule: RateLimitRule, cost: int = 1,
+                      force: bool = False) -> RateLimitResult:
+        """Consume `cost` units for `key` if the rule allows it"""
+        raw = await self.script(redis_conn, self.keys(key, rule), self.args(rule, cost, force))
+        return self.parse(raw, rule)
+
+    def queue(self, pipe, key: str, rule: RateLimitRule, cost: int = 1, force: bool = False):
+        """Queue a check on a pipeline; the script must already be loaded"""
+        keys = self.keys(key, rule)
+        pipe.evalsha(self.script.sha, len(keys), *keys, *self.args(rule, cost, force))
+
+    def parse(self, raw, rule: RateLimitRule) -> RateLimitResult:
+        allowed, remaining, retry_after_ms = raw
+        return RateLimitResult(
+            allowed=bool(allowed),
+            limit=rule.limit,
+            remaining=max(0, int(remaining)),
+            retry_after=int(retry_after_ms) / 1000
+        )
+
+class FixedWindowEngine(RateLimitEngine):
+    """
+    Fixed window counter: INCRBY and EXPIRE in one script.
+    Cheapest engine, but allows up to 2x bursts at window edges.
+    """
+
+    script = RedisScript("""
+local current = redis.call('INCRBY', KEYS[1], ARGV[3])
+if current == tonumber(ARGV[3]) then
+    redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+local limit = tonumber(ARGV[1])
+if current > limit and ARGV[4] ~= '1' then
+    return {0, 0, redis.call('PTTL', KEYS[1])}
+end
+return {1, limit - current, 0}
+""")
+
+    def args(self, rule: RateLimitRule, cost: int, force: bool):
+        return [rule.limit, rule.window, cost, int(force)]
+
+class SlidingWindowEngine(RateLimitEngine):
+    """
+    Sliding window counter: weights the previous window's count by how much
+    of it still overlaps the sliding window. Smooths the edge bursts of a
+    fixed window with two counters per client instead of a full request log.
+    Both counters live in one hash, with the index of the current window, so
+    the script only touches the key it is given.
+    """
+
+    script = RedisScript("""
+local limit = tonumber(ARGV[1])
+local window = tonumber(ARGV[2]) * 1000
+local cost = tonumber(ARGV[3])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+local index = math.floor(now / window)
+local elapsed = now - index * window
+local state = redis.call('HMGET', KEYS[1], 'index', 'current', 'previous')
+local stored = tonumber(state[1])
+local current = 0
+local previous = 0
+if stored == index then
+    current = tonumber(state[2]) or 0
+    previous = tonumber(state[3]) or 0
+elseif stored == index - 1 then
+    previous = tonumber(state[2]) or 0
+end
+local weight = (window - elapsed) / window
+local estimated = previous * weight + current
+if estimated + cost > limit and ARGV[4] ~= '1' then
+    local retry_after = window - elapsed
+    if previous > 0 and current + cost <= limit then
+        -- Wait until enough of the previous window has slid out
+        local needed = (estimated + cost - limit) / previous
+        retry_after = math.ceil(needed * window)
+    end
+    return {0, math.max(0, math.floor(limit - estimated)), retry_after}
+end
+redis.call('HSET', KEYS[1], 'index', index, 'current', current + cost, 'previous', previous)
+redis.call('PEXPIRE', KEYS[1], window * 2)
+return {1, math.floor(limit - estimated - cost), 0}
+""")
+
+    def args(self, rule: RateLimitRule, cost: int, force: bool):
+        return [rule.limit, rule.window, cost, int(force)]
+
+class TokenBucketEngine(RateLimitEngine):
+    """
+    Token bucket: refills at limit/window tokens per second up to `burst`.
+    Allows short bursts while enforcing the long-run rate exactly.
+    """
+
+    script = RedisScript("""
+local rate = tonumber(ARGV[1]) / tonumber(ARGV[2])
+local capacity = tonumber(ARGV[3])
+local cost = tonumber(ARGV[4])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local allowed = 0
+local retry_after = 0
+if tokens >= cost then
+    tokens = tokens - cost
+    allowed = 1
+elseif ARGV[5] == '1' then
+    tokens = 0
+    allowed = 1
+else
+    retry_after = math.ceil((cost - tokens) / rate * 1000)
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / rate * 1000))
+return {allowed, math.floor(tokens), retry_after}
+""")
+
+    def args(self, rule: RateLimitRule, cost: int, force: bool):
+        return [rule.limit, rule.window, rule.burst or rule.limit, cost, int(force)]
+
+ENGINES: Dict[str, RateLimitEngine] = {
+    "fixed_window": FixedWindowEngine(),
+    "sliding_window": SlidingWindowEngine(),
+    "token_bucket": TokenBucketEngine(),
+}
+
+class _LocalCounter:
+    """Per-key state kept by the local tier"""
+
+    __slots__ = ("rule", "remaining", "pending", "synced_at", "retry_after")
+
+    def __init__(self, rule: RateLimitRule):
+        self.rule = rule
+        self.remaining = 0
+        self.pending = 0
+        self.synced_at = 0.0
+        self.retry_after = 0.0
+
+class LocalCounterTier:
+    """
+    In-process first tier in front of the Redis engines.
+
+    Keeps the last Redis-reported budget for recently seen clients in a
+    bounded LRU and admits requests locally while the client is well inside
+    its limit. Locally admitted requests are reconciled to Redis as batched,
+    pipelined deltas every `sync_interval_ms`.
+
+    In exact mode a key may admit at most `local_fraction` of its limit
+    between syncs, and only while the budget stays above that margin, so each
+    worker overshoots by at most that fraction per sync interval. In
+    approximate mode the whole remaining budget is spent locally and
+    over-limit clients are rejected locally until the next sync.
+    """
+
+    def __init__(self, max_entries: int = 10000, sync_interval_ms: int = 250,
+                 local_fraction: float = 0.1, approximate: bool = False):
+        self.max_entries = max_entries
+        self.sync_interval = sync_interval_ms / 1000
+        self.local_fraction = local_fraction
+        self.approximate = approximate
+        self.entries: "OrderedDict[str, _LocalCounter]" = OrderedDict()
+        self._evicted: List[Tuple[str, RateLimitRule, int]] = []
+        self._sync_task: Optional[asyncio.Task] = None
+        self._stats = {
+            'local_hits': 0,
+            'local_rejections': 0,
+            'redis_checks': 0,
+            'sync_batches': 0,
+            'synced_keys': 0,
+            'evictions': 0
+        }
+
+    def _start_sync_task(self):
+        """Start the background reconciliation task on the running loop"""
+        if (self._sync_task is None or self._sync_task.done()
+                or self._sync_task.get_loop() is not asyncio.get_running_loop()):
+            self._sync_task = asyncio.create_task(self._sync_loop())
+
+    async def _sync_loop(self):
+        # A client library may swallow the CancelledError raised inside a
+        # flush; the task's pending cancellation still ends the loop
+        task = asyncio.current_task()
+        while not task.cancelling():
+            try:
+                await asyncio.sleep(self.sync_interval)
+                await self.flush()
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"Rate limit sync error: {e}")
+
+    def try_local(self, key: str, rule: RateLimitRule, cost: int) -> Optional[RateLimitResult]:
+        """
+        Decide locally if possible.
+        Returns None when the request must be checked against Redis.
+        """
+        self._start_sync_task()
+
+        entry = self.entries.get(key)
+        if entry is None or entry.rule != rule:
+            return None
+        self.entries.move_to_end(key)
+
+        age = time.monotonic() - entry.synced_at
+        if age > rule.window:
+            return None
+
+        estimated = entry.remaining - entry.pending
+        if self.approximate:
+            if estimated >= cost:
+                entry.pending += cost
+                self._stats['local_hits'] += 1
+                return RateLimitResult(True, rule.limit, estimated - cost, 0.0)
+            if age < self.sync_interval:
+                self._stats['local_rejections'] += 1
+                return RateLimitResult(False, rule.limit, 0, max(entry.retry_after, self.sync_interval))
+            return None
+
+        quota = max(1, int(rule.limit * self.local_fraction))
+        if entry.pending + cost <= quota and estimated - cost >= quota:
+            entry.pending += cost
+            self._stats['local_hits'] += 1
+            return RateLimitResult(True, rule.limit, estimated - cost, 0.0)
+        return None
+
+    def take_pending(self, key: str) -> int:
+        """Remove and return the unsynced delta for a key"""
+        entry = self.entries.get(key)
+        if entry is None:
+            return 0
+        pending, entry.pending = entry.pending, 0
+        return pending
+
+    def record(self, key: str, rule: RateLimitRule, result: RateLimitResult):
+        """Store the budget Redis reported for a key"""
+        self._stats['redis_checks'] += 1
+        entry = self.entries.get(key)
+        if entry is None:
+            entry = self.entries[key] = _LocalCounter(rule)
+            self._evict()
+        else:
+            self.entries.move_to_end(key)
+            entry.rule = rule
+        entry.remaining = result.remaining
+        entry.retry_after = result.retry_after
+        entry.synced_at = time.monotonic()
+
+    def _evict(self):
+        """Evict least recently used clients, keeping their unsynced deltas"""
+        while len(self.entries) > self.max_entries:
+            key, entry = self.entries.popitem(last=False)
+            if entry.pending:
+                self._evicted.append((key, entry.rule, entry.pending))
+            self._stats['evictions'] += 1
+
+    async def flush(self):
+        """Push all pending deltas to Redis in one pipelined round trip"""
+        if not self._evicted and not any(entry.pending for entry in self.entries.values()):
+            return
+
+        # Leave the deltas in place until Redis is reachable again
+        redis_conn = await get_async_redis()
+        if redis_conn is None:
+            return
+
+        batch = self._evicted
+        self._evicted = []
+        for key, entry in self.entries.items():
+            if entry.pending:
+                batch.append((key, entry.rule, entry.pending))
+                entry.pending = 0
+
+        try:
+            results = await _execute_batch(redis_conn, [(key, rule, cost, True) for key, rule, cost in batch])
+        except Exception:
+            # Keep the deltas for the next attempt
+            for key, rule, cost in batch:
+                entry = self.entries.get(key)
+                if entry is not None:
+                    entry.pending += cost
+                else:
+                    self._evicted.append((key, rule, cost))
+            raise
+
+        for (key, rule, _), result in zip(batch, results):
+            entry = self.entries.get(key)
+            if entry is not None:
+                entry.remaining = result.remaining
+                entry.synced_at = time.monotonic()
+
+        self._stats['sync_batches'] += 1
+        self._stats['synced_keys'] += len(batch)
+
+    def get_stats(self) -> Dict[str, int]:
+        """Get local tier statistics"""
+        stats = self._stats.copy()
+        stats['tracked_clients'] = len(self.entries)
+        return stats
+
+    async def close(self):
+        """Stop the sync task and push remaining deltas"""
+        if self._sync_task and not self._sync_task.done():
+            self._sync_task.cancel()
+            try:
+                await self._sync_task
+            except asyncio.CancelledError:
+                pass
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.error(f"Final rate limit sync failed: {e}")
+
+async def _execute_batch(redis_conn, checks) -> List[RateLimitResult]:
+    """Run (key, rule, cost, force) checks in a single pipelined round trip"""
+    for _, rule, _, _ in checks:
+        await ENGINES[rule.algorithm].script.ensure_loaded(redis_conn)
+
+    for attempt in range(2):
+        pipe = redis_conn.pipeline(transaction=False)
+        for key, rule, cost, force in checks:
+            ENGINES[rule.algorithm].queue(pipe, key, rule, cost, force)
+        try:
+            raw_results = await pipe.execute()
+            break
+        except NoScriptError:
+            if attempt:
+                raise
+            for engine in ENGINES.values():
+                engine.script.sha = None
+            for _, rule, _, _ in checks:
+                await ENGINES[rule.algorithm].script.ensure_loaded(redis_conn)
+
+    return [
+        ENGINES[rule.algorithm].parse(raw, rule)
+        for (_, rule, _, _), raw in zip(checks, raw_results)
+    ]
+
+class RateLimiter:
+    """
+    Applies per-route rate limit rules.
+
+    Routes are matched by longest path prefix; requests that match no rule
+    use the default rule and are limited per exact path. An optional
+    LocalCounterTier answers most checks without touching Redis.
+    """
+
+    def __init__(self, rules: Dict[str, RateLimitRule], default_rule: RateLimitRule,
+                 local_tier: Optional[LocalCounterTier] = None):
+        for rule in list(rules.values()) + [default_rule]:
+            if rule.algorithm not in ENGINES:
+                raise ValueError(f"Unknown rate limit algorithm: {rule.algorithm}")
+        self.rules = dict(rules)
+        self.default_rule = default_rule
+        self.local_tier = local_tier
+        self._prefixes = sorted(self.rules, key=len, reverse=True)
+
+    def rule_for(self, path: str) -> Tuple[str, RateLimitRule]:
+        """Return the (scope, rule) pair that applies to a path"""
+        for prefix in self._prefixes:
+            if path == prefix or path.startswith(prefix.rstrip("/") + "/"):
+                return prefix, self.rules[prefix]
+        return path, self.default_rule
+
+    async def check(self, identity: str, path: str, cost: int = 1) -> Optional[RateLimitResult]:
+        """
+        Check and consume the limit for a client on a path.
+        Returns None when Redis is unavailable so callers can fail open.
+        """
+        scope, rule = self.rule_for(path)
+        key = f"rate_limit:{rule.algorithm}:{scope}:{identity}"
+
+        if self.local_tier is not None:
+            result = self.local_tier.try_local(key, rule, cost)
+            if result is not None:
+                return result
+
+        redis_conn = await get_async_redis()
+        if redis_conn is None:
+            return None
+
+        if self.local_tier is None:
+            return await ENGINES[rule.algorithm].acquire(redis_conn, key, rule, cost)
+
+        # Reconcile this client's local delta and check in the same round trip
+        pending = self.local_tier.take_pending(key)
+        checks = [(key, rule, cost, False)]
+        if pending:
+            checks.insert(0, (key, rule, pending, True))
+        try:
+            result = (await _execute_batch(redis_conn, checks))[-1]
+        except Exception:
+            entry = self.local_tier.entries.get(key)
+            if entry is not None:
+                entry.pending += pending
+            raise
+        self.local_tier.record(key, rule, result)
+        return result
+
+    async def close(self):
+        """Flush local state on shutdown"""
+        if self.local_tier is not None:
+            await self.local_tier.close()
@@ -0,0 +1,94 @@
+"""
+AI Backend Redis Pool
+Shared async Redis connection pool used from inside the event loop
+"""
+
+import logging
+import os
+import time
+from typing import Any, List, Optional
+
+import redis.asyncio as aioredis
+from redis.exceptions import NoScriptError
+
+logger = logging.getLogger(__name__)
+
+# Seconds to wait before retrying after a failed connection attempt
+RECONNECT_BACKOFF = 30
+
+class RedisScript:
+    """
+    Server-side Lua script loaded once and then invoked by SHA
+    """
+
+    def __init__(self, source: str):
+        self.source = source
+        self.sha: Optional[str] = None
+
+    async def ensure_loaded(self, client: aioredis.Redis) -> str:
+        """Load the script on first use so later calls are a single EVALSHA"""
+        if self.sha is None:
+            self.sha = await client.script_load(self.source)
+        return self.sha
+
+    async def __call__(self, client: aioredis.Redis, keys: List[str], args: List[Any]) -> Any:
+        """Run the script, reloading it if Redis lost its script cache"""
+        sha = await self.ensure_loaded(client)
+        try:
+            return await client.evalsha(sha, len(keys), *keys, *args)
+        except NoScriptError:
+            self.sha = None
+            sha = await self.ensure_loaded(client)
+            return await client.evalsha(sha, len(keys), *keys, *args)
+
+_redis_client: Optional[aioredis.Redis] = None
+_last_failure: float = 0.0
+
+async def get_async_redis() -> Optional[aioredis.Redis]:
+    """
+    Get or create the shared async Redis client.
+
+    Returns None while Redis is unreachable so callers can degrade gracefully;
+    reconnection is retried at most once every RECONNECT_BACKOFF seconds.
+    """
+    global _redis_client, _last_failure
+
+    if _redis_client is not None:
+        return _redis_client
+
+    if time.monotonic() - _last_failure < RECONNECT_BACKOFF:
+        return None
+
+    redis_url = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+    # A blocking pool queues callers when all connections are busy instead
+    # of failing with "Too many connections" under bursts
+    pool = aioredis.BlockingConnectionPool.from_url(
+        redis_url,
+        decode_responses=True,
+        max_connections=int(os.getenv("REDIS_MAX_CONNECTIONS", "50")),
+        timeout=5,
+        socket_connect_timeout=2,
+        socket_timeout=2,
+        health_check_interval=30
+    )
+    client = aioredis.Redis(connection_pool=pool, auto_close_connection_pool=True)
+
+    try:
+        await client.ping()
+        _redis_client = client
+        logger.info("Async Redis pool initialized")
+    except Exception as e:
+        _last_failure = time.monotonic()
+        logger.warning(f"Async Redis connection failed: {e}")
+        await client.aclose()
+
+    return _redis_client
+
+async def close_async_redis():
+    """Close the shared async Redis client"""
+    global _redis_client
+
+    if _redis_client:
+        await _redis_client.aclose()
+        _redis_client = None
+        logger.info("Async Redis pool closed")
@@ -0,0 +1,257 @@
+"""
+AI Backend Token Revocation
+Revoked token IDs in Redis, fronted by a per-worker Bloom filter kept current over pub/sub
+"""
+
+import asyncio
+import hashlib
+import logging
+import math
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from redis_pool import get_async_redis
+
+logger = logging.getLogger(__name__)
+
+# Sorted set of revoked jti, scored by the token's expiry
+REVOKED_KEY = "revoked_tokens"
+# "<jti> <exp>" notices of new revocations
+REVOCATION_CHANNEL = "revoked_tokens:events"
+
+class BloomFilter:
+    """Fixed-size Bloom filter: no false negatives, false positives at about the target rate"""
+
+    def __init__(self, capacity: int, false_positive_rate: float = 0.001):
+        self.capacity = max(1, capacity)
+        self.false_positive_rate = false_positive_rate
+        self.size = max(8, int(-self.capacity * math.log(false_positive_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / self.capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item: str):
+        # Kirsch-Mitzenmacher: k positions from two halves of one digest
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, item: str):
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+class RevocationList:
+    """
+    Access token revocation without a network call on the common path.
+
+    Revoked jti live in a Redis sorted set scored by expiry, so entries can
+    be pruned once the token would be rejected anyway. Each worker keeps a
+    Bloom filter of the set: a token not in the filter is certainly not
+    revoked. Filter hits are confirmed with one ZSCORE and remembered.
+
+    New revocations are published and added to every worker's filter as
+    they arrive. Pub/sub can drop notices while a worker is disconnected,
+    so the filter is rebuilt from the set after every reconnect and every
+    `refresh_interval` seconds, which also sheds expired entries.
+    """
+
+    def __init__(self, capacity: int = 100000, false_positive_rate: float = 0.001,
+                 refresh_interval: float = 300.0, confirmed_size: int = 10000):
+        self.capacity = capacity
+        self.false_positive_rate = false_positive_rate
+        self.refresh_interval = refresh_interval
+        self.confirmed_size = confirmed_size
+        self.redis = None
+        self.bloom = BloomFilter(capacity, false_positive_rate)
+        self._confirmed: "OrderedDict[str, float]" = OrderedDict()
+        self._reload_buffer: Optional[List[str]] = None
+        self._loaded_at = 0.0
+        self._listener_task: Optional[asyncio.Task] = None
+        self._stats = {
+            'checks': 0,
+            'bloom_negatives': 0,
+            'confirmed_hits': 0,
+            'redis_checks': 0,
+            'false_positives': 0,
+            'revocations': 0,
+            'notices_received': 0,
+            'reloads': 0
+        }
+
+    async def initialize(self):
+        """Connect, load the current set and start following new revocations"""
+        if self.redis is None:
+            self.redis = await get_async_redis()
+        await self.start_listener()
+
+    async def start_listener(self):
+        if self.redis is None:
+            return
+        if self._listener_task is None or self._listener_task.done():
+            ready = asyncio.Event()
+            self._listener_task = asyncio.create_task(self._listen(ready))
+            await asyncio.wait_for(ready.wait(), timeout=5)
+
+    async def _listen(self, ready: asyncio.Event):
+        """Add published revocations to the filter, rebuilding it after gaps"""
+        while True:
+            pubsub = self.redis.pubsub()
+            try:
+                # Subscribe before loading so nothing published meanwhile is missed
+                await pubsub.subscribe(REVOCATION_CHANNEL)
+                await self.reload()
+                ready.set()
+                while True:
+                    message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                    if message is not None:
+                        jti, _, _ = message['data'].partition(' ')
+                        self._stats['notices_received'] += 1
+                        self._add(jti)
+                    if time.monotonic() - self._loaded_at >= self.refresh_interval:
+                        await self.reload()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Token revocation listener error: {e}")
+                ready.set()
+                await asyncio.sleep(1)
+            finally:
+                try:
+                    await pubsub.aclose()
+                except Exception:
+                    pass
+
+    def _add(self, jti: str):
+        self.bloom.add(jti)
+        if self._reload_buffer is not None:
+            self._reload_buffer.append(jti)
+
+    async def reload(self):
+        """Rebuild the filter from Redis, dropping expired revocations"""
+        self._reload_buffer = []
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            pipe.zremrangebyscore(REVOKED_KEY, "-inf", time.time())
+            pipe.zrange(REVOKED_KEY, 0, -1)
+            _, revoked = await pipe.execute()
+
+            bloom = BloomFilter(max(self.capacity, 2 * len(revoked)), self.false_positive_rate)
+            for jti in revoked:
+                bloom.add(jti)
+            # Notices that arrived while the snapshot was in flight
+            for jti in self._reload_buffer:
+                bloom.add(jti)
+            self.bloom = bloom
+        finally:
+            self._reload_buffer = None
+        self._loaded_at = time.monotonic()
+        self._stats['reloads'] += 1
+
+    def _confirm(self, jti: str, expires_at: float):
+        self._confirmed[jti] = expires_at
+        self._confirmed.move_to_end(jti)
+        while len(self._confirmed) > self.confirmed_size:
+            self._confirmed.popitem(last=False)
+
+    async def revoke(self, jti: str, expires_at: float):
+        """Revoke a token until it expires, on every worker"""
+        self._add(jti)
+        self._confirm(jti, expires_at)
+        self._stats['revocations'] += 1
+        if self.redis is None:
+            logger.warning(f"Redis unavailable: token {jti[:8]}... revoked on this worker only")
+            return
+
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            pipe.zadd(REVOKED_KEY, {jti: expires_at})
+            pipe.zremrangebyscore(REVOKED_KEY, "-inf", time.time())
+            pipe.publish(REVOCATION_CHANNEL, f"{jti} {expires_at}")
+            await pipe.execute()
+        except Exception as e:
+            logger.error(f"Token revocation error: {e}")
+
+    async def is_revoked(self, jti: Optional[str]) -> bool:
+        """Whether a token has been revoked; tokens issued without a jti cannot be"""
+        if not jti:
+            return False
+        self._stats['checks'] += 1
+        if jti not in self.bloom:
+            self._stats['bloom_negatives'] += 1
+            return False
+        if jti in self._confirmed:
+            self._stats['confirmed_hits'] += 1
+            return True
+        if self.redis is None:
+            return True
+
+        self._stats['redis_checks'] += 1
+        try:
+            expires_at = await self.redis.zscore(REVOKED_KEY, jti)
+        except Exception as e:
+            # A filter hit that cannot be confirmed is treated as revoked
+            logger.warning(f"Token revocation check failed: {e}")
+            return True
+        if expires_at is None:
+            self._stats['false_positives'] += 1
+            return False
+        self._confirm(jti, expires_at)
+        return True
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get revocation statistics"""
+        return {
+            **self._stats,
+            'bloom_items': self.bloom.count,
+            'bloom_bytes': len(self.bloom.bits),
+            'listening': self._listener_task is not None and not self._listener_task.done()
+        }
+
+    def reset_stats(self):
+        """Reset statistics"""
+        self._stats = {key: 0 for key in self._stats}
+
+    async def close(self):
+        """Stop following revocations"""
+        if (self._listener_task and not self._listener_task.done()
+                and self._listener_task.get_loop() is asyncio.get_running_loop()):
+            self._listener_task.cancel()
+            try:
+                await self._listener_task
+            except asyncio.CancelledError:
+                pass
+        self._listener_task = None
+
+# Global revocation list
+_revocation_list: Optional[RevocationList] = None
+
+async def get_revocation_list() -> RevocationList:
+    """Get or create the global revocation list"""
+    global _revocation_list
+
+    if _revocation_list is None:
+        _revocation_list = RevocationList(
+            capacity=int(os.getenv('REVOCATION_BLOOM_CAPACITY', '100000')),
+            false_positive_rate=float(os.getenv('REVOCATION_BLOOM_ERROR_RATE', '0.001')),
+            refresh_interval=float(os.getenv('REVOCATION_REFRESH_INTERVAL', '300'))
+        )
+        await _revocation_list.initialize()
+    elif _revocation_list.redis is None:
+        # Reconnection attempts are spaced out by redis_pool's backoff
+        await _revocation_list.initialize()
+    return _revocation_list
+
+async def close_revocation_list():
+    """Close the global revocation list"""
+    global _revocation_list
+
+    if _revocation_list:
+        await _revocation_list.close()
+        _revocation_list = None
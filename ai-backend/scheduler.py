@@ -0,0 +1,284 @@
+"""
+AI Backend Upstream Scheduler
+Queues OpenAI calls under a global concurrency limit and tokens-per-minute budget, interactive first
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import math
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
+
+from connection_manager import AdaptiveConcurrencyLimiter, UpstreamOverloadedError, get_concurrency_limiter
+
+logger = logging.getLogger(__name__)
+
+# Lower values are dispatched first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 1
+PRIORITY_NAMES = {PRIORITY_INTERACTIVE: 'interactive', PRIORITY_BULK: 'bulk'}
+
+# Rough prompt size: about four characters per token, plus per-message framing
+CHARS_PER_TOKEN = 4
+TOKENS_PER_MESSAGE = 4
+
+def estimate_tokens(messages: List[Dict[str, str]], max_tokens: int) -> int:
+    """Upper-bound token cost of a chat completion, charged before it is sent"""
+    prompt_chars = sum(len(message.get('content', '')) for message in messages)
+    return prompt_chars // CHARS_PER_TOKEN + TOKENS_PER_MESSAGE * len(messages) + max_tokens
+
+class Ticket:
+    """A queued upstream call; granted once it holds a slot and its tokens"""
+
+    __slots__ = ('priority', 'tokens', 'future', 'enqueued_at', 'granted_at', 'cancelled', 'used_tokens')
+
+    def __init__(self, priority: int, tokens: int, future: asyncio.Future):
+        self.priority = priority
+        self.tokens = tokens
+        self.future = future
+        self.enqueued_at = time.monotonic()
+        self.granted_at = None
+        self.cancelled = False
+        self.used_tokens: Optional[int] = None  # Reported usage, set by the caller
+
+    @property
+    def queue_wait(self) -> float:
+        return (self.granted_at or time.monotonic()) - self.enqueued_at
+
+class UpstreamScheduler:
+    """
+    Admission control in front of the OpenAI client.
+
+    Calls wait in a priority queue until both a concurrency slot and enough
+    of the tokens-per-minute budget are free. The budget is a token bucket
+    refilled continuously; each call is charged its estimate up front and
+    reconciled with the reported usage when it finishes. Only the head of
+    the queue is considered, so a large interactive request is not starved
+    by a stream of small bulk ones.
+
+    The queue is bounded so overload is refused at the door rather than
+    after a long wait: a call that would queue behind `max_queue` others of
+    its priority or higher, or whose expected wait exceeds `max_queue_wait`
+    seconds, raises UpstreamOverloadedError. The expected wait is the
+    number of waves ahead of it at the upstream's adaptive concurrency
+    limit times its smoothed round trip, both read from `limiter_source`.
+    """
+
+    def __init__(self, max_concurrency: int = 10, tokens_per_minute: int = 0,
+                 max_queue: Optional[int] = None, max_queue_wait: Optional[float] = None,
+                 limiter_source: Optional[Callable[[], Optional[AdaptiveConcurrencyLimiter]]] = None):
+        self.max_concurrency = max_concurrency
+        self.tokens_per_minute = tokens_per_minute  # 0 disables the budget
+        self.max_queue = max_queue  # None leaves the queue unbounded
+        self.max_queue_wait = max_queue_wait
+        self.limiter_source = limiter_source
+        self.active = 0
+        self._tokens = float(tokens_per_minute)
+        self._refilled_at = time.monotonic()
+        self._queue: List[tuple] = []
+        self._sequence = itertools.count()
+        self._wakeup: Optional[asyncio.TimerHandle] = None
+        self._stats = self._empty_stats()
+
+    def _empty_stats(self) -> Dict[str, Any]:
+        return {
+            name: {
+                'requests': 0,
+                'total_queue_wait': 0.0,
+                'max_queue_wait': 0.0,
+                'total_upstream_time': 0.0,
+                'tokens_charged': 0,
+                'rejected': 0
+            }
+            for name in PRIORITY_NAMES.values()
+        }
+
+    @property
+    def queued(self) -> int:
+        return sum(1 for _, _, ticket in self._queue if not ticket.cancelled)
+
+    def _refill(self):
+        now = time.monotonic()
+        if self.tokens_per_minute:
+            self._tokens = min(self.tokens_per_minute,
+                               self._tokens + (now - self._refilled_at) * self.tokens_per_minute / 60)
+        self._refilled_at = now
+
+    def _cost(self, ticket: Ticket) -> int:
+        # A request larger than the whole budget still runs once the bucket is full
+        return min(ticket.tokens, self.tokens_per_minute)
+
+    def _dispatch(self):
+        """Grant queued tickets in priority order while slots and tokens last"""
+        if self._wakeup is not None:
+            self._wakeup.cancel()
+            self._wakeup = None
+        self._refill()
+        while self._queue and self.active < self.max_concurrency:
+            _, _, ticket = self._queue[0]
+            if ticket.cancelled:
+                heapq.heappop(self._queue)
+                continue
+
+            if self.tokens_per_minute:
+                deficit = self._cost(ticket) - self._tokens
+                if deficit > 0:
+                    delay = deficit * 60 / self.tokens_per_minute
+                    self._wakeup = asyncio.get_running_loop().call_later(delay, self._dispatch)
+                    return
+                self._tokens -= self._cost(ticket)
+
+            heapq.heappop(self._queue)
+            self.active += 1
+            ticket.granted_at = time.monotonic()
+            ticket.future.set_result(None)
+
+    def _admit(self, priority: int):
+        """Refuse a call the bounded queue has no room for"""
+        ahead = sum(1 for queued_priority, _, ticket in self._queue
+                    if queued_priority <= priority and not ticket.cancelled)
+        if not ahead and self.active < self.max_concurrency:
+            return  # Dispatched at once, budget permitting
+
+        limiter = self.limiter_source() if self.limiter_source else None
+        expected_wait = None
+        if limiter is not None and limiter.smoothed_rtt is not None:
+            concurrency = max(1, min(self.max_concurrency, int(limiter.limit)))
+            expected_wait = (ahead // concurrency + 1) * limiter.smoothed_rtt
+
+        if self.max_queue is not None and ahead >= self.max_queue:
+            reason = f"{ahead} calls queued ahead"
+        elif (self.max_queue_wait is not None and expected_wait is not None
+              and expected_wait > self.max_queue_wait):
+            reason = f"expected queue wait {expected_wait:.1f}s"
+        else:
+            return
+
+        self._stats[PRIORITY_NAMES[priority]]['rejected'] += 1
+        logger.warning(f"Rejecting {PRIORITY_NAMES[priority]} upstream call: {reason}")
+        # Come back about when the calls ahead have drained
+        retry_after = limiter.retry_after() if limiter is not None else 1
+        if expected_wait is not None:
+            retry_after = max(retry_after, math.ceil(expected_wait))
+        raise UpstreamOverloadedError(retry_after, "Upstream queue is full")
+
+    async def acquire(self, priority: int, tokens: int) -> Ticket:
+        """
+        Wait for a slot and tokens; release() the returned ticket when done.
+
+        Raises UpstreamOverloadedError instead of queueing past the bound.
+        """
+        self._admit(priority)
+        ticket = Ticket(priority, tokens, asyncio.get_running_loop().create_future())
+        heapq.heappush(self._queue, (priority, next(self._sequence), ticket))
+        self._dispatch()
+
+        try:
+            await ticket.future
+        except asyncio.CancelledError:
+            if ticket.granted_at is not None:
+                self.release(ticket)
+            else:
+                ticket.cancelled = True
+            raise
+
+        stats = self._stats[PRIORITY_NAMES[priority]]
+        stats['requests'] += 1
+        stats['total_queue_wait'] += ticket.queue_wait
+        stats['max_queue_wait'] = max(stats['max_queue_wait'], ticket.queue_wait)
+        return ticket
+
+    def release(self, ticket: Ticket):
+        """Free the ticket's slot, settling the budget against its reported usage"""
+        self.active -= 1
+        stats = self._stats[PRIORITY_NAMES[ticket.priority]]
+        stats['total_upstream_time'] += time.monotonic() - ticket.granted_at
+        charged = self._cost(ticket) if self.tokens_per_minute else ticket.tokens
+        if ticket.used_tokens is not None:
+            if self.tokens_per_minute:
+                # Refund an overestimate; an underestimate becomes debt
+                self._refill()
+                self._tokens = min(self.tokens_per_minute, self._tokens + charged - ticket.used_tokens)
+            charged = ticket.used_tokens
+        stats['tokens_charged'] += charged
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, priority: int, tokens: int) -> AsyncIterator[Ticket]:
+        """
+        Hold a slot for the duration of an upstream call.
+
+        Set ticket.used_tokens inside the block to reconcile the budget.
+        """
+        ticket = await self.acquire(priority, tokens)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get scheduler statistics, with queue wait reported apart from upstream time"""
+        self._refill()
+        by_priority = {}
+        for name, stats in self._stats.items():
+            requests = stats['requests']
+            by_priority[name] = {
+                **stats,
+                'average_queue_wait': stats['total_queue_wait'] / requests if requests else 0,
+                'average_upstream_time': stats['total_upstream_time'] / requests if requests else 0
+            }
+        return {
+            'max_concurrency': self.max_concurrency,
+            'max_queue': self.max_queue,
+            'max_queue_wait': self.max_queue_wait,
+            'active': self.active,
+            'queued': self.queued,
+            'tokens_per_minute': self.tokens_per_minute,
+            'tokens_available': int(self._tokens) if self.tokens_per_minute else None,
+            'by_priority': by_priority
+        }
+
+    def reset_stats(self):
+        """Reset statistics"""
+        self._stats = self._empty_stats()
+
+    def close(self):
+        """Cancel the refill timer and fail anything still queued"""
+        if self._wakeup is not None:
+            self._wakeup.cancel()
+            self._wakeup = None
+        for _, _, ticket in self._queue:
+            if not ticket.future.done():
+                ticket.future.cancel()
+        self._queue.clear()
+
+# Global scheduler instance
+_scheduler: Optional[UpstreamScheduler] = None
+
+def get_scheduler() -> UpstreamScheduler:
+    """Get or create the global upstream scheduler"""
+    global _scheduler
+
+    if _scheduler is None:
+        max_concurrency = int(os.getenv('UPSTREAM_MAX_CONCURRENCY', os.getenv('MAX_CONNECTIONS', '10')))
+        _scheduler = UpstreamScheduler(
+            max_concurrency=max_concurrency,
+            tokens_per_minute=int(os.getenv('UPSTREAM_TOKENS_PER_MINUTE', '0')),
+            # By default at most one more full wave waits behind those in flight
+            max_queue=int(os.getenv('UPSTREAM_MAX_QUEUE', str(max_concurrency))),
+            max_queue_wait=float(os.getenv('UPSTREAM_MAX_QUEUE_WAIT', os.getenv('REQUEST_TIMEOUT', '30'))),
+            limiter_source=get_concurrency_limiter
+        )
+    return _scheduler
+
+def close_scheduler():
+    """Drop the global scheduler"""
+    global _scheduler
+
+    if _scheduler:
+        _scheduler.close()
+        _scheduler = None
@@ -0,0 +1,175 @@
+"""
+AI Backend Session Store
+Per-session refresh tokens in Redis with rotation and reuse detection
+"""
+
+import logging
+import os
+import time
+from typing import Any, Dict, Optional
+
+from redis_pool import RedisScript, get_async_redis
+
+logger = logging.getLogger(__name__)
+
+# Outcomes of SessionStore.rotate
+ROTATED = "rotated"
+REUSED = "reused"
+UNKNOWN = "unknown"
+UNAVAILABLE = "unavailable"
+
+# Record a session; past ARGV[5] sessions, drop expired ones, then the oldest
+CREATE_SCRIPT = RedisScript("""
+redis.call('HSET', KEYS[1], ARGV[1], ARGV[2] .. ' ' .. ARGV[3])
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+local max_sessions = tonumber(ARGV[5])
+if redis.call('HLEN', KEYS[1]) <= max_sessions then
+    return 0
+end
+local now = tonumber(ARGV[6])
+local entries = redis.call('HGETALL', KEYS[1])
+local live = {}
+local dropped = 0
+for i = 1, #entries, 2 do
+    local expires_at = tonumber(string.match(entries[i + 1], ' (.+)$') or '0')
+    if expires_at <= now then
+        redis.call('HDEL', KEYS[1], entries[i])
+        dropped = dropped + 1
+    elseif entries[i] ~= ARGV[1] then
+        table.insert(live, {entries[i], expires_at})
+    end
+end
+table.sort(live, function(a, b) return a[2] < b[2] end)
+local excess = #live + 1 - max_sessions
+for i = 1, excess do
+    redis.call('HDEL', KEYS[1], live[i][1])
+    dropped = dropped + 1
+end
+return dropped
+""")
+
+# Swap a session's refresh token jti if the presented one is current;
+# a stale jti means a rotated token was replayed, so the session is ended
+ROTATE_SCRIPT = RedisScript("""
+local current = redis.call('HGET', KEYS[1], ARGV[1])
+if not current then
+    return 'unknown'
+end
+if string.match(current, '^(%S+)') ~= ARGV[2] then
+    redis.call('HDEL', KEYS[1], ARGV[1])
+    return 'reused'
+end
+redis.call('HSET', KEYS[1], ARGV[1], ARGV[3] .. ' ' .. ARGV[4])
+redis.call('EXPIRE', KEYS[1], ARGV[5])
+return 'rotated'
+""")
+
+class SessionStore:
+    """
+    Refresh tokens tracked per login session.
+
+    Each user has one Redis hash, `refresh_sessions:{username}`, mapping a
+    session id to the jti and expiry of that session's current refresh
+    token, so logging in on a second device leaves the first signed in.
+    Refreshing rotates the jti; presenting a refresh token that has already
+    been rotated away is treated as theft and ends that session.
+
+    Every operation is one script call touching a single field, so its cost
+    does not grow with the number of sessions. Only a login that takes a
+    user past `max_sessions` scans the hash, to drop expired and then the
+    oldest sessions.
+    """
+
+    def __init__(self, ttl_seconds: int, max_sessions: int = 20):
+        self.ttl_seconds = ttl_seconds
+        self.max_sessions = max_sessions
+        self._stats = {
+            'created': 0,
+            'rotated': 0,
+            'reuse_detected': 0,
+            'unknown': 0,
+            'revoked': 0,
+            'evicted': 0,
+            'unavailable': 0
+        }
+
+    @staticmethod
+    def _key(username: str) -> str:
+        return f"refresh_sessions:{username}"
+
+    async def _redis(self):
+        redis_conn = await get_async_redis()
+        if redis_conn is None:
+            self._stats['unavailable'] += 1
+        return redis_conn
+
+    async def create(self, username: str, session_id: str, jti: str) -> bool:
+        """Record a new session's first refresh token; False if Redis is unavailable"""
+        redis_conn = await self._redis()
+        if redis_conn is None:
+            return False
+        now = time.time()
+        evicted = await CREATE_SCRIPT(redis_conn, [self._key(username)], [
+            session_id, jti, int(now + self.ttl_seconds), self.ttl_seconds, self.max_sessions, now
+        ])
+        self._stats['created'] += 1
+        self._stats['evicted'] += evicted
+        return True
+
+    async def rotate(self, username: str, session_id: str, jti: str, new_jti: str) -> str:
+        """Replace a session's refresh token jti; returns ROTATED, REUSED, UNKNOWN or UNAVAILABLE"""
+        redis_conn = await self._redis()
+        if redis_conn is None:
+            return UNAVAILABLE
+        outcome = await ROTATE_SCRIPT(redis_conn, [self._key(username)], [
+            session_id, jti, new_jti, int(time.time() + self.ttl_seconds), self.ttl_seconds
+        ])
+        if outcome == REUSED:
+            self._stats['reuse_detected'] += 1
+            logger.warning(f"Refresh token reuse for {username}, session {session_id[:8]}... ended")
+        else:
+            self._stats[outcome] += 1
+        return outcome
+
+    async def revoke(self, username: str, session_id: str):
+        """End one session"""
+        redis_conn = await self._redis()
+        if redis_conn is not None:
+            self._stats['revoked'] += await redis_conn.hdel(self._key(username), session_id)
+
+    async def revoke_all(self, username: str):
+        """End every session of a user"""
+        redis_conn = await self._redis()
+        if redis_conn is not None:
+            pipe = redis_conn.pipeline(transaction=False)
+            pipe.hlen(self._key(username))
+            pipe.delete(self._key(username))
+            revoked, _ = await pipe.execute()
+            self._stats['revoked'] += revoked
+
+    async def count(self, username: str) -> int:
+        """Number of sessions recorded for a user, including expired ones not yet dropped"""
+        redis_conn = await self._redis()
+        return 0 if redis_conn is None else await redis_conn.hlen(self._key(username))
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get session store statistics"""
+        return {**self._stats, 'max_sessions': self.max_sessions}
+
+    def reset_stats(self):
+        """Reset statistics"""
+        self._stats = {key: 0 for key in self._stats}
+
+# Global session store
+_session_store: Optional[SessionStore] = None
+
+def get_session_store(ttl_seconds: int) -> SessionStore:
+    """Get or create the global session store for refresh tokens living `ttl_seconds`"""
+    global _session_store
+
+    if _session_store is None:
+        _session_store = SessionStore(
+            ttl_seconds,
+            max_sessions=int(os.getenv('MAX_SESSIONS_PER_USER', '20'))
+        )
+    return _session_store
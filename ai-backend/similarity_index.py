@@ -0,0 +1,249 @@
+"""
+AI Backend Similarity Index
+In-process near-duplicate prompt search: hashed TF-IDF vectors with a MinHash-LSH prefilter
+"""
+
+import logging
+import re
+import zlib
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Modulus for the MinHash permutations and band hashing (2^31 - 1)
+MERSENNE = (1 << 31) - 1
+
+_WORD_RE = re.compile(r"\w+")
+
+class SimilarityIndex:
+    """
+    Near-duplicate search over cached prompts for one model.
+
+    Every prompt is reduced to hashed features (words plus character
+    trigrams). Features are bucketed into a fixed-width term-frequency row of a
+    float16 matrix, and their MinHash signature is split into LSH bands. A
+    lookup walks the matching band buckets for candidates and scores only
+    those rows by TF-IDF cosine similarity, with IDF taken from the live
+    document frequencies, so query cost tracks the number of near neighbours
+    rather than the index size.
+
+    Bucket chains are plain int32 arrays (head per band slot, next per row)
+    so the LSH tables cost a few bytes per entry instead of Python objects.
+    """
+
+    def __init__(self, dim: int = 512, num_perm: int = 96, bands: int = 12,
+                 table_bits: int = 18, max_entries: int = 100000, max_candidates: int = 2048):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.dim = dim
+        self.bands = bands
+        self.rows_per_band = num_perm // bands
+        self.max_entries = max_entries
+        self.max_candidates = max_candidates
+        self._slot_mask = (1 << table_bits) - 1
+
+        rng = np.random.default_rng(0x5EED)
+        self._perm_a = rng.integers(1, MERSENNE, num_perm, dtype=np.int64)
+        self._perm_b = rng.integers(0, MERSENNE, num_perm, dtype=np.int64)
+        self._band_mult = rng.integers(1, MERSENNE, self.rows_per_band, dtype=np.int64)
+
+        self._capacity = 0
+        self._matrix = np.zeros((0, dim), dtype=np.float16)
+        self._expires = np.zeros(0, dtype=np.float64)
+        self._slots = np.zeros((0, bands), dtype=np.int32)
+        self._next = np.zeros((0, bands), dtype=np.int32)
+        self._heads = np.full((bands, 1 << table_bits), -1, dtype=np.int32)
+        self._df = np.zeros(dim, dtype=np.int32)
+
+        self._keys: List[Optional[str]] = []
+        self._row_of: Dict[str, int] = {}
+        self._free: List[int] = []
+        self._stats = {
+            'queries': 0,
+            'candidates_scored': 0,
+            'matches': 0,
+            'evictions': 0
+        }
+
+    def __len__(self) -> int:
+        return len(self._row_of)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._row_of
+
+    def _encode(self, prompt: str) -> Tuple[Optional[np.ndarray], Optional[np.ndarray]]:
+        """Return the (MinHash signature, term-frequency vector) for a prompt"""
+        words = _WORD_RE.findall(prompt.lower())
+        if not words:
+            return None, None
+
+        features = list(words)
+        for word in words:
+            padded = f"#{word}#"
+            features.extend(padded[i:i + 3] for i in range(len(padded) - 2))
+
+        hashes = np.fromiter((zlib.crc32(f.encode()) for f in features), dtype=np.int64, count=len(features))
+        unique, counts = np.unique(hashes, return_counts=True)
+
+        shingles = unique % MERSENNE
+        signature = ((self._perm_a[:, None] * shingles[None, :] + self._perm_b[:, None]) % MERSENNE).min(axis=1)
+
+        # Sublinear term frequency, bucketed into the fixed-width row
+        vector = np.bincount(unique % self.dim, weights=1.0 + np.log(counts), minlength=self.dim)
+        return signature, vector.astype(np.float32)
+
+    def _band_slots(self, signature: np.ndarray) -> np.ndarray:
+        """Hash each band of the signature to a bucket slot"""
+        banded = signature.reshape(self.bands, self.rows_per_band)
+        return (((banded * self._band_mult).sum(axis=1) % MERSENNE) & self._slot_mask).astype(np.int32)
+
+    def _grow(self):
+        """Double the row capacity, up to max_entries"""
+        capacity = min(self.max_entries, max(1024, self._capacity * 2))
+        extra = capacity - self._capacity
+        self._matrix = np.vstack([self._matrix, np.zeros((extra, self.dim), dtype=np.float16)])
+        self._expires = np.concatenate([self._expires, np.zeros(extra)])
+        self._slots = np.vstack([self._slots, np.zeros((extra, self.bands), dtype=np.int32)])
+        self._next = np.vstack([self._next, np.full((extra, self.bands), -1, dtype=np.int32)])
+        self._keys.extend([None] * extra)
+        self._free.extend(range(capacity - 1, self._capacity - 1, -1))
+        self._capacity = capacity
+
+    def _allocate_row(self, now: float) -> int:
+        """Find a free row, growing, pruning or evicting as needed"""
+        if not self._free and self._capacity < self.max_entries:
+            self._grow()
+        if not self._free:
+            self.prune(now)
+        if not self._free:
+            # Evict the live entry closest to expiry
+            alive = np.where(self._expires > 0, self._expires, np.inf)
+            self._remove_row(int(alive.argmin()))
+            self._stats['evictions'] += 1
+        return self._free.pop()
+
+    def add(self, key: str, prompt: str, expires_at: float, now: float = 0.0):
+        """Index a prompt under its cache key until expires_at (epoch seconds)"""
+        signature, vector = self._encode(prompt)
+        if signature is None:
+            return
+        if key in self._row_of:
+            self._remove_row(self._row_of[key])
+
+        row = self._allocate_row(now)
+        self._matrix[row] = vector
+        self._expires[row] = expires_at
+        self._keys[row] = key
+        self._row_of[key] = row
+        self._df[vector > 0] += 1
+
+        slots = self._band_slots(signature)
+        self._slots[row] = slots
+        band_range = np.arange(self.bands)
+        self._next[row] = self._heads[band_range, slots]
+        self._heads[band_range, slots] = row
+
+    def remove(self, key: str) -> bool:
+        """Drop a key from the index"""
+        row = self._row_of.get(key)
+        if row is None:
+            return False
+        self._remove_row(row)
+        return True
+
+    def _remove_row(self, row: int):
+        """Unlink a row from its bucket chains and free it"""
+        for band in range(self.bands):
+            slot = self._slots[row, band]
+            current, previous = self._heads[band, slot], -1
+            while current != -1 and current != row:
+                previous, current = current, self._next[current, band]
+            if current == row:
+                if previous == -1:
+                    self._heads[band, slot] = self._next[row, band]
+                else:
+                    self._next[previous, band] = self._next[row, band]
+            self._next[row, band] = -1
+
+        self._df[self._matrix[row] > 0] -= 1
+        self._matrix[row] = 0
+        self._expires[row] = 0
+        self._row_of.pop(self._keys[row], None)
+        self._keys[row] = None
+        self._free.append(row)
+
+    def prune(self, now: float) -> int:
+        """Remove every entry that has expired by now"""
+        expired = np.flatnonzero((self._expires > 0) & (self._expires <= now))
+        for row in expired:
+            self._remove_row(int(row))
+        return len(expired)
+
+    def query(self, prompt: str, threshold: float, max_results: int = 3, now: float = 0.0,
+              exhaustive: bool = False) -> List[Tuple[str, float]]:
+        """
+        Return up to max_results (key, cosine similarity) pairs at or above threshold.
+        
+        exhaustive=True skips the LSH prefilter and scores every row, as a
+        reference for measuring the prefilter's recall.
+        """
+        self._stats['queries'] += 1
+        if not self._row_of:
+            return []
+        signature, vector = self._encode(prompt)
+        if signature is None:
+            return []
+
+        if exhaustive:
+            candidates = self._row_of.values()
+        else:
+            # LSH prefilter: rows sharing at least one band bucket
+            candidates = set()
+            for band, slot in enumerate(self._band_slots(signature)):
+                row = self._heads[band, slot]
+                while row != -1 and len(candidates) < self.max_candidates:
+                    candidates.add(int(row))
+                    row = self._next[row, band]
+            if not candidates:
+                return []
+
+        rows = np.fromiter(candidates, dtype=np.int64, count=len(candidates))
+        expired = rows[self._expires[rows] <= now]
+        for row in expired:
+            self._remove_row(int(row))
+        rows = rows[self._expires[rows] > now]
+        if not len(rows):
+            return []
+        self._stats['candidates_scored'] += len(rows)
+
+        # TF-IDF cosine similarity with the current document frequencies
+        idf = np.log((1.0 + len(self._row_of)) / (1.0 + self._df)) + 1.0
+        weights = (idf * idf).astype(np.float32)
+        matrix = self._matrix[rows].astype(np.float32)
+        numerators = matrix @ (vector * weights)
+        norms = np.sqrt((matrix * matrix) @ weights) * np.sqrt((vector * vector) @ weights)
+        scores = numerators / np.maximum(norms, 1e-12)
+
+        order = np.argsort(-scores)[:max_results]
+        matches = [(self._keys[rows[i]], float(scores[i])) for i in order if scores[i] >= threshold]
+        self._stats['matches'] += len(matches)
+        return matches
+
+    def clear(self):
+        """Drop every entry, keeping the statistics"""
+        stats = self._stats
+        self.__init__(self.dim, self.bands * self.rows_per_band, self.bands,
+                      self._slot_mask.bit_length(), self.max_entries, self.max_candidates)
+        self._stats = stats
+
+    def get_stats(self) -> Dict[str, int]:
+        """Get index statistics"""
+        return {
+            **self._stats,
+            'entries': len(self._row_of),
+            'capacity': self._capacity,
+            'memory_bytes': int(self._matrix.nbytes + self._expires.nbytes + self._slots.nbytes
+                                + self._next.nbytes + self._heads.nbytes)
+        }
@@ -0,0 +1,83 @@
+"""
+AI Backend Token Cache
+Bounded LRU of verified access tokens so repeat requests skip JWT verification
+"""
+
+import hashlib
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Dict, NamedTuple, Optional
+
+logger = logging.getLogger(__name__)
+
+class _CachedToken(NamedTuple):
+    claims: Dict[str, Any]
+    expires_at: float
+
+class TokenCache:
+    """
+    Maps token digests to the claims of tokens that passed verification.
+
+    Entries are dropped once the token's `exp` has passed, so a cached
+    result is never more permissive than decoding the token again. Only
+    signature and expiry checks are skipped: revocation is checked after
+    the cache, on every request. Only a digest of each token is kept.
+    """
+
+    def __init__(self, max_entries: int = 10000):
+        self.max_entries = max_entries
+        self.entries: "OrderedDict[bytes, _CachedToken]" = OrderedDict()
+        self._stats = {
+            'hits': 0,
+            'misses': 0,
+            'expired': 0,
+            'evictions': 0
+        }
+
+    @staticmethod
+    def _digest(token: str) -> bytes:
+        return hashlib.blake2b(token.encode(), digest_size=16).digest()
+
+    def get(self, token: str, now: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """Claims of a previously verified token, or None to verify it again"""
+        digest = self._digest(token)
+        entry = self.entries.get(digest)
+        if entry is None:
+            self._stats['misses'] += 1
+            return None
+
+        if entry.expires_at <= (time.time() if now is None else now):
+            del self.entries[digest]
+            self._stats['expired'] += 1
+            self._stats['misses'] += 1
+            return None
+
+        self.entries.move_to_end(digest)
+        self._stats['hits'] += 1
+        return entry.claims
+
+    def put(self, token: str, claims: Dict[str, Any]):
+        """Remember a verified token until its exp claim"""
+        if self.max_entries <= 0 or 'exp' not in claims:
+            return
+        digest = self._digest(token)
+        self.entries[digest] = _CachedToken(claims, float(claims['exp']))
+        self.entries.move_to_end(digest)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self._stats['evictions'] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get token cache statistics"""
+        lookups = self._stats['hits'] + self._stats['misses']
+        return {
+            **self._stats,
+            'entries': len(self.entries),
+            'max_entries': self.max_entries,
+            'hit_rate': self._stats['hits'] / lookups if lookups else 0
+        }
+
+    def reset_stats(self):
+        """Reset statistics"""
+        self._stats = {key: 0 for key in self._stats}
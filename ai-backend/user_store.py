@@ -0,0 +1,259 @@
+"""
+AI Backend User Store
+Pluggable user repositories; SQLite by default so users survive restarts and are shared by workers
+"""
+
+import asyncio
+import logging
+from abc import ABC, abstractmethod
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+USER_FIELDS = ("username", "email", "hashed_password", "is_active", "created_at")
+
+class UserStore(ABC):
+    """A user repository; request handlers only use its async methods"""
+
+    @abstractmethod
+    async def get_user(self, username: str) -> Optional[Dict[str, Any]]:
+        """Look a user up by username"""
+
+    @abstractmethod
+    async def get_user_by_email(self, email: str) -> Optional[Dict[str, Any]]:
+        """Look a user up by email"""
+
+    @abstractmethod
+    async def create_user(self, user: Dict[str, Any]) -> bool:
+        """Insert a user; False if the username is taken"""
+
+    @abstractmethod
+    async def delete_user(self, username: str) -> bool:
+        """Remove a user; False if there was none"""
+
+    def close(self):
+        """Release connections; the store reopens them on next use"""
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {}
+
+    def reset_stats(self):
+        """Reset statistics"""
+
+class MemoryUserStore(UserStore):
+    """Process-local users, lost on restart; for tests and single-worker development"""
+
+    def __init__(self):
+        self.users: Dict[str, Dict[str, Any]] = {}
+
+    async def get_user(self, username: str) -> Optional[Dict[str, Any]]:
+        return self.users.get(username)
+
+    async def get_user_by_email(self, email: str) -> Optional[Dict[str, Any]]:
+        return next((user for user in self.users.values() if user.get("email") == email), None)
+
+    async def create_user(self, user: Dict[str, Any]) -> bool:
+        if user["username"] in self.users:
+            return False
+        self.users[user["username"]] = dict(user)
+        return True
+
+    async def delete_user(self, username: str) -> bool:
+        return self.users.pop(username, None) is not None
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {'backend': 'memory', 'users': len(self.users)}
+
+class SQLiteUserStore(UserStore):
+    """
+    Users in a SQLite database in WAL mode.
+
+    Queries run on a small thread pool, each thread with its own connection,
+    so the event loop never waits on disk; WAL lets readers proceed while a
+    writer commits, including across uvicorn workers sharing the file.
+    Statements are fixed strings, so each connection's statement cache keeps
+    them prepared. Username is the primary key and email is indexed.
+
+    Lookups go through a read-through LRU of recently seen users. Entries
+    live for `cache_ttl` seconds, which bounds how long a change made by
+    another worker can go unnoticed; misses are not cached, so a user
+    registered elsewhere is visible at once.
+    """
+
+    SCHEMA = (
+        """CREATE TABLE IF NOT EXISTS users (
+            username TEXT PRIMARY KEY,
+            email TEXT,
+            hashed_password TEXT,
+            is_active INTEGER NOT NULL DEFAULT 1,
+            created_at TEXT
+        )""",
+        "CREATE INDEX IF NOT EXISTS users_email ON users (email)",
+    )
+    SELECT_BY_USERNAME = "SELECT username, email, hashed_password, is_active, created_at FROM users WHERE username = ?"
+    SELECT_BY_EMAIL = "SELECT username, email, hashed_password, is_active, created_at FROM users WHERE email = ?"
+    INSERT = "INSERT INTO users (username, email, hashed_password, is_active, created_at) VALUES (?, ?, ?, ?, ?)"
+    DELETE = "DELETE FROM users WHERE username = ?"
+
+    def __init__(self, path: str, workers: int = 4, cache_size: int = 10000, cache_ttl: float = 30.0):
+        self.path = str(path)
+        self.workers = workers
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self._cache: "OrderedDict[str, tuple]" = OrderedDict()
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._initialized = False
+        self._stats = {
+            'queries': 0,
+            'cache_hits': 0,
+            'cache_misses': 0
+        }
+
+    def _connection(self) -> sqlite3.Connection:
+        """This thread's connection, opened and set up on first use"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5.0, check_same_thread=False, cached_statements=32)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=5000")
+            with self._lock:
+                if not self._initialized:
+                    with conn:
+                        for statement in self.SCHEMA:
+                            conn.execute(statement)
+                    self._initialized = True
+                self._connections.append(conn)
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _row_to_user(row: Optional[tuple]) -> Optional[Dict[str, Any]]:
+        if row is None:
+            return None
+        user = dict(zip(USER_FIELDS, row))
+        user["is_active"] = bool(user["is_active"])
+        return user
+
+    @staticmethod
+    def _user_to_row(user: Dict[str, Any]) -> tuple:
+        return (user["username"], user.get("email"), user.get("hashed_password"),
+                int(user.get("is_active", True)), user.get("created_at"))
+
+    async def _run(self, function: Callable[..., Any], *args) -> Any:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="user-store")
+        self._stats['queries'] += 1
+        return await asyncio.get_running_loop().run_in_executor(self._executor, function, *args)
+
+    # Cache
+
+    def _cached(self, username: str) -> Optional[Dict[str, Any]]:
+        entry = self._cache.get(username)
+        if entry is None or entry[1] <= time.monotonic():
+            self._stats['cache_misses'] += 1
+            return None
+        self._cache.move_to_end(username)
+        self._stats['cache_hits'] += 1
+        return entry[0]
+
+    def _remember(self, user: Optional[Dict[str, Any]]):
+        if user is None or self.cache_size <= 0:
+            return
+        self._cache[user["username"]] = (user, time.monotonic() + self.cache_ttl)
+        self._cache.move_to_end(user["username"])
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    # Queries, run on a worker thread
+
+    def _select(self, statement: str, value: str) -> Optional[Dict[str, Any]]:
+        return self._row_to_user(self._connection().execute(statement, (value,)).fetchone())
+
+    def _write(self, statement: str, args: tuple) -> int:
+        conn = self._connection()
+        with conn:
+            return conn.execute(statement, args).rowcount
+
+    def _insert(self, row: tuple) -> bool:
+        try:
+            self._write(self.INSERT, row)
+            return True
+        except sqlite3.IntegrityError:
+            return False
+
+    # Async API
+
+    async def get_user(self, username: str) -> Optional[Dict[str, Any]]:
+        user = self._cached(username)
+        if user is None:
+            user = await self._run(self._select, self.SELECT_BY_USERNAME, username)
+            self._remember(user)
+        return user
+
+    async def get_user_by_email(self, email: str) -> Optional[Dict[str, Any]]:
+        user = await self._run(self._select, self.SELECT_BY_EMAIL, email)
+        self._remember(user)
+        return user
+
+    async def create_user(self, user: Dict[str, Any]) -> bool:
+        created = await self._run(self._insert, self._user_to_row(user))
+        if created:
+            self._remember(self._row_to_user(self._user_to_row(user)))
+        return created
+
+    async def delete_user(self, username: str) -> bool:
+        self._cache.pop(username, None)
+        return await self._run(self._write, self.DELETE, (username,)) > 0
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        # Connections are per thread; forget this thread's closed one
+        self._local = threading.local()
+        self._cache.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get user store statistics"""
+        lookups = self._stats['cache_hits'] + self._stats['cache_misses']
+        return {
+            **self._stats,
+            'backend': 'sqlite',
+            'path': self.path,
+            'cached_users': len(self._cache),
+            'cache_hit_rate': self._stats['cache_hits'] / lookups if lookups else 0
+        }
+
+    def reset_stats(self):
+        """Reset statistics"""
+        self._stats = {key: 0 for key in self._stats}
+
+def create_user_store() -> UserStore:
+    """Build the user store selected by USER_STORE"""
+    backend = os.getenv('USER_STORE', 'sqlite')
+    if backend == 'memory':
+        return MemoryUserStore()
+    if backend == 'sqlite':
+        return SQLiteUserStore(
+            os.getenv('USER_DB_PATH', str(Path(__file__).parent / "data" / "users.db")),
+            workers=int(os.getenv('USER_DB_WORKERS', '4')),
+            cache_size=int(os.getenv('USER_CACHE_SIZE', '10000')),
+            cache_ttl=float(os.getenv('USER_CACHE_TTL', '30'))
+        )
+    raise ValueError(f"Unknown user store '{backend}', expected 'sqlite' or 'memory'")
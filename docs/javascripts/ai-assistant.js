@@ -13,6 +13,14 @@ document.addEventListener('DOMContentLoaded', function() {
 const RATE_LIMIT = 10; // requests per minute
 const rateLimiter = new Map();
 
+// One-click questions; ai-backend/cache_warmer.py pre-caches answers to these
+// for every page, so keep the two lists identical
+const SUGGESTED_QUESTIONS = [
+    'What is this page about?',
+    'Summarize the key steps on this page.',
+    'What should I set up before following this page?'
+];
+
 function checkAuthentication() {
     const token = localStorage.getItem('access_token');
     if (!token) {
@@ -130,6 +138,7 @@ function toggleAIChat() {
         if (!checkAuthentication()) {
             showLoginPromptInChat();
         } else {
+            showSuggestedQuestions();
             document.getElementById('aiChatInput').focus();
         }
     } else {
@@ -138,6 +147,25 @@ function toggleAIChat() {
     }
 }
 
+function showSuggestedQuestions() {
+    const messagesContainer = document.getElementById('aiChatMessages');
+    if (messagesContainer.children.length > 0) return;
+    
+    const suggestions = document.createElement('div');
+    suggestions.className = 'ai-suggestions';
+    SUGGESTED_QUESTIONS.forEach(question => {
+        const button = document.createElement('button');
+        button.className = 'ai-suggestion';
+        button.textContent = question;
+        button.addEventListener('click', () => {
+            document.getElementById('aiChatInput').value = question;
+            sendAIMessage();
+        });
+        suggestions.appendChild(button);
+    });
+    messagesContainer.appendChild(suggestions);
+}
+
 function handleAIChatKeyPress(event) {
     if (event.key === 'Enter') {
         sendAIMessage();
@@ -189,6 +217,7 @@ async function sendAIMessage() {
         const validatedMessage = validateAIInput(message);
         
         // Add user message
+        document.querySelector('.ai-suggestions')?.remove();
         addMessage(validatedMessage, 'user');
         
         // Clear input and show typing indicator
@@ -196,11 +225,12 @@ async function sendAIMessage() {
         showStatus('🤔 Thinking...', 'info');
         addTypingIndicator();
         
-        // Make actual API call
-        const response = await fetch('/api/ai/chat', {
+        // Stream the response so tokens render as they arrive
+        const response = await fetch('/api/ai/chat/stream', {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
+                'Accept': 'text/event-stream',
                 'Authorization': `Bearer ${token}`
             },
             body: JSON.stringify({ 
@@ -209,9 +239,8 @@ async function sendAIMessage() {
             })
         });
         
-        removeTypingIndicator();
-        
         if (!response.ok) {
+            removeTypingIndicator();
             if (response.status === 429) {
                 throw new Error('Rate limit exceeded. Please wait before sending another message.');
             } else if (response.status === 401) {
@@ -221,14 +250,7 @@ async function sendAIMessage() {
             }
         }
         
-        const data = await response.json();
-        
-        if (data.error) {
-            throw new Error(data.error);
-        }
-        
-        // Add AI response
-        addMessage(data.response, 'assistant');
+        await renderStreamedResponse(response);
         showStatus('✓ Response received', 'success');
         
     } catch (error) {
@@ -241,6 +263,76 @@ async function sendAIMessage() {
     }
 }
 
+// Parse server-sent events from a fetch response and render tokens incrementally
+async function renderStreamedResponse(response) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let messageBody = null;
+    
+    const handleEvent = (eventName, data) => {
+        const payload = JSON.parse(data);
+        if (eventName === 'error') {
+            throw new Error(payload.error);
+        }
+        if (eventName === 'token') {
+            if (!messageBody) {
+                // Replace the typing indicator with the message on the first token
+                removeTypingIndicator();
+                messageBody = startStreamingMessage();
+            }
+            messageBody.textContent += payload.content;
+            const messagesContainer = document.getElementById('aiChatMessages');
+            messagesContainer.scrollTop = messagesContainer.scrollHeight;
+        }
+    };
+    
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        
+        // Events are separated by a blank line
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+            const frame = buffer.slice(0, boundary);
+            buffer = buffer.slice(boundary + 2);
+            
+            let eventName = 'message';
+            const dataLines = [];
+            frame.split('\n').forEach(line => {
+                if (line.startsWith('event:')) {
+                    eventName = line.slice(6).trim();
+                } else if (line.startsWith('data:')) {
+                    dataLines.push(line.slice(5).trimStart());
+                }
+            });
+            if (dataLines.length) {
+                handleEvent(eventName, dataLines.join('\n'));
+            }
+        }
+    }
+    
+    removeTypingIndicator();
+    if (!messageBody) {
+        throw new Error('Empty response from assistant');
+    }
+    saveConversationHistory();
+}
+
+function startStreamingMessage() {
+    const messagesContainer = document.getElementById('aiChatMessages');
+    const messageElement = document.createElement('div');
+    messageElement.className = 'ai-message assistant';
+    messageElement.innerHTML = '<strong>Assistant:</strong><br>';
+    
+    const body = document.createElement('span');
+    body.style.whiteSpace = 'pre-wrap';
+    messageElement.appendChild(body);
+    messagesContainer.appendChild(messageElement);
+    return body;
+}
+
 function getWindowContext() {
     // Extract relevant context from the current page
     const title = document.title;
@@ -0,0 +1,59 @@
+"""Per-request authentication overhead benchmark.
+
+Resolves the same bearer token through get_current_user N times and reports
+the time per call. ``--no-cache`` verifies the JWT on every call, as before
+the token cache existed.
+
+    python tests/benchmarks/bench_auth.py --calls 50000
+    python tests/benchmarks/bench_auth.py --calls 50000 --no-cache
+"""
+
+import argparse
+import asyncio
+import time
+
+from harness import add_backend_to_path, emit, summarize
+
+
+async def run(calls, cache_enabled):
+    add_backend_to_path()
+    from fastapi.security import HTTPAuthorizationCredentials
+    import main
+    from token_cache import TokenCache
+
+    main.token_cache = TokenCache(max_entries=10000 if cache_enabled else 0)
+    await main.users_db.create_user({"username": "bench", "email": "bench@example.com", "is_active": True})
+    credentials = HTTPAuthorizationCredentials(scheme="Bearer",
+                                               credentials=main.create_access_token({"sub": "bench"}))
+
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(calls):
+        began = time.perf_counter()
+        await main.get_current_user(credentials)
+        latencies.append(time.perf_counter() - began)
+    elapsed = time.perf_counter() - start
+    return latencies, elapsed, main.token_cache.get_stats()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--calls", type=int, default=50000)
+    parser.add_argument("--no-cache", action="store_true", help="verify the JWT on every call")
+    args = parser.parse_args()
+
+    latencies, elapsed, stats = asyncio.run(run(args.calls, not args.no_cache))
+
+    result = {
+        "benchmark": "auth_overhead",
+        "token_cache": not args.no_cache,
+        "calls_per_second": round(len(latencies) / elapsed, 1),
+        "mean_us": round(elapsed / len(latencies) * 1e6, 3),
+        "hit_rate": stats["hit_rate"],
+    }
+    result.update(summarize(latencies))
+    emit(result)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""Response cache hot-hit latency benchmark.
+
+Writes one entry, then reads it back N times through AIResponseCache.get and
+reports per-lookup latency. ``--no-local-tier`` sends every lookup to Redis,
+as before the in-process tier existed.
+
+    python tests/benchmarks/bench_cache.py --lookups 20000
+    python tests/benchmarks/bench_cache.py --lookups 20000 --no-local-tier
+"""
+
+import argparse
+import asyncio
+import time
+
+from harness import add_backend_to_path, emit, redis_standin, summarize
+
+
+async def run(url, lookups, local_tier):
+    add_backend_to_path()
+    from cache import AIResponseCache
+
+    cache = AIResponseCache(redis_url=url)
+    await cache.initialize()
+    if not local_tier:
+        cache.local_tier = None
+
+    context = {"page_title": "ZFS", "page_url": "/homelab/storage/", "headings": "Pools"}
+    await cache.set("How do I create a pool?", "zpool create tank mirror sda sdb" * 20,
+                    max_tokens=1000, temperature=0.7, context=context)
+
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(lookups):
+        began = time.perf_counter()
+        await cache.get("How do I create a pool?", max_tokens=1000, temperature=0.7, context=context)
+        latencies.append(time.perf_counter() - began)
+    elapsed = time.perf_counter() - start
+
+    stats = await cache.get_stats()
+    await cache.close()
+    return latencies, elapsed, stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--lookups", type=int, default=20000)
+    parser.add_argument("--no-local-tier", action="store_true",
+                        help="read every lookup from Redis")
+    args = parser.parse_args()
+
+    with redis_standin() as url:
+        latencies, elapsed, stats = asyncio.run(run(url, args.lookups, not args.no_local_tier))
+
+    result = {
+        "benchmark": "response_cache_hot_hit",
+        "local_tier": not args.no_local_tier,
+        "lookups": args.lookups,
+        "lookups_per_second": round(len(latencies) / elapsed, 1),
+        "hit_rate": stats["hit_rate"],
+    }
+    result.update(summarize(latencies))
+    emit(result)
+
+
+if __name__ == "__main__":
+    main()
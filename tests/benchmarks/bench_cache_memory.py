@@ -0,0 +1,129 @@
+"""Response cache memory benchmark.
+
+Stores N synthetic generate_content outputs twice: once the way the cache did
+before the binary entry format (JSON text, response duplicated inside the
+similarity entry) and once through AIResponseCache.set. Reports the stored
+value bytes for each layout and, against a real server (``--redis-url``), the
+per-key MEMORY USAGE Redis reports.
+
+    python tests/benchmarks/bench_cache_memory.py --entries 2000
+    python tests/benchmarks/bench_cache_memory.py --redis-url redis://localhost:6379/15
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import random
+import time
+
+from harness import add_backend_to_path, emit, redis_standin
+
+TOPICS = ["ZFS", "Proxmox", "Docker", "WireGuard", "Traefik", "Ansible", "Grafana", "Ceph", "pfSense", "Samba"]
+TECH_WORDS = ("pool dataset snapshot container volume network bridge firewall rule backup restore cluster node "
+              "service config tunnel certificate monitoring alert dashboard replica storage disk mirror").split()
+SYLLABLES = "ba ce di fo gu ha je ki lo mu na pe qui ro su ta ve wi xo yu ze an en in on un ar er ir or ur".split()
+
+
+def vocabulary(rng, size=3000):
+    """Technical terms plus pseudo-words, so bodies compress roughly like English prose"""
+    words = {"".join(rng.choice(SYLLABLES) for _ in range(rng.randint(1, 4))) for _ in range(size)}
+    return TECH_WORDS + sorted(words)
+
+
+WORDS = vocabulary(random.Random(3))
+
+
+def synthetic_guide(topic, rng):
+    """A markdown guide shaped like a generate_content completion"""
+    sections = []
+    for heading in ("Overview", "Key Concepts", "Implementation", "Best Practices", "Troubleshooting"):
+        paragraph = " ".join(rng.choice(WORDS) for _ in range(rng.randint(60, 120)))
+        sections.append(f"## {heading}\n\n{topic} {paragraph}.\n")
+        if heading == "Implementation":
+            commands = "\n".join(f"sudo {rng.choice(WORDS)} --{rng.choice(WORDS)} {rng.randint(1, 99)}"
+                                 for _ in range(8))
+            sections.append(f"```bash\n{commands}\n```\n")
+    return f"# {topic} Guide\n\n" + "\n".join(sections)
+
+
+async def legacy_set(redis_conn, cache, prompt, response, ttl):
+    """The JSON layout used before the binary entry format"""
+    await redis_conn.set(cache._get_cache_key(prompt, max_tokens=2000, temperature=0.7), json.dumps(response), ex=ttl)
+    similarity = {"prompt": prompt, "response": response, "timestamp": time.time()}
+    await redis_conn.set(cache._get_similarity_key(prompt), json.dumps(similarity), ex=ttl * 2)
+
+
+async def measure(redis_conn, prefix_patterns, memory_usage):
+    """Sum value bytes (and MEMORY USAGE on a real server) over matching keys"""
+    value_bytes = memory = 0
+    for pattern in prefix_patterns:
+        async for key in redis_conn.scan_iter(match=pattern, count=1000):
+            value_bytes += await redis_conn.strlen(key)
+            if memory_usage:
+                memory += await redis_conn.memory_usage(key) or 0
+    return value_bytes, memory if memory_usage else None
+
+
+async def run(url, entries, memory_usage):
+    add_backend_to_path()
+    import redis.asyncio as aioredis
+    from cache import AIResponseCache
+
+    rng = random.Random(7)
+    corpus = [(f"Create a guide about {rng.choice(TOPICS)} #{i}", synthetic_guide(rng.choice(TOPICS), rng))
+              for i in range(entries)]
+    raw_text_bytes = sum(len(response.encode()) for _, response in corpus)
+
+    redis_conn = aioredis.from_url(url, decode_responses=True)
+    cache = AIResponseCache(redis_url=url)
+    cache.redis = redis_conn
+    cache.local_tier = None
+    patterns = ("ai_response:*", "ai_similarity:*")
+
+    await redis_conn.flushdb()
+    for prompt, response in corpus:
+        await legacy_set(redis_conn, cache, prompt, response, ttl=3600)
+    legacy_bytes, legacy_memory = await measure(redis_conn, patterns, memory_usage)
+
+    await redis_conn.flushdb()
+    for prompt, response in corpus:
+        await cache.set(prompt, response, max_tokens=2000, temperature=0.7)
+    binary_bytes, binary_memory = await measure(redis_conn, patterns, memory_usage)
+
+    sample_prompt, sample_response = corpus[0]
+    round_trip_ok = await cache.get(sample_prompt, max_tokens=2000, temperature=0.7) == sample_response
+    await redis_conn.flushdb()
+    await redis_conn.aclose()
+
+    result = {
+        "benchmark": "response_cache_memory",
+        "entries": entries,
+        "response_text_bytes": raw_text_bytes,
+        "legacy_value_bytes": legacy_bytes,
+        "binary_value_bytes": binary_bytes,
+        "value_bytes_saved_pct": round(100 * (1 - binary_bytes / legacy_bytes), 1),
+        "round_trip_ok": round_trip_ok,
+    }
+    if legacy_memory is not None and binary_memory is not None:
+        result.update({
+            "legacy_memory_usage": legacy_memory,
+            "binary_memory_usage": binary_memory,
+            "memory_saved_pct": round(100 * (1 - binary_memory / legacy_memory), 1),
+        })
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--entries", type=int, default=2000)
+    parser.add_argument("--redis-url", help="use this (disposable!) database instead of a local stand-in")
+    args = parser.parse_args()
+
+    standin = contextlib.nullcontext(args.redis_url) if args.redis_url else redis_standin()
+    with standin as url:
+        emit(asyncio.run(run(url, args.entries, memory_usage=bool(args.redis_url))))
+
+
+if __name__ == "__main__":
+    main()
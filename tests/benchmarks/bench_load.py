@@ -0,0 +1,205 @@
+"""End-to-end load test of the ai-backend API.
+
+Drives /auth/login, /api/ai/chat, /api/files and /api/stats with a closed
+loop of concurrent clients and reports RPS, latency percentiles and error
+rates per endpoint. The app runs in-process against a Redis stand-in and
+the mock LLM server, so no network or API key is needed; per-route rate
+limits and login backoff are lifted unless ``--keep-rate-limits`` is
+given, and logins queue for a password check slot instead of being
+refused. ``--url`` points the load at a running deployment instead.
+
+Results carry the git commit; save them with ``--output`` to compare commits.
+
+    python tests/benchmarks/bench_load.py --requests 500 --concurrency 50
+    python tests/benchmarks/bench_load.py --scenarios chat --llm-latency 0.5 --llm-error-rate 0.05
+    python tests/benchmarks/bench_load.py --output bench-$(git rev-parse --short HEAD).json
+    python tests/benchmarks/bench_load.py --url http://localhost:8000 --scenarios files,stats
+"""
+
+import argparse
+import asyncio
+import contextlib
+import os
+import random
+import time
+from collections import Counter
+
+from harness import add_backend_to_path, emit, mock_llm, redis_standin, summarize
+
+SCENARIOS = ("login", "chat", "files", "stats")
+PASSWORD = "benchmark-password-123"
+
+CHAT_TOPICS = ("ZFS snapshots", "Docker networks", "Traefik certificates", "Proxmox backups",
+               "Grafana alerts", "VLAN tagging", "Pi-hole DNS", "WireGuard peers")
+
+
+def build_app(keep_rate_limits, keep_login_throttle=None):
+    """Import the backend, lifting rate limits and, unless kept, login backoff."""
+    add_backend_to_path()
+    import main
+    import login_throttle
+    from rate_limiter import RateLimitRule
+
+    if not keep_rate_limits:
+        main.rate_limiter.rules = {}
+        main.rate_limiter._prefixes = []
+        main.rate_limiter.default_rule = RateLimitRule(10 ** 9, main.SecurityConfig.RATE_LIMIT_WINDOW,
+                                                       main.rate_limiter.default_rule.algorithm)
+    if not (keep_rate_limits if keep_login_throttle is None else keep_login_throttle):
+        # Keep the password check slots, but let a closed loop of logins wait for one
+        unlimited = login_throttle.BackoffPolicy(free_failures=10 ** 9)
+        login_throttle._login_throttle = login_throttle.LoginThrottle(unlimited, unlimited,
+                                                                      slot_timeout=120)
+    return main
+
+
+def chat_prompts(count, seed):
+    """`count` distinct chat questions in a seeded order."""
+    rng = random.Random(seed)
+    prompts = [f"Question {i}: how should I set up {CHAT_TOPICS[i % len(CHAT_TOPICS)]}?" for i in range(count)]
+    rng.shuffle(prompts)
+    return prompts
+
+
+class LoadRunner:
+    """Runs each scenario with `concurrency` clients until `requests` have completed."""
+
+    def __init__(self, client, users, concurrency, requests, prompts):
+        self.client = client
+        self.users = users
+        self.concurrency = concurrency
+        self.requests = requests
+        self.prompts = prompts
+
+    async def setup(self):
+        """Register the benchmark users and collect their access tokens."""
+        self.tokens = []
+        for username in self.users:
+            response = await self.client.post("/auth/register", json={
+                "username": username, "email": f"{username}@example.com", "password": PASSWORD
+            })
+            if response.status_code != 200:
+                response = await self.client.post("/auth/login", json={"username": username, "password": PASSWORD})
+            response.raise_for_status()
+            self.tokens.append(response.json()["access_token"])
+
+    def request(self, scenario, i):
+        """The i-th request of a scenario."""
+        if scenario == "login":
+            return self.client.post("/auth/login", json={"username": self.users[i % len(self.users)],
+                                                         "password": PASSWORD})
+        if scenario == "chat":
+            headers = {"Authorization": f"Bearer {self.tokens[i % len(self.tokens)]}"}
+            return self.client.post("/api/ai/chat", json={"message": self.prompts[i % len(self.prompts)]},
+                                    headers=headers)
+        if scenario == "files":
+            return self.client.get("/api/files")
+        return self.client.get("/api/stats")
+
+    async def run(self, scenario):
+        latencies = []
+        statuses = Counter()
+        cache = Counter()
+        issued = 0
+
+        async def worker():
+            nonlocal issued
+            while issued < self.requests:
+                i = issued
+                issued += 1
+                start = time.perf_counter()
+                try:
+                    response = await self.request(scenario, i)
+                    statuses[response.status_code] += 1
+                    if "X-Cache" in response.headers:
+                        cache[response.headers["X-Cache"]] += 1
+                except Exception as e:
+                    statuses[type(e).__name__] += 1
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(self.concurrency)))
+        elapsed = time.perf_counter() - start
+
+        failed = sum(count for status, count in statuses.items() if not (isinstance(status, int) and status < 400))
+        result = {
+            "rps": round(len(latencies) / elapsed, 1),
+            "error_rate": round(failed / len(latencies), 4) if latencies else 0.0,
+            "statuses": {str(status): count for status, count in sorted(statuses.items(), key=str)},
+        }
+        result.update(summarize(latencies))
+        if cache:
+            result["cache"] = dict(cache)
+        return result
+
+
+async def run(args, base_url, app=None):
+    import httpx
+
+    transport = httpx.ASGITransport(app=app) if app is not None else None
+    timeout = httpx.Timeout(60.0)
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(transport=transport, base_url=base_url, timeout=timeout, limits=limits) as client:
+        users = [f"bench{i}" for i in range(args.users)]
+        runner = LoadRunner(client, users, args.concurrency, args.requests,
+                            chat_prompts(args.chat_prompts, args.seed))
+        await runner.setup()
+        results = {}
+        for scenario in args.scenarios:
+            results[scenario] = await runner.run(scenario)
+    return results
+
+
+def parse_scenarios(value):
+    scenarios = [name.strip() for name in value.split(",") if name.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        raise argparse.ArgumentTypeError(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    return scenarios
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenarios", type=parse_scenarios, default=list(SCENARIOS),
+                        help=f"comma-separated, from {','.join(SCENARIOS)}")
+    parser.add_argument("--requests", type=int, default=500, help="requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--chat-prompts", type=int, default=100,
+                        help="distinct chat questions; fewer means more cache hits")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--llm-latency", type=float, default=0.2)
+    parser.add_argument("--llm-tokens-per-second", type=float, default=0.0)
+    parser.add_argument("--llm-reply-tokens", type=int, default=64)
+    parser.add_argument("--llm-error-rate", type=float, default=0.0)
+    parser.add_argument("--keep-rate-limits", action="store_true",
+                        help="leave the per-route rate limits in place")
+    parser.add_argument("--url", help="load a running server instead of the in-process app")
+    parser.add_argument("--output", help="also write the JSON result to this file")
+    args = parser.parse_args()
+
+    config = {key: value for key, value in vars(args).items() if key != "output"}
+    if args.url:
+        results = asyncio.run(run(args, args.url))
+    else:
+        with contextlib.ExitStack() as stack:
+            os.environ["REDIS_URL"] = stack.enter_context(redis_standin())
+            os.environ["OPENAI_API_BASE"] = stack.enter_context(mock_llm(
+                latency=args.llm_latency, tokens_per_second=args.llm_tokens_per_second,
+                reply_tokens=args.llm_reply_tokens, error_rate=args.llm_error_rate, seed=args.seed))
+            os.environ["LLM_PROVIDER"] = "local"
+            backend = build_app(args.keep_rate_limits)
+
+            async def in_process():
+                try:
+                    return await run(args, "http://bench", backend.app)
+                finally:
+                    await backend.shutdown_event()
+
+            results = asyncio.run(in_process())
+
+    emit({"benchmark": "load", "config": config, "scenarios": results}, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""Credential stuffing benchmark for login throttling.
+
+A legitimate user logs in over and over from their own IP, first on an idle
+server and then while attackers on ``--attacker-ips`` addresses replay a
+leaked credential list of existing accounts with wrong passwords and of
+unknown usernames. Reports the legitimate login latency and status codes
+in both phases, along with how many attack attempts reached bcrypt.
+``--no-throttle`` admits every attempt, as before the login throttle.
+
+    python tests/benchmarks/bench_login_throttle.py --attack-seconds 10
+    python tests/benchmarks/bench_login_throttle.py --attack-seconds 10 --no-throttle
+"""
+
+import argparse
+import asyncio
+import contextlib
+import os
+import time
+
+from harness import emit, redis_standin, summarize
+from bench_load import PASSWORD, build_app
+
+
+async def legitimate_logins(client, username, stop):
+    """Log in back to back until stopped; return latencies and status counts."""
+    latencies = []
+    statuses = {}
+    while not stop.is_set():
+        start = time.perf_counter()
+        response = await client.post("/auth/login", json={"username": username, "password": PASSWORD})
+        latencies.append(time.perf_counter() - start)
+        statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+    return latencies, statuses
+
+
+def status_counts(statuses):
+    return {str(code): count for code, count in sorted(statuses.items())}
+
+
+async def run(backend, accounts, attacker_ips, concurrency, idle_seconds, attack_seconds):
+    import httpx
+
+    def client_from(ip):
+        transport = httpx.ASGITransport(app=backend.app, client=(ip, 40000))
+        return httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120)
+
+    async with contextlib.AsyncExitStack() as stack:
+        legit = await stack.enter_async_context(client_from("192.0.2.10"))
+        attackers = [await stack.enter_async_context(client_from(f"198.51.100.{i + 1}"))
+                     for i in range(attacker_ips)]
+
+        victims = [f"victim{i}" for i in range(accounts)]
+        for username in victims + ["legit"]:
+            await legit.post("/auth/register", json={
+                "username": username, "email": f"{username}@example.com", "password": PASSWORD
+            })
+        hasher = backend.get_password_hasher(backend.pwd_context)
+        hasher.reset_stats()
+
+        stop = asyncio.Event()
+        idle = asyncio.create_task(legitimate_logins(legit, "legit", stop))
+        await asyncio.sleep(idle_seconds)
+        stop.set()
+        idle_latencies, idle_statuses = await idle
+
+        attack_statuses = {}
+        attempts = 0
+        verifies_before = hasher.get_stats()["verifies"]
+
+        async def attacker(worker):
+            nonlocal attempts
+            while not stop.is_set():
+                i = attempts
+                attempts += 1
+                # Half the list names real accounts, half unknown usernames
+                username = victims[i % accounts] if i % 2 else f"leaked{i}"
+                response = await attackers[worker % attacker_ips].post(
+                    "/auth/login", json={"username": username, "password": f"hunter{i}"})
+                attack_statuses[response.status_code] = attack_statuses.get(response.status_code, 0) + 1
+
+        stop = asyncio.Event()
+        attack = [asyncio.create_task(attacker(worker)) for worker in range(concurrency)]
+        probe = asyncio.create_task(legitimate_logins(legit, "legit", stop))
+        await asyncio.sleep(attack_seconds)
+        stop.set()
+        attack_latencies, attack_legit_statuses = await probe
+        await asyncio.gather(*attack)
+        # Legitimate logins that got past the throttle were verified too
+        legit_verifies = attack_legit_statuses.get(200, 0) + attack_legit_statuses.get(401, 0)
+        attack_verifies = hasher.get_stats()["verifies"] - verifies_before - legit_verifies
+
+    return {
+        "legitimate_idle": {"statuses": status_counts(idle_statuses), **summarize(idle_latencies)},
+        "legitimate_under_attack": {"statuses": status_counts(attack_legit_statuses),
+                                    **summarize(attack_latencies)},
+        "attack": {
+            "attempts": attempts,
+            "per_second": round(attempts / attack_seconds, 1),
+            "statuses": status_counts(attack_statuses),
+            "bcrypt_verifies": attack_verifies,
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--accounts", type=int, default=20, help="existing accounts on the leaked list")
+    parser.add_argument("--attacker-ips", type=int, default=10)
+    parser.add_argument("--concurrency", type=int, default=50, help="concurrent attack requests")
+    parser.add_argument("--idle-seconds", type=float, default=3.0)
+    parser.add_argument("--attack-seconds", type=float, default=10.0)
+    parser.add_argument("--no-throttle", action="store_true", help="admit every login attempt")
+    parser.add_argument("--output", help="also write the JSON result to this file")
+    args = parser.parse_args()
+
+    with contextlib.ExitStack() as stack:
+        os.environ["REDIS_URL"] = stack.enter_context(redis_standin())
+        backend = build_app(keep_rate_limits=False, keep_login_throttle=True)
+        import login_throttle
+        if args.no_throttle:
+            unlimited = login_throttle.BackoffPolicy(free_failures=10 ** 9)
+            login_throttle._login_throttle = login_throttle.LoginThrottle(unlimited, unlimited,
+                                                                          max_concurrent=10 ** 9)
+
+        async def in_process():
+            try:
+                result = await run(backend, args.accounts, args.attacker_ips, args.concurrency,
+                                   args.idle_seconds, args.attack_seconds)
+                result["throttle"] = login_throttle.get_login_throttle().get_stats()
+                return result
+            finally:
+                await backend.shutdown_event()
+
+        result = asyncio.run(in_process())
+
+    result.update({
+        "benchmark": "login_credential_stuffing",
+        "throttle_enabled": not args.no_throttle,
+        "attacker_ips": args.attacker_ips,
+        "concurrency": args.concurrency,
+    })
+    emit(result, args.output)
+
+
+if __name__ == "__main__":
+    main()
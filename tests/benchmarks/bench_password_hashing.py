@@ -0,0 +1,145 @@
+"""Login storm benchmark for password hashing.
+
+Fires concurrent logins at /auth/login while a probe client sends chat
+requests one after another, and reports login throughput next to chat
+latency before and during the storm. ``--mode blocking`` hashes inline in
+the handler, as before the worker pool existed.
+
+    python tests/benchmarks/bench_password_hashing.py --logins 200 --concurrency 50
+    python tests/benchmarks/bench_password_hashing.py --mode blocking
+    python tests/benchmarks/bench_password_hashing.py --workers 8 --max-pending 64
+"""
+
+import argparse
+import asyncio
+import contextlib
+import os
+import time
+
+from harness import emit, mock_llm, redis_standin, summarize
+from bench_load import PASSWORD, build_app
+
+
+class InlineHasher:
+    """The pre-pool behaviour: bcrypt runs on the event loop."""
+
+    def __init__(self, context):
+        self.context = context
+
+    async def hash(self, password):
+        return self.context.hash(password)
+
+    async def verify(self, password, hashed_password):
+        return self.context.verify(password, hashed_password)
+
+
+async def probe_chat(client, headers, stop, label):
+    """Send chat requests back to back until stopped; return their latencies."""
+    latencies = []
+    i = 0
+    while not stop.is_set():
+        start = time.perf_counter()
+        await client.post("/api/ai/chat", json={"message": f"{label} probe {i}"}, headers=headers)
+        latencies.append(time.perf_counter() - start)
+        i += 1
+    return latencies
+
+
+async def run(backend, logins, concurrency, idle_seconds):
+    import httpx
+
+    transport = httpx.ASGITransport(app=backend.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+        users = [f"storm{i}" for i in range(min(concurrency, 20))]
+        for username in users:
+            await client.post("/auth/register", json={
+                "username": username, "email": f"{username}@example.com", "password": PASSWORD
+            })
+        token = (await client.post("/auth/login", json={"username": users[0], "password": PASSWORD})).json()
+        headers = {"Authorization": f"Bearer {token['access_token']}"}
+
+        stop = asyncio.Event()
+        idle = asyncio.create_task(probe_chat(client, headers, stop, "idle"))
+        await asyncio.sleep(idle_seconds)
+        stop.set()
+        idle_latencies = await idle
+
+        semaphore = asyncio.Semaphore(concurrency)
+        login_latencies = []
+        statuses = {}
+
+        async def login(i):
+            async with semaphore:
+                start = time.perf_counter()
+                response = await client.post("/auth/login", json={"username": users[i % len(users)],
+                                                                  "password": PASSWORD})
+                login_latencies.append(time.perf_counter() - start)
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+        stop = asyncio.Event()
+        storm_probe = asyncio.create_task(probe_chat(client, headers, stop, "storm"))
+        start = time.perf_counter()
+        await asyncio.gather(*(login(i) for i in range(logins)))
+        elapsed = time.perf_counter() - start
+        stop.set()
+        storm_latencies = await storm_probe
+
+    return {
+        "logins": {
+            "per_second": round(statuses.get(200, 0) / elapsed, 1),
+            "statuses": {str(code): count for code, count in sorted(statuses.items())},
+            **summarize(login_latencies),
+        },
+        "chat_idle": summarize(idle_latencies),
+        "chat_during_logins": summarize(storm_latencies),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--mode", choices=["pool", "blocking"], default="pool")
+    parser.add_argument("--workers", type=int, default=0, help="hashing threads (default: CPU count)")
+    parser.add_argument("--max-pending", type=int, default=0,
+                        help="admission limit (default: 8 per worker)")
+    parser.add_argument("--idle-seconds", type=float, default=2.0)
+    parser.add_argument("--llm-latency", type=float, default=0.05)
+    parser.add_argument("--output", help="also write the JSON result to this file")
+    args = parser.parse_args()
+
+    if args.workers:
+        os.environ["PASSWORD_HASH_WORKERS"] = str(args.workers)
+    if args.max_pending:
+        os.environ["PASSWORD_HASH_MAX_PENDING"] = str(args.max_pending)
+
+    with contextlib.ExitStack() as stack:
+        os.environ["REDIS_URL"] = stack.enter_context(redis_standin())
+        os.environ["OPENAI_API_BASE"] = stack.enter_context(mock_llm(latency=args.llm_latency,
+                                                                     tokens_per_second=0))
+        os.environ["LLM_PROVIDER"] = "local"
+        backend = build_app(keep_rate_limits=False)
+        if args.mode == "blocking":
+            backend.get_password_hasher = InlineHasher
+
+        async def in_process():
+            try:
+                result = await run(backend, args.logins, args.concurrency, args.idle_seconds)
+                if args.mode == "pool":
+                    result["hasher"] = backend.get_password_hasher(backend.pwd_context).get_stats()
+                return result
+            finally:
+                await backend.shutdown_event()
+
+        result = asyncio.run(in_process())
+
+    result.update({
+        "benchmark": "password_hashing_login_storm",
+        "mode": args.mode,
+        "concurrency": args.concurrency,
+    })
+    emit(result, args.output)
+
+
+if __name__ == "__main__":
+    main()
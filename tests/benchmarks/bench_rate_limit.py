@@ -0,0 +1,126 @@
+"""Rate limit middleware latency benchmark.
+
+Fires N concurrent requests at a trivial endpoint wrapped in the rate limit
+middleware and reports latency percentiles. ``--mode blocking`` replays the
+previous synchronous GET/SETEX/INCR implementation for comparison.
+
+    python tests/benchmarks/bench_rate_limit.py --requests 1000 --mode async
+    python tests/benchmarks/bench_rate_limit.py --requests 1000 --mode blocking
+    python tests/benchmarks/bench_rate_limit.py --algorithm token_bucket
+    python tests/benchmarks/bench_rate_limit.py --no-local-tier
+"""
+
+import argparse
+import asyncio
+import os
+import time
+
+from harness import add_backend_to_path, emit, redis_standin, summarize
+
+
+def build_app(mode, algorithm, local_tier):
+    add_backend_to_path()
+    import redis
+    from fastapi import FastAPI
+    from starlette.middleware.base import BaseHTTPMiddleware
+    import main
+    from main import RateLimitMiddleware, SecurityConfig
+    from rate_limiter import RateLimitRule
+
+    main.rate_limiter.default_rule = RateLimitRule(10 ** 9, SecurityConfig.RATE_LIMIT_WINDOW, algorithm)
+    if not local_tier:
+        main.rate_limiter.local_tier = None
+
+    class BlockingRateLimitMiddleware(BaseHTTPMiddleware):
+        """The pre-async implementation: three blocking round trips."""
+
+        def __init__(self, app):
+            super().__init__(app)
+            self.redis = redis.from_url(os.environ["REDIS_URL"], decode_responses=True)
+
+        async def dispatch(self, request, call_next):
+            key = f"rate_limit:{request.client.host}:{request.url.path}"
+            current = self.redis.get(key)
+            if current is None:
+                self.redis.setex(key, SecurityConfig.RATE_LIMIT_WINDOW, 1)
+            else:
+                self.redis.incr(key)
+            return await call_next(request)
+
+    app = FastAPI()
+
+    @app.get("/api/ping")
+    async def ping():
+        return {"ok": True}
+
+    app.add_middleware(BlockingRateLimitMiddleware if mode == "blocking" else RateLimitMiddleware)
+    return app
+
+
+async def run(app, total, concurrency):
+    import httpx
+
+    transport = httpx.ASGITransport(app=app)
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = 0
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        # Warm up the connection pool and script cache
+        await client.get("/api/ping")
+
+        async def one():
+            nonlocal errors
+            async with semaphore:
+                start = time.perf_counter()
+                response = await client.get("/api/ping")
+                latencies.append(time.perf_counter() - start)
+                if response.status_code != 200:
+                    errors += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(total)))
+        elapsed = time.perf_counter() - start
+
+    # Stop the sync task and release the Redis pool before the loop closes
+    import main as backend
+    from redis_pool import close_async_redis
+    await backend.rate_limiter.close()
+    await close_async_redis()
+    return latencies, errors, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=1000)
+    parser.add_argument("--mode", choices=["async", "blocking"], default="async")
+    parser.add_argument("--algorithm", default="sliding_window",
+                        choices=["fixed_window", "sliding_window", "token_bucket"])
+    parser.add_argument("--no-local-tier", action="store_true",
+                        help="check every request against Redis")
+    args = parser.parse_args()
+
+    with redis_standin() as url:
+        os.environ["REDIS_URL"] = url
+        app = build_app(args.mode, args.algorithm, not args.no_local_tier)
+        latencies, errors, elapsed = asyncio.run(run(app, args.requests, args.concurrency))
+
+    result = {
+        "benchmark": "rate_limit_middleware",
+        "mode": args.mode,
+        "algorithm": args.algorithm if args.mode == "async" else "fixed_window",
+        "concurrency": args.concurrency,
+        "errors": errors,
+        "rps": round(len(latencies) / elapsed, 1),
+    }
+    result.update(summarize(latencies))
+    if args.mode == "async":
+        import main as backend
+        if backend.rate_limiter.local_tier is not None:
+            result["local_tier"] = backend.rate_limiter.local_tier.get_stats()
+    emit(result)
+
+
+if __name__ == "__main__":
+    main()
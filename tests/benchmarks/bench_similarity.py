@@ -0,0 +1,116 @@
+"""Similarity index lookup benchmark.
+
+Indexes N synthetic documentation questions, then times lookups of lightly
+paraphrased variants (hits) and unrelated questions (misses). Reports lookup
+latency percentiles, paraphrase recall, the LSH prefilter's recall against a
+brute-force scan, and index memory.
+
+    python tests/benchmarks/bench_similarity.py --prompts 100000
+    python tests/benchmarks/bench_similarity.py --threshold 0.7
+"""
+
+import argparse
+import random
+import time
+
+from harness import add_backend_to_path, emit, summarize
+
+SUBJECTS = [
+    "zfs pool", "docker container", "proxmox cluster", "kubernetes ingress", "nginx reverse proxy",
+    "wireguard tunnel", "pfsense firewall", "ansible playbook", "grafana dashboard", "prometheus exporter",
+    "truenas share", "traefik router", "postgres replica", "redis sentinel", "ceph osd", "lvm volume",
+    "systemd timer", "cron job", "samba share", "nfs export", "vlan trunk", "bind9 zone", "pihole blocklist",
+    "home assistant automation", "certbot certificate", "borg backup", "restic snapshot", "zabbix agent",
+]
+ACTIONS = [
+    "set up", "configure", "troubleshoot", "monitor", "back up", "upgrade", "secure", "migrate",
+    "benchmark", "automate", "debug", "scale", "restore", "harden", "document", "tune",
+]
+QUALIFIERS = [
+    "on a raspberry pi", "in my homelab", "behind a nat", "with high availability", "on ubuntu 22.04",
+    "using docker compose", "for a small office", "without downtime", "with ipv6", "on debian 12",
+    "over a vpn", "with ssl", "on bare metal", "inside a vm", "with ansible", "for beginners",
+]
+FILLERS = ["please", "exactly", "quickly", "properly", "step by step", "again"]
+
+
+def synthetic_prompts(count, rng):
+    prompts = set()
+    while len(prompts) < count:
+        subject = rng.choice(SUBJECTS)
+        prompts.add(" ".join([
+            rng.choice(["How do I", "What is the best way to", "Can you explain how to", "Help me"]),
+            rng.choice(ACTIONS), "a", subject, rng.choice(QUALIFIERS),
+            rng.choice(QUALIFIERS), f"(case {rng.randrange(10 ** 6)})",
+        ]))
+    return list(prompts)
+
+
+def paraphrase(prompt, rng):
+    words = prompt.split()
+    words.insert(rng.randrange(len(words)), rng.choice(FILLERS))
+    return " ".join(words).upper() if rng.random() < 0.3 else " ".join(words)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--prompts", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--threshold", type=float, default=0.85)
+    parser.add_argument("--dim", type=int, default=512)
+    parser.add_argument("--exhaustive-queries", type=int, default=200,
+                        help="queries also answered by brute force to measure LSH recall")
+    args = parser.parse_args()
+
+    add_backend_to_path()
+    from similarity_index import SimilarityIndex
+
+    rng = random.Random(42)
+    prompts = synthetic_prompts(args.prompts, rng)
+    index = SimilarityIndex(dim=args.dim, max_entries=args.prompts)
+
+    start = time.perf_counter()
+    for i, prompt in enumerate(prompts):
+        index.add(f"ai_similarity:{i}", prompt, expires_at=float("inf"))
+    build_seconds = time.perf_counter() - start
+
+    hit_latencies, miss_latencies = [], []
+    recalled = false_positives = 0
+    lsh_found = exhaustive_found = 0
+    for _ in range(args.queries):
+        target = rng.randrange(len(prompts))
+        query = paraphrase(prompts[target], rng)
+        start = time.perf_counter()
+        matches = index.query(query, args.threshold, max_results=1)
+        hit_latencies.append(time.perf_counter() - start)
+        recalled += bool(matches) and matches[0][0] == f"ai_similarity:{target}"
+
+        # Recall of the LSH prefilter relative to scoring every row
+        if len(hit_latencies) <= args.exhaustive_queries:
+            reference = index.query(query, args.threshold, max_results=1, exhaustive=True)
+            exhaustive_found += bool(reference)
+            lsh_found += bool(reference) and bool(matches) and matches[0][0] == reference[0][0]
+
+        unrelated = f"Why does my {rng.choice(['printer', 'laptop', 'phone'])} battery drain overnight"
+        start = time.perf_counter()
+        false_positives += bool(index.query(unrelated, args.threshold, max_results=1))
+        miss_latencies.append(time.perf_counter() - start)
+
+    result = {
+        "benchmark": "similarity_index",
+        "prompts": len(prompts),
+        "queries": args.queries,
+        "threshold": args.threshold,
+        "build_seconds": round(build_seconds, 2),
+        "paraphrase_recall": round(recalled / args.queries, 4),
+        "false_positive_rate": round(false_positives / args.queries, 4),
+        "lsh_recall_vs_exhaustive": round(lsh_found / max(1, exhaustive_found), 4),
+        "hit_lookup": summarize(hit_latencies),
+        "miss_lookup": summarize(miss_latencies),
+        "index": index.get_stats(),
+    }
+    emit(result)
+
+
+if __name__ == "__main__":
+    main()
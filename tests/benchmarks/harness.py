@@ -0,0 +1,154 @@
+"""Shared helpers for the ai-backend benchmarks.
+
+Benchmarks run without external services: Redis is replaced by an in-process
+fakeredis TCP server, so results are comparable between machines and commits.
+"""
+
+import contextlib
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.join(os.path.dirname(__file__), '..', '..', 'ai-backend')
+
+
+def add_backend_to_path():
+    """Make the ai-backend modules importable, with a scratch user database."""
+    path = os.path.abspath(BACKEND_DIR)
+    if path not in sys.path:
+        sys.path.append(path)
+    os.environ.setdefault("USER_DB_PATH", os.path.join(tempfile.mkdtemp(prefix="bench-users-"), "users.db"))
+
+
+def free_port():
+    """Return a free localhost TCP port."""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+STANDIN_SCRIPT = """
+import sys
+from fakeredis import TcpFakeServer
+server = TcpFakeServer(("127.0.0.1", int(sys.argv[1])))
+print("ready", flush=True)
+server.serve_forever()
+"""
+
+
+@contextlib.contextmanager
+def redis_standin():
+    """Run a local Redis stand-in in a child process and yield its URL.
+
+    A separate process keeps the stand-in off the benchmark's GIL, so its
+    round trips behave like a real network hop.
+    """
+    try:
+        import fakeredis  # noqa: F401
+    except ImportError:
+        sys.exit("fakeredis is required for benchmarks: pip install 'fakeredis[lua]'")
+
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, "-c", STANDIN_SCRIPT, str(port)],
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    try:
+        process.stdout.readline()
+        wait_for_port(port)
+        yield f"redis://127.0.0.1:{port}/0"
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+
+
+@contextlib.contextmanager
+def mock_llm(latency=0.2, tokens_per_second=50.0, reply_tokens=64, error_rate=0.0, seed=0):
+    """Run ai-backend/mock_llm_server.py in a child process and yield its base URL."""
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(os.path.abspath(BACKEND_DIR), "mock_llm_server.py"),
+         "--port", str(port), "--latency", str(latency), "--tokens-per-second", str(tokens_per_second),
+         "--reply-tokens", str(reply_tokens), "--error-rate", str(error_rate), "--seed", str(seed)],
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        wait_for_port(port)
+        yield f"http://127.0.0.1:{port}/v1"
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+
+
+def wait_for_port(port, timeout=10.0):
+    """Block until something accepts connections on a localhost port."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+            if sock.connect_ex(("127.0.0.1", port)) == 0:
+                return
+        time.sleep(0.05)
+    raise RuntimeError(f"Nothing listening on port {port}")
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+
+def summarize(latencies):
+    """Latency summary in milliseconds."""
+    return {
+        "count": len(latencies),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+        "max_ms": round(max(latencies) * 1000, 3) if latencies else 0.0,
+    }
+
+
+def git_commit():
+    """Commit of the tree under test, marked when there are uncommitted changes."""
+    def git(*args):
+        return subprocess.run(["git", *args], cwd=BACKEND_DIR, capture_output=True, text=True).stdout.strip()
+
+    try:
+        commit = git("rev-parse", "HEAD")
+        dirty = git("status", "--porcelain", "--untracked-files=no")
+    except OSError:
+        return None
+    return f"{commit}-dirty" if commit and dirty else commit or None
+
+
+def environment():
+    """Where and on what a result was measured, so runs can be compared."""
+    return {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+    }
+
+
+def emit(result, output=None):
+    """Print a benchmark result as JSON, tagged with its environment.
+
+    With ``output`` the result is also written to that file.
+    """
+    result.setdefault("environment", environment())
+    text = json.dumps(result, indent=2, sort_keys=True)
+    print(text)
+    if output:
+        with open(output, "w") as f:
+            f.write(text + "\n")
@@ -0,0 +1,10 @@
+"""
+Shared test setup: the app gets an in-memory user store that tests can empty
+between cases, and any SQLite store stays out of the working tree
+"""
+
+import os
+import tempfile
+
+os.environ.setdefault("USER_STORE", "memory")
+os.environ.setdefault("USER_DB_PATH", os.path.join(tempfile.mkdtemp(prefix="ai-backend-tests-"), "users.db"))
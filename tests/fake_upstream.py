@@ -0,0 +1,103 @@
+"""
+Local fake of the OpenAI chat completions API for tests.
+
+Runs an aiohttp server on a background thread so the app under test talks to
+it over real HTTP through OpenAIConnectionPool.
+"""
+
+import asyncio
+import json
+import socket
+import threading
+
+from aiohttp import web
+
+
+class FakeUpstream:
+    """
+    Chat completions endpoint with scripted replies.
+
+    `latency`, `error_status` and `usage_tokens` may be callables taking the
+    0-based request index, to inject slow responses, failures or long
+    completions into particular requests.
+    """
+
+    def __init__(self, reply="Hello from the fake upstream", chunk_delay=0.0, latency=0.0, usage_tokens=42,
+                 error_status=None):
+        self.reply = reply
+        self.usage_tokens = usage_tokens
+        self.chunk_delay = chunk_delay
+        self.latency = latency
+        self.error_status = error_status
+        self.requests = []
+        self._loop = None
+        self._runner = None
+        self._thread = None
+        self.port = None
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.port}/v1"
+
+    async def _chat_completions(self, request):
+        body = await request.json()
+        index = len(self.requests)
+        self.requests.append(body)
+        latency = self.latency(index) if callable(self.latency) else self.latency
+        if latency:
+            await asyncio.sleep(latency)
+
+        status = self.error_status(index) if callable(self.error_status) else self.error_status
+        if status:
+            return web.json_response({"error": {"message": "Injected failure"}}, status=status)
+
+        if not body.get("stream"):
+            tokens = self.usage_tokens(index) if callable(self.usage_tokens) else self.usage_tokens
+            return web.json_response({
+                "object": "chat.completion",
+                "model": body["model"],
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": self.reply},
+                             "finish_reason": "stop"}],
+                "usage": {"completion_tokens": tokens, "total_tokens": tokens}
+            })
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        for word in self.reply.split(" "):
+            if self.chunk_delay:
+                await asyncio.sleep(self.chunk_delay)
+            token = word if word == self.reply.split(" ")[0] else " " + word
+            chunk = {"object": "chat.completion.chunk",
+                     "choices": [{"index": 0, "delta": {"content": token}}]}
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode())
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    def start(self):
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            self.port = sock.getsockname()[1]
+
+        started = threading.Event()
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            app = web.Application()
+            app.router.add_post("/v1/chat/completions", self._chat_completions)
+            self._runner = web.AppRunner(app)
+            self._loop.run_until_complete(self._runner.setup())
+            site = web.TCPSite(self._runner, "127.0.0.1", self.port)
+            self._loop.run_until_complete(site.start())
+            started.set()
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target=run, daemon=True)
+        self._thread.start()
+        started.wait(5)
+        return self
+
+    def stop(self):
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result(5)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(5)
@@ -0,0 +1,421 @@
+"""
+Tests for the AI generation endpoints: response caching and upstream calls
+"""
+
+import asyncio
+import json
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+from unittest.mock import patch, AsyncMock
+
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'ai-backend'))
+import cache as cache_module
+import connection_manager
+import deduplicator
+import main
+import scheduler
+from main import app, users_db
+from cache import AIResponseCache
+from connection_manager import UpstreamError
+from tests.fake_upstream import FakeUpstream
+
+fakeredis = pytest.importorskip("fakeredis")
+
+client = TestClient(app)
+
+
+def sse_events(body):
+    """(event, data) pairs from a server-sent event stream body"""
+    events = []
+    for frame in body.strip().split("\n\n"):
+        name, data = frame.split("\n")
+        events.append((name[len("event: "):], json.loads(data[len("data: "):])))
+    return events
+
+
+class AIEndpointTestCase:
+    """Registers a user and points the response cache at a Redis stand-in"""
+
+    def setup_method(self):
+        users_db.users.clear()
+        register_response = client.post("/auth/register", json={
+            "username": "aiuser",
+            "email": "ai@example.com",
+            "password": "testpassword123"
+        })
+        self.auth_headers = {"Authorization": f"Bearer {register_response.json()['access_token']}"}
+
+        self.cache = AIResponseCache()
+        self.cache.redis = fakeredis.FakeAsyncRedis(decode_responses=True)
+        cache_module._cache = self.cache
+
+        self.key_patch = patch.object(main.Config, "OPENAI_API_KEY", "sk-placeholder")
+        self.key_patch.start()
+
+    def teardown_method(self):
+        self.key_patch.stop()
+        cache_module._cache = None
+        users_db.users.clear()
+
+
+class TestResponseCache(AIEndpointTestCase):
+    """Test read-through caching of AI responses"""
+
+    def test_generate_second_request_is_cache_hit(self):
+        """Identical generate requests call upstream once"""
+        request_data = {"topic": "Docker Basics", "content_type": "guide"}
+
+        with patch("main.call_openai", new=AsyncMock(return_value="# Docker\n\nGuide body")) as upstream:
+            first = client.post("/api/generate", json=request_data, headers=self.auth_headers)
+            second = client.post("/api/generate", json=request_data, headers=self.auth_headers)
+
+        assert first.status_code == 200
+        assert first.headers["X-Cache"] == "MISS"
+        assert second.headers["X-Cache"] == "HIT"
+        assert second.json()["content"] == "# Docker\n\nGuide body"
+        assert upstream.await_count == 1
+
+    def test_chat_cache_key_includes_page_context(self):
+        """The same question on a different page is a cache miss"""
+        upstream = AsyncMock(side_effect=["Answer for ZFS", "Answer for Docker"])
+        zfs_page = {"page_title": "ZFS", "page_url": "/homelab/storage/", "headings": "Pools"}
+        docker_page = {"page_title": "Docker", "page_url": "/homelab/docker/", "headings": "Compose"}
+
+        with patch("main.call_openai", new=upstream):
+            first = client.post("/api/ai/chat", json={"message": "How do I start?", "context": zfs_page},
+                                headers=self.auth_headers)
+            repeat = client.post("/api/ai/chat", json={"message": "How do I start?", "context": zfs_page},
+                                 headers=self.auth_headers)
+            other = client.post("/api/ai/chat", json={"message": "How do I start?", "context": docker_page},
+                                headers=self.auth_headers)
+
+        assert [r.headers["X-Cache"] for r in (first, repeat, other)] == ["MISS", "HIT", "MISS"]
+        assert repeat.json()["response"] == "Answer for ZFS"
+        assert other.json()["response"] == "Answer for Docker"
+        assert upstream.await_count == 2
+
+    def test_cache_key_includes_generation_parameters(self):
+        """Different max_tokens or temperature never share an entry"""
+        base = self.cache._get_cache_key("prompt", "gpt-3.5-turbo", max_tokens=1000, temperature=0.7)
+        assert base != self.cache._get_cache_key("prompt", "gpt-3.5-turbo", max_tokens=2000, temperature=0.7)
+        assert base != self.cache._get_cache_key("prompt", "gpt-3.5-turbo", max_tokens=1000, temperature=0.2)
+        assert base != self.cache._get_cache_key("prompt", "gpt-4", max_tokens=1000, temperature=0.7)
+
+    def test_stats_report_hits_and_misses(self):
+        """Cache metrics are exposed through /api/ai/stats"""
+        with patch("main.call_openai", new=AsyncMock(return_value="Answer")):
+            for _ in range(3):
+                client.post("/api/ai/chat", json={"message": "What is RAID?"}, headers=self.auth_headers)
+
+        stats = client.get("/api/ai/stats", headers=self.auth_headers).json()["cache"]
+        assert stats["cache_hits"] == 2
+        assert stats["cache_misses"] == 1
+        assert stats["hit_rate"] == pytest.approx(2 / 3)
+
+
+class TestUpstreamConnectionPool(AIEndpointTestCase):
+    """Test that OpenAI calls go through the shared connection pool"""
+
+    def setup_method(self):
+        super().setup_method()
+        self.upstream = FakeUpstream(reply="# Guide\n\nStreamed markdown body").start()
+        self.base_patch = patch.object(main.Config, "OPENAI_API_BASE", self.upstream.base_url)
+        self.base_patch.start()
+        connection_manager._connection_pool = None
+        scheduler._scheduler = None
+
+    def teardown_method(self):
+        self.base_patch.stop()
+        self.upstream.stop()
+        connection_manager._connection_pool = None
+        scheduler._scheduler = None
+        super().teardown_method()
+
+    def test_generate_uses_connection_pool(self):
+        """Non-streaming generation is a pooled JSON request"""
+        with TestClient(app) as live_client:
+            response = live_client.post("/api/generate", json={"topic": "ZFS"}, headers=self.auth_headers)
+            stats = live_client.get("/api/ai/stats", headers=self.auth_headers).json()["connections"]
+
+        assert response.status_code == 200
+        assert response.json()["content"] == "# Guide\n\nStreamed markdown body"
+        assert self.upstream.requests[0]["max_tokens"] == 2000
+        assert self.upstream.requests[0]["stream"] is False
+        assert stats["requests_made"] == 1
+
+    def test_generate_stream_relays_tokens_and_fills_cache(self):
+        """stream=true relays SSE deltas as markdown and caches the full text"""
+        with TestClient(app) as live_client:
+            with live_client.stream("POST", "/api/generate", json={"topic": "ZFS", "stream": True},
+                                    headers=self.auth_headers) as streamed:
+                chunks = list(streamed.iter_text())
+                cache_header = streamed.headers["X-Cache"]
+            cached = live_client.post("/api/generate", json={"topic": "ZFS"}, headers=self.auth_headers)
+
+        assert cache_header == "MISS"
+        assert "".join(chunks) == "# Guide\n\nStreamed markdown body"
+        assert self.upstream.requests[0]["stream"] is True
+        assert cached.headers["X-Cache"] == "HIT"
+        assert cached.json()["content"] == "# Guide\n\nStreamed markdown body"
+        assert len(self.upstream.requests) == 1
+
+    def test_generate_stream_ends_with_error_note_on_upstream_failure(self):
+        """An upstream failure after the response has started ends the markdown with an error note"""
+        self.upstream.error_status = 502
+        with TestClient(app) as live_client:
+            with live_client.stream("POST", "/api/generate", json={"topic": "ZFS", "stream": True},
+                                    headers=self.auth_headers) as streamed:
+                status_code = streamed.status_code
+                body = "".join(streamed.iter_text())
+
+        assert status_code == 200
+        assert body.strip().startswith(main.GENERATE_STREAM_ERROR_MARKER)
+        assert body.rstrip().endswith("AI response failed. Please try again.")
+
+    def test_chat_stream_emits_token_and_done_events(self):
+        """The chat SSE endpoint relays tokens, then a done event; repeats are cached"""
+        def read_events(live_client):
+            with live_client.stream("POST", "/api/ai/chat/stream", json={"message": "What is ZFS?"},
+                                    headers=self.auth_headers) as streamed:
+                assert streamed.headers["content-type"].startswith("text/event-stream")
+                return sse_events("".join(streamed.iter_text()))
+
+        with TestClient(app) as live_client:
+            first = read_events(live_client)
+            second = read_events(live_client)
+
+        tokens = [data["content"] for name, data in first if name == "token"]
+        assert "".join(tokens) == "# Guide\n\nStreamed markdown body"
+        assert len(tokens) > 1
+        assert first[-1][0] == "done"
+        assert first[-1][1]["cached"] is False
+        assert first[-1][1]["user"] == "aiuser"
+
+        assert second[0] == ("token", {"content": "# Guide\n\nStreamed markdown body"})
+        assert second[-1][1]["cached"] is True
+        assert len(self.upstream.requests) == 1
+
+    def test_upstream_failure_is_not_retried(self):
+        """A 5xx reaches the client after one upstream call; the breaker decides when to try again"""
+        self.upstream.error_status = 502
+        with TestClient(app) as live_client:
+            response = live_client.post("/api/generate", json={"topic": "ZFS"}, headers=self.auth_headers)
+
+        assert response.status_code >= 500
+        assert len(self.upstream.requests) == 1
+
+    def test_upstream_calls_are_scheduled_by_priority(self):
+        """Chat runs as interactive and generate as bulk, with usage charged to the budget"""
+        with TestClient(app) as live_client:
+            live_client.post("/api/ai/chat", json={"message": "What is ZFS?"}, headers=self.auth_headers)
+            live_client.post("/api/generate", json={"topic": "ZFS"}, headers=self.auth_headers)
+            stats = live_client.get("/api/ai/stats", headers=self.auth_headers).json()["scheduler"]
+
+        interactive, bulk = stats["by_priority"]["interactive"], stats["by_priority"]["bulk"]
+        assert (interactive["requests"], bulk["requests"]) == (1, 1)
+        assert interactive["tokens_charged"] == self.upstream.usage_tokens
+        assert interactive["average_upstream_time"] > 0
+        assert stats["active"] == 0 and stats["queued"] == 0
+
+
+class TestRequestDeduplication(AIEndpointTestCase):
+    """Load test: concurrent identical requests share one upstream call"""
+
+    concurrency = 25
+
+    def setup_method(self):
+        super().setup_method()
+        # Slow enough that every request arrives while the first is in flight
+        self.upstream = FakeUpstream(reply="Shared answer", latency=0.3).start()
+        self.base_patch = patch.object(main.Config, "OPENAI_API_BASE", self.upstream.base_url)
+        self.base_patch.start()
+        connection_manager._connection_pool = None
+        deduplicator._deduplicator = None
+
+    def teardown_method(self):
+        self.base_patch.stop()
+        self.upstream.stop()
+        connection_manager._connection_pool = None
+        deduplicator._deduplicator = None
+        super().teardown_method()
+
+    def fire(self, requests):
+        """Send (path, body) pairs concurrently and return the responses and dedup stats"""
+        async def run():
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as live_client:
+                responses = await asyncio.gather(*(
+                    live_client.post(path, json=body, headers=self.auth_headers) for path, body in requests
+                ))
+            stats = (await deduplicator.get_deduplicator()).get_stats()
+            await main.shutdown_event()
+            return responses, stats
+        return asyncio.run(run())
+
+    def test_concurrent_identical_chat_requests_call_upstream_once(self):
+        """N simultaneous identical questions produce exactly one upstream call"""
+        body = {"message": "How do I create a ZFS pool?", "context": {"page_title": "ZFS"}}
+        responses, stats = self.fire([("/api/ai/chat", body)] * self.concurrency)
+
+        assert [r.status_code for r in responses] == [200] * self.concurrency
+        assert {r.json()["response"] for r in responses} == {"Shared answer"}
+        assert len(self.upstream.requests) == 1
+        assert stats["unique_requests"] == 1
+        assert stats["total_duplicates_prevented"] == self.concurrency - 1
+
+    def test_concurrent_identical_generate_requests_call_upstream_once(self):
+        """Generate requests are single-flighted the same way"""
+        responses, _ = self.fire([("/api/generate", {"topic": "Proxmox"})] * self.concurrency)
+
+        assert [r.status_code for r in responses] == [200] * self.concurrency
+        assert len(self.upstream.requests) == 1
+
+    def test_concurrent_identical_chat_streams_call_upstream_once(self):
+        """Streamed chat misses share one upstream stream; followers get the finished answer"""
+        body = {"message": "How do I mount NFS?", "context": {"page_title": "Storage"}}
+        responses, stats = self.fire([("/api/ai/chat/stream", body)] * self.concurrency)
+
+        assert [r.status_code for r in responses] == [200] * self.concurrency
+        for r in responses:
+            events = sse_events(r.text)
+            assert "".join(data["content"] for name, data in events if name == "token") == "Shared answer"
+            assert events[-1][0] == "done"
+        assert len(self.upstream.requests) == 1
+        assert self.upstream.requests[0]["stream"] is True
+        assert stats["total_duplicates_prevented"] == self.concurrency - 1
+
+    def test_concurrent_identical_generate_streams_call_upstream_once(self):
+        """Streamed generation is single-flighted and the result is cached"""
+        body = {"topic": "Proxmox", "stream": True}
+        responses, _ = self.fire([("/api/generate", body)] * self.concurrency)
+
+        assert [r.status_code for r in responses] == [200] * self.concurrency
+        assert {r.text for r in responses} == {"Shared answer"}
+        assert len(self.upstream.requests) == 1
+
+    def test_prompt_normalization_and_parameters(self):
+        """Whitespace and case variants share a flight; different pages do not"""
+        requests = [
+            ("/api/ai/chat", {"message": "What is RAID?", "context": {"page_title": "Storage"}}),
+            ("/api/ai/chat", {"message": "  what is   RAID? ", "context": {"page_title": "Storage"}}),
+            ("/api/ai/chat", {"message": "What is RAID?", "context": {"page_title": "Backups"}}),
+        ]
+        responses, stats = self.fire(requests)
+
+        assert [r.status_code for r in responses] == [200] * 3
+        assert len(self.upstream.requests) == 2
+        assert stats["total_duplicates_prevented"] == 1
+
+    def test_upstream_failure_is_shared_not_retried(self):
+        """Waiters receive the leader's error instead of stampeding upstream"""
+        upstream = AsyncMock(side_effect=UpstreamError(502, "bad gateway"))
+
+        async def slow_failure(*args, **kwargs):
+            await asyncio.sleep(0.1)
+            return await upstream(*args, **kwargs)
+
+        with patch("main.call_openai", new=slow_failure):
+            responses, stats = self.fire([("/api/ai/chat", {"message": "Why?"})] * 5)
+
+        assert [r.status_code for r in responses] == [500] * 5
+        assert upstream.await_count == 1
+        assert stats["failed_requests"] == 1
+
+
+class TestStaleWhileRevalidate(AIEndpointTestCase):
+    """Stale answers are served at once while one background refresh runs"""
+
+    concurrency = 10
+
+    def setup_method(self):
+        super().setup_method()
+        self.cache.grace_period = 600
+        self.upstream = FakeUpstream(reply="Fresh answer", latency=0.3).start()
+        self.base_patch = patch.object(main.Config, "OPENAI_API_BASE", self.upstream.base_url)
+        self.base_patch.start()
+        connection_manager._connection_pool = None
+        deduplicator._deduplicator = None
+
+    def teardown_method(self):
+        self.base_patch.stop()
+        self.upstream.stop()
+        connection_manager._connection_pool = None
+        deduplicator._deduplicator = None
+        super().teardown_method()
+
+    async def seed_stale(self, message, answer, context=None):
+        """Cache an answer whose soft TTL has already passed"""
+        params = {
+            "max_tokens": main.CHAT_MAX_TOKENS,
+            "temperature": main.AI_TEMPERATURE,
+            "context": main.chat_page_context(context)
+        }
+        await self.cache.set(message, answer, main.AI_MODEL, **params)
+        await self.cache.redis.expire(self.cache._get_cache_key(message, main.AI_MODEL, **params), 60)
+        self.cache.local_tier.clear()
+
+    def test_concurrent_stale_hits_refresh_once(self):
+        """Every caller gets the stale answer immediately; upstream is called once"""
+        body = {"message": "How do I create a ZFS pool?", "context": {"page_title": "ZFS"}}
+
+        async def run():
+            await self.seed_stale(body["message"], "Old answer", body["context"])
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as live_client:
+                stale = await asyncio.gather(*(
+                    live_client.post("/api/ai/chat", json=body, headers=self.auth_headers)
+                    for _ in range(self.concurrency)
+                ))
+                refreshed = await live_client.post("/api/ai/chat", json=body, headers=self.auth_headers)
+            await main.shutdown_event()
+            return stale, refreshed
+
+        stale, refreshed = asyncio.run(run())
+
+        assert [r.status_code for r in stale] == [200] * self.concurrency
+        assert {r.headers["X-Cache"] for r in stale} == {"STALE"}
+        assert {r.json()["response"] for r in stale} == {"Old answer"}
+        assert len(self.upstream.requests) == 1
+        assert refreshed.headers["X-Cache"] == "HIT"
+        assert refreshed.json()["response"] == "Fresh answer"
+
+    def test_stale_chat_stream_is_served_and_refreshed(self):
+        """The SSE endpoint serves a stale answer and refreshes it in the background"""
+        body = {"message": "What is ZFS?"}
+
+        async def run():
+            await self.seed_stale(body["message"], "Old answer")
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as live_client:
+                stale = await live_client.post("/api/ai/chat/stream", json=body, headers=self.auth_headers)
+                refreshed = await live_client.post("/api/ai/chat/stream", json=body, headers=self.auth_headers)
+            await main.shutdown_event()
+            return stale, refreshed
+
+        stale, refreshed = asyncio.run(run())
+
+        assert stale.headers["X-Cache"] == "STALE"
+        assert sse_events(stale.text)[0] == ("token", {"content": "Old answer"})
+        assert len(self.upstream.requests) == 1
+        assert refreshed.headers["X-Cache"] == "HIT"
+        assert sse_events(refreshed.text)[0] == ("token", {"content": "Fresh answer"})
+
+    def test_failed_refresh_keeps_serving_stale_answer(self):
+        """An upstream error during refresh leaves the stale entry in place"""
+        async def run():
+            await self.seed_stale("Why?", "Old answer")
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as live_client:
+                with patch("main.call_openai", new=AsyncMock(side_effect=UpstreamError(502, "bad gateway"))):
+                    first = await live_client.post("/api/ai/chat", json={"message": "Why?"}, headers=self.auth_headers)
+                    second = await live_client.post("/api/ai/chat", json={"message": "Why?"}, headers=self.auth_headers)
+            await main.shutdown_event()
+            return first, second
+
+        first, second = asyncio.run(run())
+        assert [r.status_code for r in (first, second)] == [200, 200]
+        assert [r.json()["response"] for r in (first, second)] == ["Old answer", "Old answer"]
+        assert second.headers["X-Cache"] == "STALE"
@@ -0,0 +1,400 @@
+"""
+Tests for the AI response cache indexes
+"""
+
+import asyncio
+import json
+import time
+import pytest
+from unittest.mock import patch
+
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'ai-backend'))
+from cache import AIResponseCache, ENTRY_MAGIC, FLAG_ZLIB, decode_entry, encode_entry
+from deduplicator import RequestDeduplicator
+from similarity_index import SimilarityIndex
+
+fakeredis = pytest.importorskip("fakeredis")
+
+
+class TestCacheIndex:
+    """Test that cache bookkeeping uses index structures instead of KEYS"""
+
+    def setup_method(self):
+        self.cache = AIResponseCache()
+        self.cache.redis = fakeredis.FakeAsyncRedis(decode_responses=True)
+        # KEYS blocks the server; any use of it is a regression
+        self.cache.redis.keys = self.fail_on_keys
+
+    async def fail_on_keys(self, *args, **kwargs):
+        raise AssertionError("KEYS must not be used")
+
+    def run(self, coro):
+        return asyncio.run(coro)
+
+    def test_stats_count_entries_per_model(self):
+        """Entry counts come from the per-model indexes"""
+        async def scenario():
+            await self.cache.set("What is ZFS?", "A filesystem", "gpt-3.5-turbo")
+            await self.cache.set("What is LVM?", "A volume manager", "gpt-3.5-turbo")
+            await self.cache.set("What is RAID?", "Redundancy", "gpt-4")
+            return await self.cache.get_stats()
+
+        stats = self.run(scenario())
+        assert stats['cached_responses'] == 3
+        assert stats['cached_similarities'] == 3
+        assert stats['total_cached_items'] == 6
+        assert stats['cached_responses_by_model'] == {"gpt-3.5-turbo": 2, "gpt-4": 1}
+
+    def test_expired_entries_leave_the_index(self):
+        """Counts only include live entries, and writes trim expired members"""
+        async def scenario():
+            await self.cache.set("short lived", "gone soon", ttl=1)
+            later = time.time() + self.cache.grace_period + 5
+            with patch("cache.time.time", return_value=later):
+                stats = await self.cache.get_stats()
+                await self.cache.set("fresh", "still here")
+            members = await self.cache.redis.zcard(self.cache._response_index("gpt-3.5-turbo"))
+            return stats, members
+
+        stats, members = self.run(scenario())
+        assert stats['cached_responses'] == 0
+        assert members == 1
+
+    def test_get_similar_reads_model_index(self):
+        """Similarity search finds entries for the model without scanning the keyspace"""
+        self.cache.similarity_threshold = 0.5
+
+        async def scenario():
+            await self.cache.set("how to create a zfs pool", "zpool create ...", "gpt-3.5-turbo")
+            await self.cache.set("how to create a zfs pool", "other model", "gpt-4")
+            return await self.cache.get_similar("how do I create a zfs pool", "gpt-3.5-turbo")
+
+        results = self.run(scenario())
+        assert [r['response'] for r in results] == ["zpool create ..."]
+
+    def test_invalidate_removes_index_entries(self):
+        """Invalidated entries are no longer counted"""
+        async def scenario():
+            await self.cache.set("What is ZFS?", "A filesystem", max_tokens=1000)
+            await self.cache.invalidate("What is ZFS?", max_tokens=1000)
+            return await self.cache.get_stats()
+
+        stats = self.run(scenario())
+        assert stats['total_cached_items'] == 0
+
+    def test_clear_all_removes_indexed_and_unindexed_entries(self):
+        """clear_all empties the indexes and sweeps legacy keys with SCAN"""
+        async def scenario():
+            for i in range(3):
+                await self.cache.set(f"question {i}", f"answer {i}")
+            await self.cache.redis.set("ai_response:legacy", json.dumps("old"), ex=60)
+            await self.cache.redis.set("unrelated", "keep me")
+            await self.cache.clear_all()
+            return await self.cache.redis.scan(0, count=1000)
+
+        _, remaining = self.run(scenario())
+        assert remaining == ["unrelated"]
+
+    def test_cache_and_dedup_keys_normalize_alike(self):
+        """Prompts differing only in case and whitespace share both the cache and the dedup key"""
+        async def dedup_keys(prompts):
+            deduplicator = RequestDeduplicator()
+            keys = {deduplicator._get_request_key(p, "gpt-4") for p in prompts}
+            await deduplicator.shutdown()
+            return keys
+
+        prompts = ["What is  ZFS?", "what is\nzfs?", "  WHAT IS ZFS?\t"]
+        assert len({self.cache._get_cache_key(p, "gpt-4") for p in prompts}) == 1
+        assert len({self.cache._get_similarity_key(p, "gpt-4") for p in prompts}) == 1
+        assert len(self.run(dedup_keys(prompts))) == 1
+
+    def test_rebuild_index_from_scan(self):
+        """Entries written without an index are picked up by a rebuild"""
+        async def scenario():
+            redis_conn = self.cache.redis
+            await redis_conn.set("ai_response:legacy", json.dumps("old answer"), ex=60)
+            await redis_conn.set("ai_similarity:legacy", json.dumps(
+                {"prompt": "old", "response": "old answer", "model": "gpt-4"}), ex=120)
+            await redis_conn.set("ai_response:persistent", json.dumps("no ttl"))
+            indexed = await self.cache.rebuild_index()
+            return indexed, await self.cache.get_stats()
+
+        indexed, stats = self.run(scenario())
+        assert indexed == 2
+        assert stats['cached_responses_by_model'] == {"gpt-3.5-turbo": 1, "gpt-4": 0}
+        assert stats['cached_similarities'] == 1
+
+
+class TestSimilarityIndex:
+    """Test near-duplicate lookups through the local similarity index"""
+
+    def setup_method(self):
+        self.index = SimilarityIndex(max_entries=64)
+
+    def test_paraphrase_matches_and_unrelated_does_not(self):
+        """Reworded prompts match; different questions do not"""
+        self.index.add("zfs", "How do I create a ZFS pool with two mirrored disks?", float("inf"))
+        self.index.add("docker", "How do I expose a Docker container port to my LAN?", float("inf"))
+
+        matches = self.index.query("how do i create a zfs pool with 2 mirrored disks", 0.7)
+        assert [key for key, _ in matches] == ["zfs"]
+        assert self.index.query("What is the best UPS for a rack?", 0.7) == []
+
+    def test_prefilter_agrees_with_exhaustive_scoring(self):
+        """The LSH prefilter finds the same best match as scoring every row"""
+        for i in range(50):
+            self.index.add(f"q{i}", f"How do I configure service number {i} behind nginx", float("inf"))
+        query = "how do I configure service number 17 behind nginx please"
+        assert self.index.query(query, 0.8, 1) == self.index.query(query, 0.8, 1, exhaustive=True)
+
+    def test_expired_entries_are_not_returned(self):
+        """Entries past their expiry are dropped at lookup"""
+        self.index.add("old", "How do I renew a certbot certificate?", expires_at=100.0)
+        assert self.index.query("How do I renew a certbot certificate?", 0.9, now=50.0)
+        assert self.index.query("How do I renew a certbot certificate?", 0.9, now=150.0) == []
+        assert len(self.index) == 0
+
+    def test_full_index_evicts_soonest_expiring_entry(self):
+        """max_entries bounds memory by evicting the entry closest to expiry"""
+        for i in range(64):
+            self.index.add(f"q{i}", f"question {i} about vlan trunk {i}", expires_at=1000.0 + i)
+        self.index.add("new", "a brand new question about wireguard", expires_at=5000.0)
+
+        assert len(self.index) == 64
+        assert "q0" not in self.index and "new" in self.index
+        assert self.index.get_stats()['evictions'] == 1
+
+    def test_remove_unlinks_buckets(self):
+        """Removed keys never come back from a lookup, and their rows are reused"""
+        self.index.add("a", "How do I back up Proxmox VMs?", float("inf"))
+        self.index.remove("a")
+        assert self.index.query("How do I back up Proxmox VMs?", 0.5) == []
+        self.index.add("b", "How do I back up Proxmox VMs?", float("inf"))
+        assert [key for key, _ in self.index.query("How do I back up Proxmox VMs?", 0.5)] == ["b"]
+
+    def test_other_workers_entries_are_synced(self):
+        """A cache instance picks up similarity entries written by another worker"""
+        redis_conn = fakeredis.FakeAsyncRedis(decode_responses=True)
+        writer, reader = AIResponseCache(), AIResponseCache()
+        writer.redis = reader.redis = redis_conn
+
+        async def scenario():
+            await writer.set("How do I harden SSH on Debian?", "Disable password auth")
+            return await reader.get_similar("how do I harden ssh on debian")
+
+        results = asyncio.run(scenario())
+        assert [r['response'] for r in results] == ["Disable password auth"]
+        assert results[0]['similarity'] >= reader.similarity_threshold
+
+
+    def test_shorter_ttl_entries_written_later_are_synced(self):
+        """Syncing follows write order, so a short-lived entry after a long-lived one is not skipped"""
+        redis_conn = fakeredis.FakeAsyncRedis(decode_responses=True)
+        writer, reader = AIResponseCache(), AIResponseCache()
+        writer.redis = reader.redis = redis_conn
+        reader.similarity_sync_interval = 0
+
+        async def scenario():
+            await reader.get_similar("anything")
+            await writer.set("How do I rotate Grafana API keys?", "Use service accounts", ttl=86400)
+            await reader.get_similar("anything")
+            await writer.set("How do I renew a Traefik certificate?", "Restart with ACME staging off", ttl=60)
+            return await reader.get_similar("how do I renew a traefik certificate")
+
+        results = asyncio.run(scenario())
+        assert [r['response'] for r in results] == ["Restart with ACME staging off"]
+        assert len(reader._similarity_index_for("gpt-3.5-turbo")) == 2
+
+
+class TestLocalCacheTier:
+    """Test the in-process tier in front of Redis"""
+
+    def setup_method(self):
+        self.server = fakeredis.FakeServer()
+        self.cache = self.make_cache()
+
+    def make_cache(self):
+        cache = AIResponseCache()
+        cache.redis = fakeredis.FakeAsyncRedis(server=self.server, decode_responses=True)
+        return cache
+
+    def count_pipelines(self, cache):
+        """Count Redis round trips made through pipelines"""
+        calls = []
+        original = cache.redis.pipeline
+
+        def counting(*args, **kwargs):
+            calls.append(1)
+            return original(*args, **kwargs)
+        cache.redis.pipeline = counting
+        return calls
+
+    def test_hot_hits_skip_redis(self):
+        """Entries written by this worker are served from memory"""
+        async def scenario():
+            await self.cache.set("What is ZFS?", "A filesystem")
+            round_trips = self.count_pipelines(self.cache)
+            results = [await self.cache.get("What is ZFS?") for _ in range(100)]
+            return results, round_trips
+
+        results, round_trips = asyncio.run(scenario())
+        assert results == ["A filesystem"] * 100
+        assert round_trips == []
+        assert self.cache.local_tier.get_stats()['hits'] == 100
+
+    def test_fill_ttl_follows_redis(self):
+        """Entries read from Redis expire locally when the Redis key does"""
+        async def scenario():
+            key = self.cache._get_cache_key("What is LVM?")
+            await self.cache.redis.set(key, json.dumps("Volumes"), px=2000)
+            return key, await self.cache.get("What is LVM?")
+
+        key, result = asyncio.run(scenario())
+        assert result == "Volumes"
+        expires_at = self.cache.local_tier.entries[key][1]
+        assert 1.0 < expires_at - time.time() <= 2.0
+        assert self.cache.local_tier.get(key, now=time.time() + 3) is None
+
+    def test_concurrent_misses_share_one_fill(self):
+        """Simultaneous lookups of a cold key make a single Redis read"""
+        async def scenario():
+            writer = self.make_cache()
+            await writer.set("What is Ceph?", "Distributed storage")
+            round_trips = self.count_pipelines(self.cache)
+            results = await asyncio.gather(*(self.cache.get("What is Ceph?") for _ in range(20)))
+            return results, round_trips
+
+        results, round_trips = asyncio.run(scenario())
+        assert results == ["Distributed storage"] * 20
+        assert len(round_trips) == 1
+        assert self.cache._stats['coalesced_fills'] == 19
+
+    def test_lru_is_bounded_by_bytes(self):
+        """The least recently used entries are evicted past max_bytes"""
+        from cache import LocalCacheTier
+        tier = LocalCacheTier(max_bytes=1000)
+        for i in range(10):
+            tier.put(f"key{i}", "x" * 150, ttl=60)
+            tier.get("key0")  # keep key0 hot
+
+        assert tier.bytes <= 1000
+        assert "key0" in tier.entries and "key1" not in tier.entries
+        assert tier.get_stats()['evictions'] > 0
+
+    def test_peer_invalidation_drops_local_copy(self):
+        """A change on one worker evicts the entry from another worker's tier"""
+        async def scenario():
+            reader = self.make_cache()
+            await reader.start_invalidation_listener()
+            await self.cache.set("What is NFS?", "Network file system")
+            assert await reader.get("What is NFS?") == "Network file system"
+
+            await self.cache.invalidate("What is NFS?")
+            for _ in range(50):
+                if not reader.local_tier.entries:
+                    break
+                await asyncio.sleep(0.02)
+            result = await reader.get("What is NFS?")
+            await reader.close()
+            return result, reader.local_tier.get_stats()
+
+        result, stats = asyncio.run(scenario())
+        assert result is None
+        assert stats['invalidations'] == 1
+
+
+class TestEntryFormat:
+    """Test the versioned binary entry format"""
+
+    def test_round_trip_text_and_json(self):
+        """Text and structured values survive encoding, compressed or not"""
+        markdown = "# Guide\n\n" + "Use `zpool status` to check pool health.\n" * 100
+        for value in ("short answer", markdown, {"prompt": "What?", "model": "gpt-4"}):
+            assert decode_entry(encode_entry(value)) == value
+
+    def test_large_bodies_are_compressed(self):
+        """Bodies above the threshold are zlib-compressed when that helps"""
+        markdown = "## Step\n\nRun `docker compose up -d` and check the logs.\n" * 80
+        encoded = encode_entry(markdown)
+        assert encoded[:2] == ENTRY_MAGIC
+        assert encoded[3] & FLAG_ZLIB
+        assert len(encoded) < len(json.dumps(markdown)) / 4
+        assert not encode_entry("tiny")[3] & FLAG_ZLIB
+
+    def test_legacy_json_entries_decode(self):
+        """Entries written as JSON text before versioning are still readable"""
+        assert decode_entry(json.dumps("old answer").encode()) == "old answer"
+        assert decode_entry(b'{"prompt": "old", "response": "old answer"}')["response"] == "old answer"
+
+    def test_unknown_version_is_rejected(self):
+        """A newer writer's format is not misread"""
+        with pytest.raises(ValueError):
+            decode_entry(ENTRY_MAGIC + bytes([99, 0]) + b"body")
+
+    def test_response_is_stored_once(self):
+        """The similarity entry references the response instead of copying it"""
+        cache = AIResponseCache()
+        cache.redis = fakeredis.FakeAsyncRedis(decode_responses=True)
+        cache.similarity_threshold = 0.6
+        response = "## Mirrors\n\n" + "Create the pool with `zpool create tank mirror sda sdb`.\n" * 50
+
+        async def scenario():
+            await cache.set("How do I create a mirrored ZFS pool?", response)
+            similarity_raw = await cache._get_raw(cache._get_similarity_key("How do I create a mirrored ZFS pool?"))
+            similar = await cache.get_similar("how do i create a mirrored zfs pool")
+            return similarity_raw, similar
+
+        similarity_raw, similar = asyncio.run(scenario())
+        assert b"zpool create" not in similarity_raw
+        assert decode_entry(similarity_raw)["response_key"] == cache._get_cache_key("How do I create a mirrored ZFS pool?")
+        assert similar[0]["response"] == response
+
+
+class TestSoftTTL:
+    """Test stale-while-revalidate expiry semantics"""
+
+    def setup_method(self):
+        self.cache = AIResponseCache()
+        self.cache.redis = fakeredis.FakeAsyncRedis(decode_responses=True)
+        self.cache.grace_period = 600
+
+    def test_keys_outlive_ttl_by_grace_period(self):
+        """Redis keeps entries for the soft TTL plus the grace period"""
+        async def scenario():
+            await self.cache.set("What is ZFS?", "A filesystem", ttl=60)
+            return await self.cache.redis.ttl(self.cache._get_cache_key("What is ZFS?"))
+
+        assert 655 <= asyncio.run(scenario()) <= 660
+
+    def test_entries_past_ttl_are_served_as_stale(self):
+        """Within the grace period an entry is still returned, flagged stale"""
+        async def scenario():
+            await self.cache.set("What is ZFS?", "A filesystem", ttl=60)
+            fresh = await self.cache.get_entry("What is ZFS?")
+            # Past the soft TTL: less than the grace period remains
+            await self.cache.redis.expire(self.cache._get_cache_key("What is ZFS?"), 300)
+            self.cache.local_tier.clear()
+            stale = await self.cache.get_entry("What is ZFS?")
+            stale_again = await self.cache.get_entry("What is ZFS?")
+            return fresh, stale, stale_again, await self.cache.get("What is ZFS?")
+
+        fresh, stale, stale_again, value = asyncio.run(scenario())
+        assert fresh == ("A filesystem", False)
+        assert stale == ("A filesystem", True)
+        # The local tier keeps the hard expiry, so it agrees with Redis
+        assert stale_again == ("A filesystem", True)
+        assert value == "A filesystem"
+        assert self.cache._stats['stale_hits'] == 3
+
+    def test_hard_expiry_after_grace_period(self):
+        """Once the grace period is over the entry is a miss"""
+        async def scenario():
+            self.cache.local_tier = None
+            await self.cache.set("What is LVM?", "Volumes", ttl=60)
+            await self.cache.redis.pexpire(self.cache._get_cache_key("What is LVM?"), 50)
+            await asyncio.sleep(0.1)
+            return await self.cache.get_entry("What is LVM?")
+
+        assert asyncio.run(scenario()) is None
@@ -0,0 +1,176 @@
+"""
+Tests for the docs-driven response cache warmer
+"""
+
+import asyncio
+import re
+from pathlib import Path
+import pytest
+from fastapi.testclient import TestClient
+from unittest.mock import patch
+
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'ai-backend'))
+import cache as cache_module
+import connection_manager
+import deduplicator
+import main
+from main import app, users_db
+from cache import AIResponseCache
+from cache_warmer import WARM_QUESTIONS, CacheWarmer, js_substring, load_docs_pages, render_page
+from tests.fake_upstream import FakeUpstream
+
+fakeredis = pytest.importorskip("fakeredis")
+
+REPO_ROOT = os.path.join(os.path.dirname(__file__), '..')
+
+PAGE = """---
+title: ZFS Storage
+---
+
+# ZFS Storage Guide
+
+## 💾 Creating a `zpool` { #create }
+
+```bash
+# Not a heading
+zpool create tank mirror sda sdb
+```
+
+### [Snapshots](snapshots.md) and **replication**
+"""
+
+
+class TestDocsPages:
+    """Test that page contexts match what getWindowContext() sends"""
+
+    def test_render_page_matches_widget_context(self):
+        """Title, URL and headings follow MkDocs Material's rendering"""
+        page = render_page("homelab/storage/zfs.md", PAGE, "Homelab Docs", nav_title="ZFS")
+
+        assert page.title == "ZFS Storage - Homelab Docs"
+        assert page.url == "/homelab/storage/zfs/"
+        assert page.headings == "ZFS Storage Guide¶\n💾 Creating a zpool¶\nSnapshots and replication¶"
+
+    def test_page_without_h1_gets_title_heading(self):
+        """Material inserts an H1 with the page title when the page has none"""
+        page = render_page("guides/index.md", "## First steps\n", "Homelab Docs", nav_title=None)
+
+        assert page.title == "Guides - Homelab Docs"
+        assert page.url == "/guides/"
+        assert page.headings == "Guides\nFirst steps¶"
+
+    def test_headings_truncated_like_javascript(self):
+        """substring() counts UTF-16 code units, so astral emoji count twice"""
+        assert js_substring("💾" * 300, 500) == "💾" * 250
+        page = render_page("long.md", "\n".join(f"## Section {i}" for i in range(100)), "Docs")
+        assert len(page.headings) == 500
+
+    def test_docs_corpus_loads(self):
+        """Every page in docs/ gets a context"""
+        pages = load_docs_pages(Path(REPO_ROOT) / "docs", Path(REPO_ROOT) / "mkdocs.yml")
+
+        assert len(pages) >= 40
+        home = next(page for page in pages if page.path == "index.md")
+        assert home.url == "/"
+        assert all(page.headings for page in pages)
+
+    def test_questions_match_widget_suggestions(self):
+        """Only questions the widget offers verbatim can be served from the warm cache"""
+        with open(os.path.join(REPO_ROOT, "docs", "javascripts", "ai-assistant.js")) as f:
+            script = f.read()
+        block = re.search(r"SUGGESTED_QUESTIONS = \[(.*?)\];", script, re.DOTALL).group(1)
+
+        assert tuple(re.findall(r"'([^']*)'", block)) == WARM_QUESTIONS
+
+
+class TestCacheWarmer:
+    """Test warming against a local stub model"""
+
+    def setup_method(self):
+        users_db.users.clear()
+        self.client = TestClient(app)
+        register_response = self.client.post("/auth/register", json={
+            "username": "warmuser",
+            "email": "warm@example.com",
+            "password": "testpassword123"
+        })
+        self.auth_headers = {"Authorization": f"Bearer {register_response.json()['access_token']}"}
+
+        self.cache = AIResponseCache()
+        self.cache.redis = fakeredis.FakeAsyncRedis(decode_responses=True)
+        cache_module._cache = self.cache
+        connection_manager._connection_pool = None
+        deduplicator._deduplicator = None
+
+        self.upstream = FakeUpstream(reply="Warm answer", latency=0.05).start()
+        self.patches = [
+            patch.object(main.Config, "OPENAI_API_KEY", "sk-placeholder"),
+            patch.object(main.Config, "OPENAI_API_BASE", self.upstream.base_url),
+        ]
+        for p in self.patches:
+            p.start()
+
+        self.pages = [
+            render_page("homelab/storage/zfs.md", PAGE, "Homelab Docs"),
+            render_page("guides/index.md", "# Guides\n\n## First steps\n", "Homelab Docs"),
+        ]
+
+    def teardown_method(self):
+        for p in self.patches:
+            p.stop()
+        self.upstream.stop()
+        cache_module._cache = None
+        connection_manager._connection_pool = None
+        deduplicator._deduplicator = None
+        users_db.users.clear()
+
+    def test_warmed_answers_are_chat_cache_hits(self):
+        """A first visit asking a suggested question is answered from the cache"""
+        async def warm():
+            stats = await CacheWarmer(concurrency=2).warm(self.pages)
+            await connection_manager.close_connection_pool()
+            return stats
+
+        stats = asyncio.run(warm())
+        assert stats["warmed"] == len(self.pages) * len(WARM_QUESTIONS)
+        assert len(self.upstream.requests) == stats["warmed"]
+
+        # The widget also sends a timestamp, which is not part of the key
+        context = {**self.pages[0].context, "timestamp": "2024-01-01T00:00:00Z"}
+        response = self.client.post("/api/ai/chat", json={"message": WARM_QUESTIONS[0], "context": context},
+                                    headers=self.auth_headers)
+        assert response.headers["X-Cache"] == "HIT"
+        assert response.json()["response"] == "Warm answer"
+        assert len(self.upstream.requests) == stats["warmed"]
+
+    def test_fresh_entries_are_skipped(self):
+        """Re-running the warmer does not call upstream for cached answers"""
+        async def warm_twice():
+            first = await CacheWarmer().warm(self.pages)
+            second = await CacheWarmer().warm(self.pages)
+            await connection_manager.close_connection_pool()
+            return first, second
+
+        first, second = asyncio.run(warm_twice())
+        assert second["skipped"] == first["warmed"]
+        assert second["warmed"] == 0
+
+    def test_concurrency_is_bounded(self):
+        """No more than `concurrency` generations run at once"""
+        in_flight, peak = 0, 0
+
+        async def stub_model(messages, max_tokens, **kwargs):
+            nonlocal in_flight, peak
+            in_flight += 1
+            peak = max(peak, in_flight)
+            await asyncio.sleep(0.02)
+            in_flight -= 1
+            return "Stub answer"
+
+        with patch("main.call_openai", new=stub_model):
+            stats = asyncio.run(CacheWarmer(concurrency=2).warm(self.pages * 3))
+
+        assert peak == 2
+        assert stats["failed"] == 0
@@ -0,0 +1,461 @@
+"""
+Tests for the upstream connection pool's adaptive concurrency limit, circuit breaker and hedging
+"""
+
+import asyncio
+import time
+import httpx
+import pytest
+from unittest.mock import patch
+
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'ai-backend'))
+import cache as cache_module
+import connection_manager
+import deduplicator
+import main
+import scheduler
+from main import app, users_db
+from cache import AIResponseCache
+from connection_manager import (AdaptiveConcurrencyLimiter, CircuitBreaker, OpenAIConnectionPool,
+                                UpstreamOverloadedError)
+from tests.fake_upstream import FakeUpstream
+
+fakeredis = pytest.importorskip("fakeredis")
+
+BODY = {"model": "gpt-3.5-turbo", "messages": []}
+
+
+class TestAdaptiveConcurrencyLimiter:
+    """Test the AIMD limit"""
+
+    def test_requests_over_the_limit_are_shed(self):
+        """try_acquire fails immediately once the limit is in use"""
+        limiter = AdaptiveConcurrencyLimiter(initial_limit=2, max_limit=2)
+
+        assert [limiter.try_acquire() for _ in range(3)] == [True, True, False]
+        limiter.release(0.1, 200)
+        assert limiter.try_acquire()
+        assert limiter.get_stats()["shed"] == 1
+
+    def test_overload_status_shrinks_the_limit(self):
+        """429s and 503s back the limit off multiplicatively"""
+        limiter = AdaptiveConcurrencyLimiter(initial_limit=10, max_limit=10, backoff=0.5)
+
+        limiter.try_acquire()
+        limiter.release(0.1, 429)
+        assert limiter.get_stats()["limit"] == 5
+
+    def test_latency_above_tolerance_shrinks_the_limit(self):
+        """A response much slower than the baseline is treated as queueing upstream"""
+        limiter = AdaptiveConcurrencyLimiter(initial_limit=10, max_limit=10, latency_tolerance=2.0, backoff=0.5)
+
+        limiter.try_acquire()
+        limiter.release(0.01, 200)
+        limiter.try_acquire()
+        limiter.release(0.05, 200)
+        assert limiter.get_stats()["limit"] == 5
+
+    def test_one_decrease_per_round_trip(self):
+        """A burst of failures from the same window counts once"""
+        limiter = AdaptiveConcurrencyLimiter(initial_limit=10, max_limit=10, backoff=0.5)
+
+        for _ in range(5):
+            limiter.try_acquire()
+        for _ in range(5):
+            limiter.release(1.0, 503)
+        stats = limiter.get_stats()
+        assert (stats["limit"], stats["decreases"]) == (5, 1)
+
+    def test_limit_recovers_additively_under_load(self):
+        """Healthy responses at full utilisation grow the limit again"""
+        limiter = AdaptiveConcurrencyLimiter(initial_limit=2, min_limit=1, max_limit=4)
+
+        limits = []
+        for _ in range(8):
+            admitted = 0
+            while limiter.try_acquire():
+                admitted += 1
+            for _ in range(admitted):
+                limiter.release(0.1, 200)
+            limits.append(limiter.get_stats()["limit"])
+        assert limits == sorted(limits)
+        assert limits[-1] == 4
+
+    def test_status_alone_judges_calls_without_latency_signal(self):
+        """A call with no per-token latency shrinks the limit only on an overload status"""
+        limiter = AdaptiveConcurrencyLimiter(initial_limit=10, max_limit=10, backoff=0.5)
+
+        limiter.try_acquire()
+        limiter.release(0.001, 200, 0.1)
+        limiter.try_acquire()
+        limiter.release(None, 200, 6.0)
+        assert limiter.get_stats()["limit"] == 10
+        limiter.try_acquire()
+        limiter.release(None, 503, 6.0)
+        assert limiter.get_stats()["limit"] == 5
+
+    def test_idle_traffic_does_not_grow_the_limit(self):
+        """One request at a time says nothing about spare upstream capacity"""
+        limiter = AdaptiveConcurrencyLimiter(initial_limit=4, max_limit=10)
+
+        for _ in range(50):
+            limiter.try_acquire()
+            limiter.release(0.1, 200)
+        assert limiter.get_stats()["limit"] == 4
+
+
+class TestMixedLengthCompletions:
+    """Long completions are not mistaken for upstream congestion"""
+
+    def test_mixed_length_successes_keep_the_limit(self):
+        """Short chat and long generate calls, all 200, leave the limit alone"""
+        # Every call takes 10 ms per output token; long ones produce 8x the tokens
+        upstream = FakeUpstream(latency=lambda i: 0.4 if i % 3 == 0 else 0.05,
+                                usage_tokens=lambda i: 40 if i % 3 == 0 else 5).start()
+        pool = OpenAIConnectionPool(max_connections=10)
+
+        async def run():
+            semaphore = asyncio.Semaphore(3)
+
+            async def call():
+                async with semaphore:
+                    return await pool.make_request("POST", f"{upstream.base_url}/chat/completions", json=BODY)
+
+            results = await asyncio.gather(*(call() for _ in range(30)))
+            await pool.close()
+            return results
+
+        try:
+            results = asyncio.run(run())
+        finally:
+            upstream.stop()
+        stats = pool.limiter.get_stats()
+        assert all(r["success"] for r in results)
+        assert (stats["limit"], stats["shed"], stats["decreases"]) == (10, 0, 0)
+
+    def test_slower_tokens_still_shrink_the_limit(self):
+        """Per-token latency well above the baseline is still read as queueing"""
+        upstream = FakeUpstream(latency=lambda i: 0.4 if i >= 3 else 0.05, usage_tokens=5).start()
+        pool = OpenAIConnectionPool(max_connections=10)
+
+        async def run():
+            for _ in range(5):
+                await pool.make_request("POST", f"{upstream.base_url}/chat/completions", json=BODY)
+            await pool.close()
+
+        try:
+            asyncio.run(run())
+        finally:
+            upstream.stop()
+        assert pool.limiter.get_stats()["decreases"] >= 1
+
+
+class TestLoadShedding:
+    """Requests over the limit get 503 with Retry-After instead of waiting"""
+
+    def setup_method(self):
+        users_db.users.clear()
+        self.upstream = FakeUpstream(reply="Answer", latency=0.3).start()
+        self.patches = [
+            patch.object(main.Config, "OPENAI_API_KEY", "sk-placeholder"),
+            patch.object(main.Config, "OPENAI_API_BASE", self.upstream.base_url),
+        ]
+        for p in self.patches:
+            p.start()
+        cache = AIResponseCache()
+        cache.redis = fakeredis.FakeAsyncRedis(decode_responses=True)
+        cache_module._cache = cache
+        deduplicator._deduplicator = None
+        scheduler._scheduler = None
+
+        connection_manager._connection_pool = OpenAIConnectionPool(max_connections=10)
+        connection_manager._connection_pool.limiter.limit = 1
+
+    def teardown_method(self):
+        for p in self.patches:
+            p.stop()
+        self.upstream.stop()
+        cache_module._cache = None
+        connection_manager._connection_pool = None
+        deduplicator._deduplicator = None
+        scheduler._scheduler = None
+        users_db.users.clear()
+
+    def test_excess_chat_requests_are_shed_with_retry_after(self):
+        """Only the admitted request reaches upstream; the rest fail fast"""
+        async def run():
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as live_client:
+                register = await live_client.post("/auth/register", json={
+                    "username": "shed", "email": "shed@example.com", "password": "testpassword123"
+                })
+                headers = {"Authorization": f"Bearer {register.json()['access_token']}"}
+                responses = await asyncio.gather(*(
+                    live_client.post("/api/ai/chat", json={"message": f"Question {i}"}, headers=headers)
+                    for i in range(4)
+                ))
+                stats = (await live_client.get("/api/ai/stats", headers=headers)).json()["connections"]
+            await main.shutdown_event()
+            return responses, stats
+
+        responses, stats = asyncio.run(run())
+
+        codes = sorted(r.status_code for r in responses)
+        assert codes == [200, 503, 503, 503]
+        shed = [r for r in responses if r.status_code == 503]
+        assert all(int(r.headers["Retry-After"]) >= 1 for r in shed)
+        # Shed requests are not retried upstream
+        assert len(self.upstream.requests) == 1
+        assert stats["adaptive_limit"]["shed"] == 3
+
+    def test_shed_streams_raise_overloaded(self):
+        """Streaming requests are shed the same way"""
+        pool = connection_manager._connection_pool
+
+        async def run():
+            pool.limiter.in_flight = 1
+            events = pool.stream_request("POST", f"{self.upstream.base_url}/chat/completions", json={})
+            with pytest.raises(UpstreamOverloadedError) as error:
+                await events.__anext__()
+            await pool.close()
+            return error.value
+
+        error = asyncio.run(run())
+        assert error.status_code == 503
+        assert error.retry_after >= 1
+        assert self.upstream.requests == []
+
+
+class TestBoundedQueue:
+    """With the default limits, overload is refused when requests arrive, not after they queue"""
+
+    concurrency = 25
+
+    def setup_method(self):
+        users_db.users.clear()
+        self.upstream = FakeUpstream(reply="Answer", latency=0.3).start()
+        self.patches = [
+            patch.object(main.Config, "OPENAI_API_KEY", "sk-placeholder"),
+            patch.object(main.Config, "OPENAI_API_BASE", self.upstream.base_url),
+        ]
+        for p in self.patches:
+            p.start()
+        cache = AIResponseCache()
+        cache.redis = fakeredis.FakeAsyncRedis(decode_responses=True)
+        cache_module._cache = cache
+        deduplicator._deduplicator = None
+        scheduler._scheduler = None
+        connection_manager._connection_pool = None
+
+    def teardown_method(self):
+        for p in self.patches:
+            p.stop()
+        self.upstream.stop()
+        cache_module._cache = None
+        connection_manager._connection_pool = None
+        deduplicator._deduplicator = None
+        scheduler._scheduler = None
+        users_db.users.clear()
+
+    def test_requests_beyond_one_queued_wave_get_503(self):
+        """Ten run, ten wait their turn, the rest are rejected at enqueue"""
+        async def run():
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as live_client:
+                register = await live_client.post("/auth/register", json={
+                    "username": "queued", "email": "queued@example.com", "password": "testpassword123"
+                })
+                headers = {"Authorization": f"Bearer {register.json()['access_token']}"}
+                responses = await asyncio.gather(*(
+                    live_client.post("/api/ai/chat", json={"message": f"Question {i}"}, headers=headers)
+                    for i in range(self.concurrency)
+                ))
+                stats = (await live_client.get("/api/ai/stats", headers=headers)).json()
+            await main.shutdown_event()
+            return responses, stats
+
+        responses, stats = asyncio.run(run())
+
+        codes = [r.status_code for r in responses]
+        assert codes.count(200) == 20
+        assert codes.count(503) == 5
+        assert all(int(r.headers["Retry-After"]) >= 1 for r in responses if r.status_code == 503)
+        assert len(self.upstream.requests) == 20
+        assert stats["scheduler"]["by_priority"]["interactive"]["rejected"] == 5
+        # Nothing was admitted by the scheduler only to be shed by the limiter
+        assert stats["connections"]["adaptive_limit"]["shed"] == 0
+
+
+class TestCircuitBreaker:
+    """Consecutive upstream failures open the circuit; a half-open probe closes it"""
+
+    def setup_method(self):
+        self.upstream = FakeUpstream(reply="Answer", error_status=lambda index: 500 if index < 3 else None).start()
+        self.url = f"{self.upstream.base_url}/chat/completions"
+        self.pool = OpenAIConnectionPool(adaptive=False,
+                                         breaker=CircuitBreaker(failure_threshold=3, reset_timeout=0.2))
+
+    def teardown_method(self):
+        self.upstream.stop()
+
+    def test_open_circuit_fails_fast(self):
+        """After the threshold, requests are rejected without reaching upstream"""
+        async def run():
+            results = [await self.pool.make_request("POST", self.url, json=BODY) for _ in range(5)]
+            await self.pool.close()
+            return results
+
+        results = asyncio.run(run())
+        assert [r["status_code"] for r in results] == [500, 500, 500, 503, 503]
+        assert results[-1]["error"] == "Upstream circuit open"
+        assert results[-1]["retry_after"] >= 1
+        assert len(self.upstream.requests) == 3
+        stats = self.pool.get_stats()["circuit"]
+        assert (stats["state"], stats["opens"], stats["rejections"]) == ("open", 1, 2)
+
+    def test_half_open_probe_closes_the_circuit(self):
+        """Once the reset timeout passes, one successful probe lets traffic back in"""
+        async def run():
+            for _ in range(3):
+                await self.pool.make_request("POST", self.url, json=BODY)
+            await asyncio.sleep(0.25)
+            probe = await self.pool.make_request("POST", self.url, json=BODY)
+            after = await self.pool.make_request("POST", self.url, json=BODY)
+            await self.pool.close()
+            return probe, after
+
+        probe, after = asyncio.run(run())
+        assert probe["success"] and after["success"]
+        stats = self.pool.get_stats()["circuit"]
+        assert (stats["state"], stats["probes"]) == ("closed", 1)
+
+    def test_failed_probe_reopens_the_circuit(self):
+        """A failing probe opens the circuit again; concurrent calls are not let through"""
+        self.upstream.error_status = 503
+        self.upstream.latency = 0.05
+
+        async def run():
+            for _ in range(3):
+                await self.pool.make_request("POST", self.url, json=BODY)
+            await asyncio.sleep(0.25)
+            results = await asyncio.gather(*(self.pool.make_request("POST", self.url, json=BODY) for _ in range(3)))
+            await self.pool.close()
+            return results
+
+        results = asyncio.run(run())
+        assert len(self.upstream.requests) == 4
+        assert sum(1 for r in results if r["error"] == "Upstream circuit open") == 2
+        assert self.pool.breaker.state == CircuitBreaker.OPEN
+
+    def test_client_errors_do_not_open_the_circuit(self):
+        """A 400 is the request's fault, not the upstream's"""
+        self.upstream.error_status = 400
+
+        async def run():
+            for _ in range(5):
+                await self.pool.make_request("POST", self.url, json=BODY)
+            await self.pool.close()
+
+        asyncio.run(run())
+        assert len(self.upstream.requests) == 5
+        assert self.pool.breaker.state == CircuitBreaker.CLOSED
+
+    def test_open_circuit_sheds_chat_with_retry_after(self):
+        """The API turns an open circuit into 503 with Retry-After"""
+        users_db.users.clear()
+        cache = AIResponseCache()
+        cache.redis = fakeredis.FakeAsyncRedis(decode_responses=True)
+        cache_module._cache = cache
+        deduplicator._deduplicator = None
+        scheduler._scheduler = None
+        connection_manager._connection_pool = self.pool
+        self.pool.breaker.reset_timeout = 60
+        self.pool.breaker.state = CircuitBreaker.OPEN
+        self.pool.breaker._opened_at = time.monotonic()
+
+        async def run():
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as live_client:
+                register = await live_client.post("/auth/register", json={
+                    "username": "circuit", "email": "circuit@example.com", "password": "testpassword123"
+                })
+                headers = {"Authorization": f"Bearer {register.json()['access_token']}"}
+                response = await live_client.post("/api/ai/chat", json={"message": "Hello"}, headers=headers)
+            await main.shutdown_event()
+            return response
+
+        try:
+            with patch.object(main.Config, "OPENAI_API_KEY", "sk-placeholder"), \
+                    patch.object(main.Config, "OPENAI_API_BASE", self.upstream.base_url):
+                response = asyncio.run(run())
+        finally:
+            cache_module._cache = None
+            connection_manager._connection_pool = None
+            deduplicator._deduplicator = None
+            scheduler._scheduler = None
+            users_db.users.clear()
+
+        assert response.status_code == 503
+        assert int(response.headers["Retry-After"]) >= 1
+        assert self.upstream.requests == []
+
+
+class TestHedgedRequests:
+    """A second attempt after the p95 latency cuts off the slow tail"""
+
+    def setup_method(self):
+        # Every request is fast except the fourth, which stalls
+        self.upstream = FakeUpstream(reply="Answer", latency=lambda index: 1.0 if index == 3 else 0.01).start()
+        self.url = f"{self.upstream.base_url}/chat/completions"
+        self.pool = OpenAIConnectionPool(adaptive=True, hedge=True)
+        self.pool._latencies.extend([0.1] * 20)
+
+    def teardown_method(self):
+        self.upstream.stop()
+
+    def test_hedge_wins_over_a_slow_attempt(self):
+        """The hedge answers first and the stalled attempt is cancelled"""
+        async def run():
+            for _ in range(3):
+                await self.pool.make_request("POST", self.url, json=BODY)
+            start = time.monotonic()
+            result = await self.pool.make_request("POST", self.url, json=BODY)
+            elapsed = time.monotonic() - start
+            await self.pool.close()
+            return result, elapsed
+
+        result, elapsed = asyncio.run(run())
+        assert result["success"]
+        assert elapsed < 0.5
+        assert len(self.upstream.requests) == 5
+        stats = self.pool.get_stats()
+        assert (stats["hedges_sent"], stats["hedges_won"]) == (1, 1)
+        # The cancelled loser gave back its concurrency slot
+        assert self.pool.limiter.in_flight == 0
+
+    def test_no_hedge_without_latency_history(self):
+        """Until enough latencies are seen there is no p95 to hedge on"""
+        self.pool._latencies.clear()
+
+        async def run():
+            await self.pool.make_request("POST", self.url, json=BODY)
+            await self.pool.close()
+
+        asyncio.run(run())
+        assert self.pool.hedge_delay() is None
+        assert self.pool.get_stats()["hedges_sent"] == 0
+
+    def test_hedging_can_be_disabled_per_request(self):
+        """hedge=False waits out a slow attempt"""
+        self.upstream.latency = 0.3
+
+        async def run():
+            result = await self.pool.make_request("POST", self.url, hedge=False, json=BODY)
+            await self.pool.close()
+            return result
+
+        assert asyncio.run(run())["success"]
+        assert len(self.upstream.requests) == 1
+        assert self.pool.get_stats()["hedges_sent"] == 0
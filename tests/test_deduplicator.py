@@ -0,0 +1,229 @@
+"""
+Tests for request deduplication across workers
+"""
+
+import asyncio
+import pytest
+import socket
+
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'ai-backend'))
+import redis_pool
+from connection_manager import UpstreamOverloadedError
+from deduplicator import FINISH_FLIGHT, RequestDeduplicator, DistributedFlightError
+
+fakeredis = pytest.importorskip("fakeredis")
+
+
+class TestDistributedSingleFlight:
+    """Several deduplicators sharing one Redis behave like separate workers"""
+
+    def setup_method(self):
+        self.server = fakeredis.FakeServer()
+        self.calls = 0
+
+    def teardown_method(self):
+        redis_pool._redis_client = None
+
+    def make_worker(self, lease_ms=600):
+        return RequestDeduplicator(distributed=True, lease_ms=lease_ms)
+
+    def run(self, scenario):
+        async def wrapped():
+            redis_pool._redis_client = fakeredis.FakeAsyncRedis(server=self.server, decode_responses=True)
+            return await scenario()
+        return asyncio.run(wrapped())
+
+    async def slow_upstream(self, delay=0.3, answer="answer"):
+        self.calls += 1
+        await asyncio.sleep(delay)
+        return answer
+
+    def test_workers_share_one_upstream_call(self):
+        """Identical prompts on different workers call upstream once"""
+        async def scenario():
+            workers = [self.make_worker() for _ in range(4)]
+            results = await asyncio.gather(*(
+                worker.execute_or_wait("What is ZFS?", "gpt-3.5-turbo", self.slow_upstream)
+                for worker in workers
+            ))
+            return results, [worker.get_stats() for worker in workers]
+
+        results, stats = self.run(scenario)
+        assert results == ["answer"] * 4
+        assert self.calls == 1
+        assert sum(s['distributed_leads'] for s in stats) == 1
+        assert sum(s['distributed_follows'] for s in stats) == 3
+
+    def test_followers_share_one_subscription(self):
+        """Followers of many flights wait on one pub/sub connection per worker"""
+        async def scenario():
+            leader, follower = self.make_worker(), self.make_worker()
+            client = await redis_pool.get_async_redis()
+            original = client.pubsub
+            opened = []
+            client.pubsub = lambda: opened.append(1) or original()
+
+            prompts = [f"Question {i}" for i in range(10)]
+            leading = [asyncio.create_task(leader.execute_or_wait(p, "gpt-3.5-turbo", self.slow_upstream))
+                       for p in prompts]
+            await asyncio.sleep(0.05)
+            following = await asyncio.gather(*(
+                follower.execute_or_wait(p, "gpt-3.5-turbo", self.slow_upstream) for p in prompts
+            ))
+            await asyncio.gather(*leading)
+            return following, len(opened), follower.get_stats()
+
+        following, opened, stats = self.run(scenario)
+        assert following == ["answer"] * 10
+        assert opened == 1
+        assert stats['distributed_follows'] == 10
+
+    def test_follower_takes_over_when_leader_dies(self):
+        """A lease that lapses without a result is taken over by a follower"""
+        async def scenario():
+            worker = self.make_worker(lease_ms=300)
+            key = worker._get_request_key("Why?", "gpt-3.5-turbo")
+            # A crashed worker's lease: never renewed, never finished
+            client = await redis_pool.get_async_redis()
+            await client.set(f"ai_singleflight:lease:{key}", "dead-worker", px=300)
+
+            result = await worker.execute_or_wait("Why?", "gpt-3.5-turbo",
+                                                  lambda: self.slow_upstream(delay=0))
+            return result, worker.get_stats()
+
+        result, stats = self.run(scenario)
+        assert result == "answer"
+        assert self.calls == 1
+        assert stats['takeovers'] == 1
+        assert stats['distributed_leads'] == 1
+
+    def test_lease_is_renewed_for_slow_requests(self):
+        """A leader slower than the lease keeps followers waiting instead of taking over"""
+        async def scenario():
+            leader, follower = self.make_worker(lease_ms=300), self.make_worker(lease_ms=300)
+            first = asyncio.create_task(leader.execute_or_wait(
+                "Slow", "gpt-3.5-turbo", lambda: self.slow_upstream(delay=1.0)))
+            await asyncio.sleep(0.05)
+            second = await follower.execute_or_wait("Slow", "gpt-3.5-turbo", self.slow_upstream)
+            return await first, second, follower.get_stats()
+
+        first, second, stats = self.run(scenario)
+        assert first == second == "answer"
+        assert self.calls == 1
+        assert stats['takeovers'] == 0
+
+    def test_leader_failure_reaches_followers(self):
+        """Followers get the leader's error; the failure is not cached"""
+        async def failing():
+            self.calls += 1
+            await asyncio.sleep(0.2)
+            raise RuntimeError("upstream 502")
+
+        async def scenario():
+            leader, follower = self.make_worker(), self.make_worker()
+            outcomes = await asyncio.gather(
+                leader.execute_or_wait("Broken", "gpt-3.5-turbo", failing),
+                follower.execute_or_wait("Broken", "gpt-3.5-turbo", failing),
+                return_exceptions=True
+            )
+            retry = await follower.execute_or_wait("Broken", "gpt-3.5-turbo",
+                                                   lambda: self.slow_upstream(delay=0))
+            return outcomes, retry
+
+        outcomes, retry = self.run(scenario)
+        assert sorted(type(o).__name__ for o in outcomes) == ["DistributedFlightError", "RuntimeError"]
+        assert any(isinstance(o, DistributedFlightError) and "upstream 502" in str(o) for o in outcomes)
+        assert retry == "answer"
+        assert self.calls == 2
+
+    def test_publish_error_keeps_the_leaders_outcome(self):
+        """The leader returns its own result or error even if publishing it to Redis fails"""
+        async def failing():
+            raise RuntimeError("upstream 502")
+
+        async def scenario():
+            worker = self.make_worker()
+            client = await redis_pool.get_async_redis()
+            original = client.evalsha
+
+            async def broken_finish(sha, *args):
+                if sha == FINISH_FLIGHT.sha:
+                    raise ConnectionError("Redis went away")
+                return await original(sha, *args)
+
+            client.evalsha = broken_finish
+            result = await worker.execute_or_wait("Publish", "gpt-3.5-turbo",
+                                                  lambda: self.slow_upstream(delay=0))
+            with pytest.raises(RuntimeError, match="upstream 502"):
+                await worker.execute_or_wait("Publish fails", "gpt-3.5-turbo", failing)
+            return result
+
+        assert self.run(scenario) == "answer"
+
+    def test_falls_back_to_local_without_redis(self):
+        """With Redis unavailable distributed mode degrades to per-process single-flight"""
+        async def scenario():
+            redis_pool._redis_client = None
+            redis_pool._last_failure = float("inf")
+            worker = self.make_worker()
+            results = await asyncio.gather(*(
+                worker.execute_or_wait("Offline", "gpt-3.5-turbo", self.slow_upstream) for _ in range(3)
+            ))
+            return results, worker.get_stats()
+
+        try:
+            results, stats = asyncio.run(scenario())
+        finally:
+            redis_pool._last_failure = 0.0
+        assert results == ["answer"] * 3
+        assert self.calls == 1
+        assert stats['distributed_leads'] == 0
+
+    def test_overloaded_leader_reaches_followers_as_overload(self):
+        """Followers of a shed request get the same 503 and retry hint"""
+        leading = asyncio.Event()
+
+        async def overloaded():
+            self.calls += 1
+            leading.set()
+            await asyncio.sleep(0.2)
+            raise UpstreamOverloadedError(7)
+
+        async def scenario():
+            leader, follower = self.make_worker(), self.make_worker()
+            first = asyncio.create_task(leader.execute_or_wait("Busy", "gpt-3.5-turbo", overloaded))
+            await leading.wait()
+            with pytest.raises(UpstreamOverloadedError) as raised:
+                await follower.execute_or_wait("Busy", "gpt-3.5-turbo", overloaded)
+            with pytest.raises(UpstreamOverloadedError):
+                await first
+            return raised.value
+
+        error = self.run(scenario)
+        assert error.retry_after == 7
+        assert error.status_code == 503
+        assert self.calls == 1
+
+    def test_falls_back_to_local_when_redis_dies(self):
+        """A cached client whose server has gone away runs the request locally"""
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            dead_port = sock.getsockname()[1]
+
+        async def scenario():
+            import redis.asyncio as aioredis
+            redis_pool._redis_client = aioredis.Redis(host="127.0.0.1", port=dead_port,
+                                                      socket_connect_timeout=0.2, decode_responses=True)
+            worker = self.make_worker()
+            results = await asyncio.gather(*(
+                worker.execute_or_wait("Outage", "gpt-3.5-turbo", self.slow_upstream) for _ in range(3)
+            ))
+            await worker.shutdown()
+            return results, worker.get_stats()
+
+        results, stats = asyncio.run(scenario())
+        assert results == ["answer"] * 3
+        assert self.calls == 1
+        assert stats['redis_fallbacks'] == 1
@@ -0,0 +1,160 @@
+"""
+Tests for the LLM provider backends and the mock LLM server
+"""
+
+import asyncio
+import time
+import httpx
+import pytest
+from unittest.mock import patch
+
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'ai-backend'))
+import cache as cache_module
+import connection_manager
+import deduplicator
+import main
+import scheduler
+from main import app, users_db
+from cache import AIResponseCache
+from connection_manager import OpenAIConnectionPool, UpstreamError
+from llm_provider import (PROVIDERS, LLMProvider, LocalProvider, OpenAICompatibleProvider, create_provider,
+                          register_provider)
+from mock_llm_server import MockLLMServer
+
+MESSAGES = [{"role": "user", "content": "How do I snapshot a ZFS pool?"}]
+
+
+class TestMockLLMServer:
+    """Test the mock server's timing, errors and determinism through the provider"""
+
+    def setup_method(self):
+        connection_manager._connection_pool = OpenAIConnectionPool(adaptive=False)
+
+    def teardown_method(self):
+        connection_manager._connection_pool = None
+
+    def run(self, server, scenario):
+        async def wrapped():
+            await server.start()
+            try:
+                return await scenario(LocalProvider(server.base_url, None, "mock-model"))
+            finally:
+                await connection_manager.close_connection_pool()
+                await server.stop()
+        return asyncio.run(wrapped())
+
+    def test_replies_are_deterministic(self):
+        """The same prompt and seed give the same reply and usage"""
+        async def scenario(provider):
+            return await provider.complete(MESSAGES, max_tokens=16, temperature=0.7)
+
+        first = self.run(MockLLMServer(reply_tokens=32, seed=7), scenario)
+        second = self.run(MockLLMServer(reply_tokens=32, seed=7), scenario)
+
+        assert first == second
+        assert len(first.content.split()) == 16
+        assert first.total_tokens == 16 + len(MESSAGES[0]["content"].split())
+
+    def test_stream_follows_token_rate(self):
+        """Streamed tokens arrive at tokens_per_second after the initial latency"""
+        async def scenario(provider):
+            start = time.monotonic()
+            deltas = [delta async for delta in provider.stream(MESSAGES, max_tokens=100, temperature=0.7)]
+            return deltas, time.monotonic() - start
+
+        server = MockLLMServer(latency=0.05, tokens_per_second=100, reply_tokens=20)
+        deltas, elapsed = self.run(server, scenario)
+
+        assert len(deltas) == 20
+        assert 0.25 <= elapsed < 1.0
+        assert server.get_stats()["streams"] == 1
+
+    def test_error_rate_is_reproducible(self):
+        """A seeded error rate fails the same requests every run"""
+        async def scenario(provider):
+            outcomes = []
+            for _ in range(40):
+                try:
+                    await provider.complete(MESSAGES, max_tokens=4, temperature=0.7)
+                    outcomes.append(200)
+                except UpstreamError as e:
+                    outcomes.append(e.status_code)
+            return outcomes
+
+        first = self.run(MockLLMServer(error_rate=0.25, error_status=503, seed=3), scenario)
+        second = self.run(MockLLMServer(error_rate=0.25, error_status=503, seed=3), scenario)
+
+        assert first == second
+        assert set(first) == {200, 503}
+        assert 4 <= first.count(503) <= 16
+
+
+class TestProviderSelection:
+    """Test choosing a backend through configuration"""
+
+    def test_local_provider_needs_no_key(self):
+        """Without an API key only keyless providers count as configured"""
+        with patch.object(main.Config, "OPENAI_API_KEY", None):
+            with patch.object(main.Config, "LLM_PROVIDER", "openai"):
+                assert not main.Config.ai_configured()
+            with patch.object(main.Config, "LLM_PROVIDER", "local"):
+                assert main.Config.ai_configured()
+
+    def test_registered_providers_are_selectable(self):
+        """register_provider adds a backend; unknown names are rejected"""
+        class EchoProvider(LLMProvider):
+            requires_api_key = False
+
+        register_provider("echo", EchoProvider)
+        try:
+            provider = create_provider("echo", "http://example.invalid/v1/", None, "echo-1")
+            assert isinstance(provider, EchoProvider)
+            assert provider.api_base == "http://example.invalid/v1"
+        finally:
+            PROVIDERS.pop("echo")
+
+        assert isinstance(create_provider("openai", "https://api.openai.com/v1", "sk-x", "m"), OpenAICompatibleProvider)
+        with pytest.raises(ValueError):
+            create_provider("missing", "", None, "m")
+
+    def test_chat_runs_offline_against_the_mock_server(self):
+        """The chat endpoint answers from the mock server with no API key"""
+        fakeredis = pytest.importorskip("fakeredis")
+        users_db.users.clear()
+        cache = AIResponseCache()
+        cache.redis = fakeredis.FakeAsyncRedis(decode_responses=True)
+        cache_module._cache = cache
+        connection_manager._connection_pool = None
+        deduplicator._deduplicator = None
+        scheduler._scheduler = None
+        server = MockLLMServer(reply_tokens=12, seed=1)
+
+        async def run():
+            await server.start()
+            with patch.object(main.Config, "OPENAI_API_BASE", server.base_url):
+                transport = httpx.ASGITransport(app=app)
+                async with httpx.AsyncClient(transport=transport, base_url="http://test") as live_client:
+                    register = await live_client.post("/auth/register", json={
+                        "username": "offline", "email": "offline@example.com", "password": "testpassword123"
+                    })
+                    headers = {"Authorization": f"Bearer {register.json()['access_token']}"}
+                    response = await live_client.post("/api/ai/chat", json={"message": "Hello"}, headers=headers)
+            await main.shutdown_event()
+            await server.stop()
+            return response
+
+        try:
+            with patch.object(main.Config, "OPENAI_API_KEY", None), patch.object(main.Config, "LLM_PROVIDER", "local"):
+                response = asyncio.run(run())
+        finally:
+            cache_module._cache = None
+            connection_manager._connection_pool = None
+            deduplicator._deduplicator = None
+            scheduler._scheduler = None
+            users_db.users.clear()
+
+        assert response.status_code == 200
+        assert len(response.json()["response"].split()) == 12
+        assert server.get_stats()["requests"] == 1
@@ -0,0 +1,171 @@
+"""
+Tests for login throttling ahead of password hashing
+"""
+
+import asyncio
+import pytest
+from fastapi.testclient import TestClient
+
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'ai-backend'))
+import login_throttle
+import password_hasher
+import redis_pool
+from main import app, users_db, get_password_hash
+from login_throttle import BackoffPolicy, LoginThrottle, LoginThrottledError
+
+fakeredis = pytest.importorskip("fakeredis")
+
+
+class TestLoginThrottle:
+    """Test the backoff counters, against Redis and the local fallback"""
+
+    def setup_method(self):
+        redis_pool._redis_client = fakeredis.FakeAsyncRedis(decode_responses=True)
+        self.throttle = LoginThrottle(username_policy=BackoffPolicy(free_failures=3),
+                                      ip_policy=BackoffPolicy(free_failures=5), max_concurrent=2,
+                                      slot_timeout=0.05)
+
+    def teardown_method(self):
+        redis_pool._redis_client = None
+
+    async def attempt(self, username, client_ip="10.0.0.1", known_user=False):
+        """Admit and fail one login; the retry hint if it was throttled"""
+        try:
+            await self.throttle.check(username, client_ip, known_user)
+        except LoginThrottledError as e:
+            return e.retry_after
+        await self.throttle.record_failure(username, client_ip)
+        return None
+
+    def test_username_backoff_doubles(self):
+        """Free failures pass, then each failure blocks for twice as long"""
+        async def scenario():
+            results = [await self.attempt("alice") for _ in range(4)]
+            results.append(await self.attempt("alice", "10.0.0.2"))
+            key = self.throttle._keys("alice", "10.0.0.1")[0][0]
+            await redis_pool._redis_client.hset(key, "blocked_until", 0)
+            await self.throttle.record_failure("alice", "10.0.0.2")
+            results.append(await self.attempt("alice", "10.0.0.3"))
+            return results
+
+        results = asyncio.run(scenario())
+        # Blocked for 1s after the 4th failure, from any IP; 2s after the 5th
+        assert results == [None, None, None, None, 1, 2]
+
+    def test_ip_counter_catches_spraying(self):
+        """One source trying many usernames is blocked by its IP"""
+        async def scenario():
+            return [await self.attempt(f"user{i}") for i in range(7)]
+
+        results = asyncio.run(scenario())
+        assert results[:6] == [None] * 6
+        assert results[6] == 1
+        assert asyncio.run(self.attempt("user0", "10.0.0.9")) is None
+
+    def test_ip_block_spares_known_users_in_good_standing(self):
+        """Users sharing a blocked address still log in unless their own username is failing"""
+        async def scenario():
+            for i in range(6):
+                await self.attempt(f"user{i}")
+            return (await self.attempt("newcomer", known_user=False),
+                    await self.attempt("alice", known_user=True),
+                    await self.attempt("alice", known_user=True))
+
+        # alice's failure extends the IP block and subjects her next attempt to it
+        assert asyncio.run(scenario()) == (1, None, 2)
+
+    def test_success_clears_the_username(self):
+        async def scenario():
+            for _ in range(4):
+                await self.attempt("bob")
+            await self.throttle.record_success("bob", "10.0.0.1")
+            return await self.attempt("bob")
+
+        assert asyncio.run(scenario()) is None
+
+    def test_concurrency_cap(self):
+        """Password checks beyond max_concurrent wait briefly for a slot, then are refused"""
+        async def hold(seconds):
+            async with self.throttle.verify_slot():
+                await asyncio.sleep(seconds)
+
+        async def scenario():
+            async with self.throttle.verify_slot():
+                async with self.throttle.verify_slot():
+                    with pytest.raises(LoginThrottledError):
+                        async with self.throttle.verify_slot():
+                            pass
+                # A slot freed within slot_timeout is handed to the waiter
+                short = asyncio.create_task(hold(0.01))
+                await asyncio.sleep(0)
+                async with self.throttle.verify_slot():
+                    in_flight = self.throttle.in_flight
+                await short
+            return in_flight
+
+        assert asyncio.run(scenario()) == 2
+
+        stats = self.throttle.get_stats()
+        assert (stats['concurrency_rejections'], stats['in_flight']) == (1, 0)
+
+    def test_local_fallback_without_redis(self):
+        """Counters are kept per worker while Redis is unavailable"""
+        redis_pool._redis_client = None
+        redis_pool._last_failure = float("inf")
+
+        async def scenario():
+            return [await self.attempt("carol") for _ in range(5)]
+
+        try:
+            results = asyncio.run(scenario())
+        finally:
+            redis_pool._last_failure = 0.0
+        assert results == [None, None, None, None, 1]
+        assert self.throttle.get_stats()['local_entries'] == 2
+
+    def test_local_fallback_ip_block_is_soft(self):
+        """Without Redis the IP block also spares known users in good standing"""
+        redis_pool._redis_client = None
+        redis_pool._last_failure = float("inf")
+
+        async def scenario():
+            for i in range(6):
+                await self.attempt(f"user{i}")
+            return (await self.attempt("newcomer"), await self.attempt("alice", known_user=True))
+
+        try:
+            assert asyncio.run(scenario()) == (1, None)
+        finally:
+            redis_pool._last_failure = 0.0
+
+
+class TestLoginEndpointThrottling:
+    """Test that throttled logins never reach the password hasher"""
+
+    def setup_method(self):
+        users_db.users.clear()
+        redis_pool._redis_client = fakeredis.FakeAsyncRedis(decode_responses=True)
+        password_hasher._password_hasher = None
+        login_throttle._login_throttle = LoginThrottle(username_policy=BackoffPolicy(free_failures=2))
+        asyncio.run(users_db.create_user({"username": "victim", "email": "victim@example.com", "is_active": True,
+                                          "hashed_password": get_password_hash("testpassword123")}))
+        self.client = TestClient(app)
+
+    def teardown_method(self):
+        login_throttle._login_throttle = None
+        password_hasher.close_password_hasher()
+        redis_pool._redis_client = None
+        users_db.users.clear()
+
+    def test_throttled_login_is_429_before_hashing(self):
+        codes = [self.client.post("/auth/login", json={"username": "victim", "password": f"guess{i}"}).status_code
+                 for i in range(3)]
+        blocked = self.client.post("/auth/login", json={"username": "victim", "password": "testpassword123"})
+
+        assert codes == [401, 401, 401]
+        assert blocked.status_code == 429
+        assert int(blocked.headers["Retry-After"]) >= 1
+        assert password_hasher._password_hasher.get_stats()["verifies"] == 3
+
@@ -0,0 +1,142 @@
+"""
+Tests for password hashing on the worker pool
+"""
+
+import asyncio
+import time
+import pytest
+from fastapi.testclient import TestClient
+from passlib.context import CryptContext
+
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'ai-backend'))
+import password_hasher
+from main import app, users_db, get_password_hash, verify_password
+from password_hasher import PasswordHasher, PasswordHasherOverloadedError
+
+context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+
+class SlowContext:
+    """Stands in for a CryptContext whose hash takes a fixed time"""
+
+    def __init__(self, delay):
+        self.delay = delay
+
+    def hash(self, password):
+        time.sleep(self.delay)
+        return f"hashed:{password}"
+
+    def verify(self, password, hashed_password):
+        time.sleep(self.delay)
+        return hashed_password == f"hashed:{password}"
+
+
+class TestPasswordHasher:
+    """Test the bounded hashing pool"""
+
+    def test_hashes_are_compatible_with_the_sync_helpers(self):
+        """Pool hashes verify synchronously and the other way round"""
+        hasher = PasswordHasher(context, workers=2)
+
+        async def scenario():
+            hashed = await hasher.hash("correct horse")
+            return hashed, await hasher.verify("correct horse", get_password_hash("correct horse"))
+
+        hashed, valid = asyncio.run(scenario())
+        hasher.close()
+        assert verify_password("correct horse", hashed)
+        assert valid
+        assert hasher.get_stats()["hashes"] == 1
+
+    def test_event_loop_keeps_running_while_hashing(self):
+        """Other coroutines are scheduled while a hash runs"""
+        hasher = PasswordHasher(SlowContext(0.2), workers=1)
+
+        async def scenario():
+            ticks = 0
+
+            async def ticker():
+                nonlocal ticks
+                while True:
+                    await asyncio.sleep(0.01)
+                    ticks += 1
+
+            task = asyncio.create_task(ticker())
+            await hasher.hash("password")
+            task.cancel()
+            return ticks
+
+        assert asyncio.run(scenario()) >= 10
+        hasher.close()
+
+    def test_admission_limit_rejects_excess_calls(self):
+        """Calls beyond max_pending fail at once with a retry hint"""
+        hasher = PasswordHasher(SlowContext(0.1), workers=1, max_pending=2)
+
+        async def scenario():
+            return await asyncio.gather(*(hasher.verify("pw", "hashed:pw") for _ in range(4)),
+                                        return_exceptions=True)
+
+        results = asyncio.run(scenario())
+        hasher.close()
+        assert results[:2] == [True, True]
+        assert all(isinstance(r, PasswordHasherOverloadedError) and r.retry_after >= 1 for r in results[2:])
+        stats = hasher.get_stats()
+        assert (stats["rejected"], stats["peak_pending"], stats["pending"]) == (2, 2, 0)
+
+    def test_cancelled_caller_keeps_its_slot_until_the_hash_ends(self):
+        """The admission count tracks work still on the pool, not waiting callers"""
+        hasher = PasswordHasher(SlowContext(0.1), workers=1, max_pending=1)
+
+        async def scenario():
+            with pytest.raises(asyncio.TimeoutError):
+                await asyncio.wait_for(hasher.hash("pw"), timeout=0.02)
+            with pytest.raises(PasswordHasherOverloadedError):
+                await hasher.hash("pw")
+            await asyncio.sleep(0.15)
+            return await hasher.hash("pw")
+
+        assert asyncio.run(scenario()) == "hashed:pw"
+        hasher.close()
+
+
+class TestAuthHashing:
+    """Test the auth endpoints' use of the pool"""
+
+    def setup_method(self):
+        users_db.users.clear()
+        password_hasher._password_hasher = None
+        self.client = TestClient(app)
+
+    def teardown_method(self):
+        password_hasher.close_password_hasher()
+        users_db.users.clear()
+
+    def test_login_uses_the_pool(self):
+        """Register and login hash on the pool; wrong passwords are still 401"""
+        self.client.post("/auth/register", json={
+            "username": "pooluser", "email": "pool@example.com", "password": "testpassword123"
+        })
+        ok = self.client.post("/auth/login", json={"username": "pooluser", "password": "testpassword123"})
+        bad = self.client.post("/auth/login", json={"username": "pooluser", "password": "wrongpassword"})
+
+        assert ok.status_code == 200
+        assert bad.status_code == 401
+        stats = password_hasher._password_hasher.get_stats()
+        assert (stats["hashes"], stats["verifies"]) == (1, 2)
+
+    def test_overloaded_login_is_503_with_retry_after(self):
+        """Logins over the admission limit are turned away before hashing"""
+        asyncio.run(users_db.create_user({"username": "busy", "email": "busy@example.com", "is_active": True,
+                                          "hashed_password": get_password_hash("testpassword123")}))
+        hasher = password_hasher.get_password_hasher(context)
+        hasher.pending = hasher.max_pending
+
+        response = self.client.post("/auth/login", json={"username": "busy", "password": "testpassword123"})
+
+        hasher.pending = 0
+        assert response.status_code == 503
+        assert int(response.headers["Retry-After"]) >= 1
+        assert hasher.get_stats()["verifies"] == 0
@@ -0,0 +1,265 @@
+"""
+Tests for the rate limiting engines and middleware
+"""
+
+import asyncio
+import time
+import pytest
+from fastapi.testclient import TestClient
+
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'ai-backend'))
+import redis_pool
+import main
+from main import app
+from rate_limiter import ENGINES, LocalCounterTier, RateLimiter, RateLimitRule
+
+fakeredis = pytest.importorskip("fakeredis")
+
+
+class TestRateLimitMiddleware:
+    """Test the async rate limiting middleware"""
+
+    def setup_method(self):
+        """Point the shared async pool at a fresh Redis stand-in"""
+        self.redis = fakeredis.FakeAsyncRedis(decode_responses=True)
+        redis_pool._redis_client = self.redis
+        self.original_rule = main.rate_limiter.default_rule
+        main.rate_limiter.default_rule = RateLimitRule(limit=5, window=60, algorithm="sliding_window")
+        self.client = TestClient(app)
+
+    def teardown_method(self):
+        main.rate_limiter.default_rule = self.original_rule
+        redis_pool._redis_client = None
+
+    def test_requests_over_limit_are_rejected(self):
+        """Requests beyond the window limit get 429"""
+        codes = [self.client.get("/api/navigation").status_code for _ in range(7)]
+        assert codes[:5] == [200] * 5
+        assert codes[5:] == [429, 429]
+
+    def test_rate_limit_headers(self):
+        """Responses report the remaining budget and 429s carry Retry-After"""
+        response = self.client.get("/api/navigation")
+        assert response.headers["X-RateLimit-Limit"] == "5"
+        assert response.headers["X-RateLimit-Remaining"] == "4"
+
+        for _ in range(4):
+            self.client.get("/api/navigation")
+        response = self.client.get("/api/navigation")
+        assert response.status_code == 429
+        assert int(response.headers["Retry-After"]) >= 1
+
+    def test_counter_keys_expire(self):
+        """Counter keys are created with a TTL"""
+        self.client.get("/api/navigation")
+
+        async def ttl():
+            keys = await self.redis.keys("rate_limit:*")
+            return await self.redis.pttl(keys[0])
+
+        assert asyncio.run(ttl()) > 0
+
+    def test_route_rules_are_isolated(self):
+        """Per-route rules keep separate budgets"""
+        for _ in range(5):
+            self.client.get("/api/navigation")
+        assert self.client.get("/api/navigation").status_code == 429
+        assert self.client.get("/api/stats").status_code == 200
+
+    def test_health_checks_are_not_limited(self):
+        """Health checks bypass the limiter"""
+        codes = [self.client.get("/health").status_code for _ in range(10)]
+        assert codes == [200] * 10
+
+
+class TestRateLimitEngines:
+    """Test the Lua-backed limiter engines directly"""
+
+    def run_checks(self, algorithm, rule, count):
+        async def checks():
+            redis_conn = fakeredis.FakeAsyncRedis(decode_responses=True)
+            engine = ENGINES[algorithm]
+            return [await engine.acquire(redis_conn, "rate_limit:test", rule) for _ in range(count)]
+        return asyncio.run(checks())
+
+    @pytest.mark.parametrize("algorithm", ["fixed_window", "sliding_window", "token_bucket"])
+    def test_engine_enforces_limit(self, algorithm):
+        """Every engine allows exactly the limit within one window"""
+        rule = RateLimitRule(limit=5, window=60, algorithm=algorithm)
+        results = self.run_checks(algorithm, rule, 7)
+        assert [r.allowed for r in results] == [True] * 5 + [False] * 2
+        assert [r.remaining for r in results[:5]] == [4, 3, 2, 1, 0]
+        assert results[-1].retry_after > 0
+
+    @pytest.mark.parametrize("algorithm", ["fixed_window", "sliding_window", "token_bucket"])
+    def test_engine_touches_only_declared_keys(self, algorithm):
+        """Scripts keep their state under the keys passed in KEYS, as Redis Cluster requires"""
+        async def checks():
+            redis_conn = fakeredis.FakeAsyncRedis(decode_responses=True)
+            engine = ENGINES[algorithm]
+            rule = RateLimitRule(limit=5, window=1, algorithm=algorithm)
+            for _ in range(3):
+                await engine.acquire(redis_conn, "rate_limit:test", rule)
+            await asyncio.sleep(1.1)
+            await engine.acquire(redis_conn, "rate_limit:test", rule)
+            return engine.keys("rate_limit:test", rule), sorted(await redis_conn.keys("*"))
+
+        declared, stored = asyncio.run(checks())
+        assert stored == declared
+
+    def test_sliding_window_carries_the_previous_window(self):
+        """Requests from the previous window still count, weighted by their overlap"""
+        async def checks():
+            redis_conn = fakeredis.FakeAsyncRedis(decode_responses=True)
+            engine = ENGINES["sliding_window"]
+            rule = RateLimitRule(limit=5, window=2, algorithm="sliding_window")
+            for _ in range(5):
+                await engine.acquire(redis_conn, "rate_limit:test", rule)
+            # Move to early in the next window
+            await asyncio.sleep(2 - (time.time() % 2) + 0.1)
+            return await engine.acquire(redis_conn, "rate_limit:test", rule)
+
+        result = asyncio.run(checks())
+        assert not result.allowed
+        assert result.retry_after > 0
+
+    def test_token_bucket_burst(self):
+        """Token bucket capacity caps the initial burst"""
+        rule = RateLimitRule(limit=60, window=60, algorithm="token_bucket", burst=3)
+        results = self.run_checks("token_bucket", rule, 4)
+        assert [r.allowed for r in results] == [True, True, True, False]
+        assert 0 < results[-1].retry_after <= 1
+
+    def test_longest_prefix_rule_wins(self):
+        """Routes match the most specific rule prefix"""
+        default = RateLimitRule(limit=100, window=3600)
+        chat = RateLimitRule(limit=30, window=60, algorithm="token_bucket")
+        limiter = RateLimiter({"/api": default, "/api/ai/chat": chat}, default)
+        assert limiter.rule_for("/api/ai/chat/stream") == ("/api/ai/chat", chat)
+        assert limiter.rule_for("/api/files") == ("/api", default)
+        assert limiter.rule_for("/apiary") == ("/apiary", default)
+
+    def test_unknown_algorithm_rejected(self):
+        """Misconfigured rules fail fast"""
+        with pytest.raises(ValueError):
+            RateLimiter({}, RateLimitRule(limit=1, window=1, algorithm="leaky"))
+
+
+class TestLocalCounterTier:
+    """Test the in-process counter tier and its Redis reconciliation"""
+
+    def setup_method(self):
+        self.redis = fakeredis.FakeAsyncRedis(decode_responses=True)
+        redis_pool._redis_client = self.redis
+
+    def teardown_method(self):
+        redis_pool._redis_client = None
+
+    def make_limiter(self, limit, **tier_options):
+        rule = RateLimitRule(limit=limit, window=60, algorithm="fixed_window")
+        tier = LocalCounterTier(sync_interval_ms=10000, **tier_options)
+        return RateLimiter({}, rule, local_tier=tier), tier
+
+    def test_local_tier_reduces_redis_checks(self):
+        """Clients far below their limit are mostly answered locally"""
+        limiter, tier = self.make_limiter(1000)
+
+        async def run():
+            results = [await limiter.check("10.0.0.1", "/api/files") for _ in range(200)]
+            await limiter.close()
+            return results
+
+        results = asyncio.run(run())
+        assert all(r.allowed for r in results)
+        stats = tier.get_stats()
+        assert stats['redis_checks'] <= 200 // 10
+        assert stats['local_hits'] >= 180
+
+        # Every admitted request is reconciled to Redis
+        count = asyncio.run(self.redis.get("rate_limit:fixed_window:/api/files:10.0.0.1"))
+        assert int(count) == 200
+
+    def test_exact_mode_enforces_limit(self):
+        """Near the limit every check goes to Redis, so the limit is exact"""
+        limiter, _ = self.make_limiter(20)
+
+        async def run():
+            return [await limiter.check("10.0.0.1", "/api/files") for _ in range(30)]
+
+        results = asyncio.run(run())
+        assert sum(r.allowed for r in results) == 20
+        assert not any(r.allowed for r in results[20:])
+
+    def test_approximate_mode_rejects_locally(self):
+        """Approximate mode spends the budget locally and rejects until the next sync"""
+        limiter, tier = self.make_limiter(10, approximate=True)
+
+        async def run():
+            return [await limiter.check("10.0.0.1", "/api/files") for _ in range(15)]
+
+        results = asyncio.run(run())
+        assert sum(r.allowed for r in results) == 10
+        stats = tier.get_stats()
+        assert stats['redis_checks'] == 1
+        assert stats['local_rejections'] == 5
+
+    def test_lru_eviction_keeps_pending_deltas(self):
+        """Evicted clients still have their local deltas synced"""
+        limiter, tier = self.make_limiter(1000, max_entries=2)
+
+        async def run():
+            for _ in range(5):
+                await limiter.check("10.0.0.1", "/api/files")
+            for ip in ("10.0.0.2", "10.0.0.3"):
+                await limiter.check(ip, "/api/files")
+            await tier.flush()
+            return await self.redis.get("rate_limit:fixed_window:/api/files:10.0.0.1")
+
+        assert int(asyncio.run(run())) == 5
+        assert len(tier.entries) == 2
+        assert tier.get_stats()['evictions'] == 1
+
+    def test_deltas_survive_a_redis_outage(self):
+        """A flush while Redis is unavailable keeps the deltas for the next one"""
+        limiter, tier = self.make_limiter(1000, max_entries=1)
+
+        async def run():
+            for ip in ("10.0.0.1", "10.0.0.1", "10.0.0.2", "10.0.0.2"):
+                await limiter.check(ip, "/api/files")
+            redis_pool._redis_client = None
+            redis_pool._last_failure = float("inf")
+            try:
+                await tier.flush()
+            finally:
+                redis_pool._redis_client = self.redis
+                redis_pool._last_failure = 0.0
+            await tier.flush()
+            return [await self.redis.get(f"rate_limit:fixed_window:/api/files:{ip}")
+                    for ip in ("10.0.0.1", "10.0.0.2")]
+
+        assert [int(count) for count in asyncio.run(run())] == [2, 2]
+
+    def test_close_stops_sync_when_flush_swallows_cancellation(self):
+        """Shutdown does not hang if a flush eats the task's CancelledError"""
+        tier = LocalCounterTier(sync_interval_ms=10)
+        flushes = []
+
+        async def swallowing_flush():
+            flushes.append(1)
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                pass
+
+        tier.flush = swallowing_flush
+
+        async def run():
+            tier._start_sync_task()
+            while not flushes:
+                await asyncio.sleep(0.01)
+            await asyncio.wait_for(tier.close(), timeout=2)
+            return tier._sync_task.done()
+
+        assert asyncio.run(run())
@@ -0,0 +1,159 @@
+"""
+Tests for access token revocation
+"""
+
+import asyncio
+import time
+import httpx
+import pytest
+
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'ai-backend'))
+import main
+import revocation
+from main import app, users_db
+from revocation import REVOKED_KEY, BloomFilter, RevocationList
+
+fakeredis = pytest.importorskip("fakeredis")
+
+
+class TestBloomFilter:
+    """Test the per-worker membership filter"""
+
+    def test_no_false_negatives(self):
+        bloom = BloomFilter(1000)
+        for i in range(1000):
+            bloom.add(f"jti-{i}")
+        assert all(f"jti-{i}" in bloom for i in range(1000))
+
+    def test_false_positive_rate_near_target(self):
+        bloom = BloomFilter(10000, false_positive_rate=0.01)
+        for i in range(10000):
+            bloom.add(f"revoked-{i}")
+        false_positives = sum(f"valid-{i}" in bloom for i in range(20000))
+        assert false_positives / 20000 < 0.02
+
+
+class TestRevocationList:
+    """Test revocation across workers sharing one Redis"""
+
+    def setup_method(self):
+        self.server = fakeredis.FakeServer()
+
+    def make_worker(self, **kwargs):
+        worker = RevocationList(capacity=1000, **kwargs)
+        worker.redis = fakeredis.FakeAsyncRedis(server=self.server, decode_responses=True)
+        return worker
+
+    def test_unrevoked_tokens_make_no_redis_calls(self):
+        """Tokens missing from the filter are answered locally"""
+        worker = self.make_worker()
+        calls = []
+        original = worker.redis.zscore
+
+        async def counting(*args, **kwargs):
+            calls.append(args)
+            return await original(*args, **kwargs)
+        worker.redis.zscore = counting
+
+        async def scenario():
+            await worker.revoke("revoked", time.time() + 60)
+            return [await worker.is_revoked(f"valid-{i}") for i in range(1000)]
+
+        results = asyncio.run(scenario())
+        assert not any(results)
+        stats = worker.get_stats()
+        assert stats['bloom_negatives'] + stats['false_positives'] == 1000
+        assert len(calls) == stats['redis_checks'] == stats['false_positives']
+        assert stats['redis_checks'] <= 5
+
+    def test_revocation_reaches_other_workers(self):
+        """A logout on one worker is seen by a worker already running"""
+        revoker = self.make_worker()
+        follower = self.make_worker()
+
+        async def scenario():
+            await follower.start_listener()
+            await revoker.revoke("logged-out", time.time() + 60)
+            for _ in range(50):
+                if follower.get_stats()['notices_received']:
+                    break
+                await asyncio.sleep(0.02)
+            revoked = await follower.is_revoked("logged-out")
+            again = await follower.is_revoked("logged-out")
+            await follower.close()
+            return revoked, again
+
+        assert asyncio.run(scenario()) == (True, True)
+        stats = follower.get_stats()
+        assert stats['redis_checks'] == 1
+        assert stats['confirmed_hits'] == 1
+
+    def test_new_worker_loads_existing_revocations(self):
+        """A worker starting later builds its filter from the set, without expired entries"""
+        async def scenario():
+            now = time.time()
+            await self.make_worker().redis.zadd(REVOKED_KEY, {"expired": now - 1, "current": now + 60})
+            worker = self.make_worker()
+            await worker.start_listener()
+            result = (await worker.is_revoked("current"), await worker.is_revoked("expired"),
+                      await worker.redis.zrange(REVOKED_KEY, 0, -1))
+            await worker.close()
+            return result
+
+        current, expired, remaining = asyncio.run(scenario())
+        assert current is True
+        assert expired is False
+        assert remaining == ["current"]
+
+    def test_periodic_reload_sheds_expired_entries(self):
+        """Rebuilding drops jti whose tokens have expired from the filter"""
+        worker = self.make_worker()
+
+        async def scenario():
+            await worker.revoke("short-lived", time.time() + 0.05)
+            await asyncio.sleep(0.1)
+            await worker.reload()
+
+        asyncio.run(scenario())
+        assert "short-lived" not in worker.bloom
+        assert worker.get_stats()['bloom_items'] == 0
+
+
+class TestLogoutRevokesAccessToken:
+    """Test the logout endpoint against the revocation list"""
+
+    def setup_method(self):
+        users_db.users.clear()
+        revocation._revocation_list = RevocationList(capacity=1000)
+        revocation._revocation_list.redis = fakeredis.FakeAsyncRedis(decode_responses=True)
+
+    def teardown_method(self):
+        revocation._revocation_list = None
+        users_db.users.clear()
+
+    def test_logged_out_token_is_rejected(self):
+        """The logged-out token stops working; the user's other tokens do not"""
+        async def run():
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                register = await client.post("/auth/register", json={
+                    "username": "leaver", "email": "leaver@example.com", "password": "testpassword123"
+                })
+                login = await client.post("/auth/login", json={
+                    "username": "leaver", "password": "testpassword123"
+                })
+                first = {"Authorization": f"Bearer {register.json()['access_token']}"}
+                second = {"Authorization": f"Bearer {login.json()['access_token']}"}
+
+                logout = await client.post("/auth/logout", headers=first)
+                reused = await client.post("/auth/logout", headers=first)
+                other = await client.post("/auth/logout", headers=second)
+            await main.shutdown_event()
+            return logout, reused, other
+
+        logout, reused, other = asyncio.run(run())
+        assert logout.status_code == 200
+        assert reused.status_code == 401
+        assert other.status_code == 200
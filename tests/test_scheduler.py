@@ -0,0 +1,184 @@
+"""
+Tests for the upstream request scheduler
+"""
+
+import asyncio
+import time
+import pytest
+
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'ai-backend'))
+from connection_manager import AdaptiveConcurrencyLimiter, UpstreamOverloadedError
+from scheduler import PRIORITY_BULK, PRIORITY_INTERACTIVE, UpstreamScheduler, estimate_tokens
+
+
+class TestUpstreamScheduler:
+    """Test concurrency, priority and token budget admission"""
+
+    def test_concurrency_limit(self):
+        """No more than max_concurrency calls hold a slot at once"""
+        scheduler = UpstreamScheduler(max_concurrency=3)
+        in_flight, peak = 0, 0
+
+        async def call():
+            nonlocal in_flight, peak
+            async with scheduler.slot(PRIORITY_INTERACTIVE, 10):
+                in_flight += 1
+                peak = max(peak, in_flight)
+                await asyncio.sleep(0.01)
+                in_flight -= 1
+
+        async def scenario():
+            await asyncio.gather(*(call() for _ in range(12)))
+
+        asyncio.run(scenario())
+        assert peak == 3
+        assert scheduler.active == 0
+        assert scheduler.get_stats()["by_priority"]["interactive"]["requests"] == 12
+
+    def test_interactive_requests_jump_the_bulk_queue(self):
+        """Queued chat calls are dispatched before earlier queued generate calls"""
+        scheduler = UpstreamScheduler(max_concurrency=1)
+        order = []
+
+        async def call(name, priority):
+            async with scheduler.slot(priority, 10):
+                order.append(name)
+                await asyncio.sleep(0.01)
+
+        async def scenario():
+            blocker = asyncio.create_task(call("running", PRIORITY_BULK))
+            await asyncio.sleep(0)
+            queued = [asyncio.create_task(call("bulk-1", PRIORITY_BULK)),
+                      asyncio.create_task(call("bulk-2", PRIORITY_BULK))]
+            await asyncio.sleep(0)
+            queued.append(asyncio.create_task(call("chat", PRIORITY_INTERACTIVE)))
+            await asyncio.gather(blocker, *queued)
+
+        asyncio.run(scenario())
+        assert order == ["running", "chat", "bulk-1", "bulk-2"]
+
+    def test_tokens_per_minute_budget_delays_calls(self):
+        """Once the bucket is drained, calls wait for it to refill"""
+        scheduler = UpstreamScheduler(max_concurrency=10, tokens_per_minute=60000)  # 1000 per second
+
+        async def scenario():
+            async with scheduler.slot(PRIORITY_INTERACTIVE, 60000):
+                pass
+            start = time.monotonic()
+            async with scheduler.slot(PRIORITY_INTERACTIVE, 100):
+                pass
+            return time.monotonic() - start
+
+        waited = asyncio.run(scenario())
+        assert 0.08 <= waited < 1.0
+        assert scheduler.get_stats()["by_priority"]["interactive"]["max_queue_wait"] >= 0.08
+
+    def test_reported_usage_refunds_the_estimate(self):
+        """The budget is settled against actual usage when a call finishes"""
+        scheduler = UpstreamScheduler(tokens_per_minute=10000)
+
+        async def scenario():
+            async with scheduler.slot(PRIORITY_INTERACTIVE, 4000) as ticket:
+                during = scheduler.get_stats()["tokens_available"]
+                ticket.used_tokens = 500
+            return during, scheduler.get_stats()
+
+        during, stats = asyncio.run(scenario())
+        assert during <= 6001
+        assert stats["tokens_available"] >= 9499
+        assert stats["by_priority"]["interactive"]["tokens_charged"] == 500
+
+    def test_cancelled_waiters_do_not_leak_slots(self):
+        """A caller that gives up while queued is skipped"""
+        scheduler = UpstreamScheduler(max_concurrency=1)
+
+        async def scenario():
+            release = asyncio.Event()
+
+            async def holder():
+                async with scheduler.slot(PRIORITY_BULK, 10):
+                    await release.wait()
+
+            holding = asyncio.create_task(holder())
+            await asyncio.sleep(0)
+            with pytest.raises(asyncio.TimeoutError):
+                await asyncio.wait_for(scheduler.acquire(PRIORITY_INTERACTIVE, 10), timeout=0.05)
+            release.set()
+            await holding
+            async with scheduler.slot(PRIORITY_INTERACTIVE, 10):
+                return scheduler.active, scheduler.queued
+
+        assert asyncio.run(scenario()) == (1, 0)
+        assert scheduler.active == 0
+
+    def test_queue_wait_is_reported_apart_from_upstream_time(self):
+        """Stats separate time spent queued from time spent upstream"""
+        scheduler = UpstreamScheduler(max_concurrency=1)
+
+        async def call():
+            async with scheduler.slot(PRIORITY_BULK, 10):
+                await asyncio.sleep(0.05)
+
+        async def scenario():
+            await asyncio.gather(call(), call())
+
+        asyncio.run(scenario())
+        bulk = scheduler.get_stats()["by_priority"]["bulk"]
+        assert bulk["total_upstream_time"] >= 0.1
+        assert 0.04 <= bulk["max_queue_wait"] < bulk["total_upstream_time"]
+        assert bulk["average_queue_wait"] == pytest.approx(bulk["total_queue_wait"] / 2)
+
+    def test_full_queue_rejects_at_enqueue(self):
+        """Calls beyond max_queue waiters fail at once with a retry hint"""
+        scheduler = UpstreamScheduler(max_concurrency=2, max_queue=2)
+
+        async def call():
+            async with scheduler.slot(PRIORITY_INTERACTIVE, 10):
+                await asyncio.sleep(0.05)
+
+        async def scenario():
+            return await asyncio.gather(*(call() for _ in range(6)), return_exceptions=True)
+
+        outcomes = asyncio.run(scenario())
+        rejected = [o for o in outcomes if isinstance(o, UpstreamOverloadedError)]
+        assert outcomes.count(None) == 4
+        assert len(rejected) == 2
+        assert all(error.status_code == 503 and error.retry_after >= 1 for error in rejected)
+        stats = scheduler.get_stats()["by_priority"]["interactive"]
+        assert (stats["requests"], stats["rejected"]) == (4, 2)
+
+    def test_expected_wait_bound_follows_the_adaptive_limit(self):
+        """The wait estimate uses the limiter's current limit and smoothed round trip"""
+        limiter = AdaptiveConcurrencyLimiter(initial_limit=1, max_limit=10)
+        limiter.smoothed_rtt = 1.0
+        scheduler = UpstreamScheduler(max_concurrency=1, max_queue_wait=1.5, limiter_source=lambda: limiter)
+
+        async def scenario():
+            release = asyncio.Event()
+
+            async def holder():
+                async with scheduler.slot(PRIORITY_INTERACTIVE, 10):
+                    await release.wait()
+
+            holding = asyncio.create_task(holder())
+            await asyncio.sleep(0)
+            # One wave ahead: about one round trip, within the bound
+            queued = asyncio.create_task(scheduler.acquire(PRIORITY_INTERACTIVE, 10))
+            await asyncio.sleep(0)
+            with pytest.raises(UpstreamOverloadedError) as error:
+                await scheduler.acquire(PRIORITY_INTERACTIVE, 10)
+            release.set()
+            await holding
+            scheduler.release(await queued)
+            return error.value
+
+        error = asyncio.run(scenario())
+        assert error.retry_after == 2
+        assert scheduler.active == 0
+
+    def test_estimate_includes_prompt_and_completion(self):
+        """Estimates cover the prompt text plus the completion allowance"""
+        messages = [{"role": "system", "content": "x" * 400}, {"role": "user", "content": "y" * 40}]
+        assert estimate_tokens(messages, max_tokens=1000) == 100 + 10 + 8 + 1000
@@ -0,0 +1,183 @@
+"""
+Tests for per-session refresh tokens
+"""
+
+import asyncio
+import pytest
+from fastapi.testclient import TestClient
+
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'ai-backend'))
+import redis_pool
+import revocation
+import session_store
+from main import app, users_db
+from session_store import REUSED, ROTATED, UNKNOWN, SessionStore
+
+fakeredis = pytest.importorskip("fakeredis")
+
+
+class TestSessionStore:
+    """Test rotation, reuse detection and session limits"""
+
+    def setup_method(self):
+        self.redis = fakeredis.FakeAsyncRedis(decode_responses=True)
+        redis_pool._redis_client = self.redis
+        self.store = SessionStore(ttl_seconds=3600, max_sessions=3)
+
+    def teardown_method(self):
+        redis_pool._redis_client = None
+
+    def test_sessions_are_independent(self):
+        """A second login does not end the first; rotating one leaves the other"""
+        async def scenario():
+            await self.store.create("alice", "laptop", "jti-1")
+            await self.store.create("alice", "phone", "jti-2")
+            return (await self.store.rotate("alice", "laptop", "jti-1", "jti-3"),
+                    await self.store.rotate("alice", "phone", "jti-2", "jti-4"),
+                    await self.store.count("alice"))
+
+        assert asyncio.run(scenario()) == (ROTATED, ROTATED, 2)
+
+    def test_replayed_token_ends_the_session(self):
+        """Presenting a rotated-away token revokes the session for both holders"""
+        async def scenario():
+            await self.store.create("alice", "laptop", "jti-1")
+            await self.store.rotate("alice", "laptop", "jti-1", "jti-2")
+            replay = await self.store.rotate("alice", "laptop", "jti-1", "jti-x")
+            legitimate = await self.store.rotate("alice", "laptop", "jti-2", "jti-3")
+            return replay, legitimate
+
+        assert asyncio.run(scenario()) == (REUSED, UNKNOWN)
+        assert self.store.get_stats()['reuse_detected'] == 1
+
+    def test_revoke_one_and_all(self):
+        async def scenario():
+            for device in ("laptop", "phone", "tablet"):
+                await self.store.create("alice", device, f"jti-{device}")
+            await self.store.revoke("alice", "laptop")
+            after_one = await self.store.count("alice")
+            phone = await self.store.rotate("alice", "phone", "jti-phone", "jti-next")
+            await self.store.revoke_all("alice")
+            return after_one, phone, await self.store.count("alice")
+
+        assert asyncio.run(scenario()) == (2, ROTATED, 0)
+        assert self.store.get_stats()['revoked'] == 3
+
+    def test_oldest_sessions_are_dropped_past_the_limit(self):
+        """Logins beyond max_sessions evict expired, then the soonest to expire"""
+        async def scenario():
+            key = self.store._key("alice")
+            await self.redis.hset(key, "stale", "jti-0 1")
+            for i, device in enumerate(("a", "b", "c", "d")):
+                self.store.ttl_seconds = 3600 + i
+                await self.store.create("alice", device, f"jti-{device}")
+            return sorted(await self.redis.hkeys(key)), await self.redis.ttl(key)
+
+        sessions, ttl = asyncio.run(scenario())
+        assert sessions == ["b", "c", "d"]
+        assert 0 < ttl <= 3603
+        assert self.store.get_stats()['evicted'] == 2
+
+    def test_one_round_trip_regardless_of_session_count(self):
+        """Each operation is a single command, however many sessions the user has"""
+        commands = []
+        original = self.redis.execute_command
+
+        async def counting(*args, **kwargs):
+            commands.append(args[0])
+            return await original(*args, **kwargs)
+
+        async def scenario():
+            self.store.max_sessions = 1000
+            for i in range(200):
+                await self.store.create("alice", f"device{i}", f"jti-{i}")
+            # Load the scripts on this server first
+            await self.store.rotate("alice", "device0", "jti-0", "jti-0b")
+            self.redis.execute_command = counting
+            await self.store.create("alice", "new", "jti-new")
+            await self.store.rotate("alice", "new", "jti-new", "jti-newer")
+            await self.store.revoke("alice", "new")
+
+        asyncio.run(scenario())
+        assert commands == ["EVALSHA", "EVALSHA", "HDEL"]
+
+
+class TestRefreshEndpoint:
+    """Test the auth endpoints against the session store"""
+
+    def setup_method(self):
+        users_db.users.clear()
+        redis_pool._redis_client = fakeredis.FakeAsyncRedis(decode_responses=True)
+        session_store._session_store = None
+        revocation._revocation_list = None
+        self.client = TestClient(app)
+        self.client.post("/auth/register", json={
+            "username": "traveller", "email": "traveller@example.com", "password": "testpassword123"
+        })
+
+    def teardown_method(self):
+        session_store._session_store = None
+        revocation._revocation_list = None
+        redis_pool._redis_client = None
+        users_db.users.clear()
+
+    def login(self):
+        return self.client.post("/auth/login", json={
+            "username": "traveller", "password": "testpassword123"
+        }).json()
+
+    def refresh(self, token):
+        return self.client.post("/auth/refresh", params={"refresh_token": token})
+
+    def test_devices_refresh_independently(self):
+        """Logging in on a second device keeps the first signed in"""
+        laptop, phone = self.login(), self.login()
+
+        rotated = self.refresh(laptop["refresh_token"])
+        assert rotated.status_code == 200
+        assert rotated.json()["refresh_token"] != laptop["refresh_token"]
+        assert self.refresh(phone["refresh_token"]).status_code == 200
+
+    def test_reused_refresh_token_is_rejected(self):
+        """Replaying a rotated token fails and ends that session only"""
+        laptop, phone = self.login(), self.login()
+        rotated = self.refresh(laptop["refresh_token"]).json()
+
+        assert self.refresh(laptop["refresh_token"]).status_code == 401
+        assert self.refresh(rotated["refresh_token"]).status_code == 401
+        assert self.refresh(phone["refresh_token"]).status_code == 200
+
+    def test_logout_ends_the_current_session(self):
+        """Logout ends its own session; all_sessions ends every one"""
+        laptop, phone, tablet = self.login(), self.login(), self.login()
+        headers = {"Authorization": f"Bearer {laptop['access_token']}"}
+
+        assert self.client.post("/auth/logout", headers=headers).status_code == 200
+        assert self.refresh(laptop["refresh_token"]).status_code == 401
+        phone = self.refresh(phone["refresh_token"]).json()
+
+        headers = {"Authorization": f"Bearer {tablet['access_token']}"}
+        assert self.client.post("/auth/logout", params={"all_sessions": True}, headers=headers).status_code == 200
+        assert self.refresh(phone["refresh_token"]).status_code == 401
+        assert self.refresh(tablet["refresh_token"]).status_code == 401
+
+    def test_refresh_during_redis_outage_keeps_the_session(self):
+        """Without Redis the refresh token is handed back unrotated and still works afterwards"""
+        laptop = self.login()
+        redis = redis_pool._redis_client
+        redis_pool._redis_client = None
+        redis_pool._last_failure = float("inf")
+        try:
+            during = self.refresh(laptop["refresh_token"])
+        finally:
+            redis_pool._redis_client = redis
+            redis_pool._last_failure = 0.0
+
+        assert during.status_code == 200
+        assert during.json()["access_token"]
+        assert during.json()["refresh_token"] == laptop["refresh_token"]
+        rotated = self.refresh(during.json()["refresh_token"])
+        assert rotated.status_code == 200
+        assert self.refresh(rotated.json()["refresh_token"]).status_code == 200
@@ -0,0 +1,95 @@
+"""
+Tests for the verified access token cache
+"""
+
+import asyncio
+import time
+import pytest
+from fastapi import HTTPException
+from fastapi.security import HTTPAuthorizationCredentials
+
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'ai-backend'))
+import main
+from main import users_db, create_access_token, get_current_user
+from token_cache import TokenCache
+
+
+class TestTokenCache:
+    """Test LRU and expiry handling"""
+
+    def test_cached_claims_until_exp(self):
+        """A cached token is served until its exp claim passes"""
+        cache = TokenCache()
+        cache.put("token", {"sub": "alice", "exp": 1000})
+
+        assert cache.get("token", now=999) == {"sub": "alice", "exp": 1000}
+        assert cache.get("token", now=1000) is None
+        assert cache.get("token", now=999) is None
+        assert cache.get_stats()["expired"] == 1
+
+    def test_least_recently_used_is_evicted(self):
+        """The cache holds at most max_entries tokens"""
+        cache = TokenCache(max_entries=2)
+        exp = time.time() + 60
+        cache.put("a", {"exp": exp})
+        cache.put("b", {"exp": exp})
+        cache.get("a")
+        cache.put("c", {"exp": exp})
+
+        assert cache.get("b") is None
+        assert cache.get("a") is not None and cache.get("c") is not None
+        assert cache.get_stats()["evictions"] == 1
+
+    def test_tokens_are_not_stored_in_clear(self):
+        """Only digests are kept; tokens without exp are not cached"""
+        cache = TokenCache()
+        cache.put("secret-token", {"exp": time.time() + 60})
+        cache.put("no-exp", {"sub": "alice"})
+
+        assert len(cache.entries) == 1
+        assert all(b"secret-token" not in key for key in cache.entries)
+
+
+class TestGetCurrentUser:
+    """Test the cache in front of JWT verification"""
+
+    def setup_method(self):
+        users_db.users.clear()
+        asyncio.run(users_db.create_user({"username": "alice", "email": "alice@example.com", "is_active": True}))
+        main.token_cache = TokenCache()
+
+    def teardown_method(self):
+        users_db.users.clear()
+        main.token_cache = TokenCache(max_entries=main.SecurityConfig.TOKEN_CACHE_MAX_ENTRIES)
+
+    def authenticate(self, token):
+        return asyncio.run(get_current_user(HTTPAuthorizationCredentials(scheme="Bearer", credentials=token)))
+
+    def test_repeat_requests_skip_verification(self):
+        """The second request with a token is served from the cache"""
+        token = create_access_token({"sub": "alice"})
+
+        assert self.authenticate(token)["username"] == "alice"
+        assert self.authenticate(token)["username"] == "alice"
+        stats = main.token_cache.get_stats()
+        assert (stats["hits"], stats["misses"]) == (1, 1)
+
+    def test_user_lookup_still_happens(self):
+        """A deleted user is rejected even with a cached token"""
+        token = create_access_token({"sub": "alice"})
+        self.authenticate(token)
+        asyncio.run(users_db.delete_user("alice"))
+
+        with pytest.raises(HTTPException) as error:
+            self.authenticate(token)
+        assert error.value.status_code == 401
+
+    def test_invalid_tokens_are_not_cached(self):
+        """Refresh tokens and bad signatures are rejected every time"""
+        refresh = main.create_refresh_token({"sub": "alice"})
+        for token in (refresh, refresh, "not-a-jwt"):
+            with pytest.raises(HTTPException):
+                self.authenticate(token)
+        assert main.token_cache.get_stats()["entries"] == 0
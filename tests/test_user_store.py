@@ -0,0 +1,112 @@
+"""
+Tests for the SQLite user store
+"""
+
+import asyncio
+import os
+import tempfile
+
+import sys
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'ai-backend'))
+from user_store import MemoryUserStore, SQLiteUserStore
+
+ALICE = {"username": "alice", "email": "alice@example.com", "hashed_password": "hash",
+         "is_active": True, "created_at": "2024-01-01T00:00:00"}
+
+
+class TestSQLiteUserStore:
+    """Test persistence, sharing between workers and the read-through cache"""
+
+    def setup_method(self):
+        self.path = os.path.join(tempfile.mkdtemp(), "users.db")
+        self.store = SQLiteUserStore(self.path)
+
+    def teardown_method(self):
+        self.store.close()
+
+    def test_users_survive_a_restart(self):
+        """A new store on the same file sees earlier registrations"""
+        assert asyncio.run(self.store.create_user(ALICE))
+        self.store.close()
+
+        restarted = SQLiteUserStore(self.path)
+        try:
+            assert asyncio.run(restarted.get_user("alice")) == ALICE
+        finally:
+            restarted.close()
+
+    def test_duplicate_usernames_are_rejected(self):
+        """create_user reports a taken username instead of overwriting it"""
+        async def scenario():
+            first = await self.store.create_user(ALICE)
+            second = await self.store.create_user({**ALICE, "email": "other@example.com"})
+            return first, second, await self.store.get_user("alice")
+
+        first, second, user = asyncio.run(scenario())
+        assert (first, second) == (True, False)
+        assert user["email"] == "alice@example.com"
+
+    def test_workers_share_registrations(self):
+        """A user registered through one worker's store can log in through another's"""
+        other_worker = SQLiteUserStore(self.path)
+
+        async def scenario():
+            missing = await other_worker.get_user("alice")
+            await self.store.create_user(ALICE)
+            return missing, await other_worker.get_user("alice")
+
+        try:
+            missing, found = asyncio.run(scenario())
+        finally:
+            other_worker.close()
+        assert missing is None
+        assert found == ALICE
+
+    def test_lookups_are_served_from_the_cache(self):
+        """Repeat lookups skip the database"""
+        async def scenario():
+            await self.store.create_user(ALICE)
+            for _ in range(5):
+                await self.store.get_user("alice")
+
+        asyncio.run(scenario())
+        stats = self.store.get_stats()
+        assert stats["queries"] == 1
+        assert stats["cache_hits"] == 5
+
+    def test_database_setup(self):
+        """WAL journaling, and email lookups use the index"""
+        conn = self.store._connection()
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        plan = " ".join(str(row) for row in conn.execute(
+            "EXPLAIN QUERY PLAN " + self.store.SELECT_BY_EMAIL, ("alice@example.com",)))
+        assert "users_email" in plan
+
+        asyncio.run(self.store.create_user(ALICE))
+        assert asyncio.run(self.store.get_user_by_email("alice@example.com"))["username"] == "alice"
+
+    def test_delete_user(self):
+        """Deleted users are gone from the database and the cache"""
+        async def scenario():
+            await self.store.create_user(ALICE)
+            await self.store.get_user("alice")
+            return (await self.store.delete_user("alice"), await self.store.delete_user("alice"),
+                    await self.store.get_user("alice"))
+
+        assert asyncio.run(scenario()) == (True, False, None)
+
+
+class TestMemoryUserStore:
+    """Test the in-memory backend against the same interface"""
+
+    def test_create_and_get(self):
+        store = MemoryUserStore()
+
+        async def scenario():
+            created = await store.create_user(ALICE)
+            duplicate = await store.create_user(ALICE)
+            return created, duplicate, await store.get_user_by_email("alice@example.com")
+
+        created, duplicate, user = asyncio.run(scenario())
+        assert (created, duplicate) == (True, False)
+        assert user == ALICE